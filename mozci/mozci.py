@@ -8,31 +8,106 @@ In here, you will also find high level functions that will do various low level
 interactions with distinct modules to meet your needs."""
 from __future__ import absolute_import
 
+import fnmatch
+import itertools
 import json
 import logging
-
-from mozci.platforms import determine_upstream_builder
+import re
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+from mozci.platforms import (
+    determine_upstream_builder,
+    determine_upstream_builders,
+    match_repo_name,
+)
 from mozci.sources import allthethings, buildapi, buildjson, pushlog
-from mozci.utils.misc import _all_urls_reachable
+from mozci.utils import memo, transport
+from mozci.utils.misc import ThreadLogBuffer, _all_urls_reachable
 
 LOG = logging.getLogger()
 
 
-def _matching_jobs(buildername, all_jobs):
+def _matching_jobs(buildername, schedule):
     '''
-    It returns all jobs that matched the criteria.
+    It returns all jobs of the JobSchedule schedule that matched the criteria.
     '''
-    LOG.debug("Find jobs matching '%s'" % buildername)
-    matching_jobs = []
-    for j in all_jobs:
-        if j["buildername"] == buildername:
-            matching_jobs.append(j)
-
+    matching_jobs = schedule.jobs_of(buildername)
     LOG.info("We have found %d job(s) of '%s'." %
              (len(matching_jobs), buildername))
     return matching_jobs
 
 
+def _build_job_to_use(matching_jobs):
+    '''
+    Pick among the jobs of a build the one whose files we can use (the first
+    successful one) or which we wait for (the first running one).
+
+    It returns a tuple (successful_job, running_job); at most one is set.
+    '''
+    for job in matching_jobs:
+        status = job.get("status")
+        if status is None:
+            # XXX: If we break, we mean that we wait for this job and ignore
+            # what status other jobs might be in
+            return None, job
+        elif status == 0:
+            return job, None
+    return None, None
+
+
+def _determine_build_objective(build_buildername, schedule, job_data=None):
+    '''
+    Determine if we need to trigger the build job build_buildername in order
+    to trigger its test jobs, given the JobSchedule of the revision.
+
+    job_data can map request_ids to their buildjson data (see _find_files).
+
+    trigger_build:  Whether we need to trigger the build job
+    files:          Files of a successful build we can pass to its test jobs;
+                    None if there is no such build (yet)
+    '''
+    # Let's only look at jobs that match such build_buildername
+    matching_jobs = _matching_jobs(build_buildername, schedule)
+
+    if len(matching_jobs) == 0:
+        # We need to simply trigger a build job
+        LOG.debug("We need to trigger %s" % build_buildername)
+        return True, None
+
+    # We know there is at least one build job in some state
+    # We need to determine if we need to trigger a build job
+    # or the test job
+    LOG.debug("List of matching jobs:")
+    for job in matching_jobs:
+        LOG.debug(job)
+    successful_job, running_job = _build_job_to_use(matching_jobs)
+
+    if successful_job:
+        # A build job has completed successfully
+        # If the files are still around on FTP we can then trigger
+        # the test job, otherwise, we need to trigger the build.
+        LOG.info("There is a job that has completed successfully.")
+        LOG.debug(str(successful_job))
+        files = _find_files(successful_job, job_data)
+        if not _all_urls_reachable(files):
+            LOG.debug("The files are not around on Ftp anymore:")
+            LOG.debug(files)
+            return True, []
+        # We have the files needed to trigger the test job
+        return False, files
+    elif running_job:
+        # NOTE: Note that a build might have not finished yet
+        # the installer and test.zip might already have been uploaded
+        # For now, we will ignore this situation but need to take note of it
+        LOG.info("We are waiting for a build to finish.")
+        LOG.debug(str(running_job))
+        return False, None
+    else:
+        LOG.info("We are going to trigger %s." % build_buildername)
+        return True, None
+
+
 def _determine_trigger_objective(repo_name, revision, buildername):
     '''
     Determine if we need to trigger any jobs and which job.
@@ -40,82 +115,43 @@ def _determine_trigger_objective(repo_name, revision, buildername):
     trigger:  The name of the builder we need to trigger
     files:    Files needed for such builder
     '''
-    trigger = None
-    files = None
-
     # Let's figure out the associated build job
     # XXX: We have to handle the case when we query a build job
     build_buildername = determine_upstream_builder(buildername, repo_name)
     assert valid_builder(build_buildername), \
         "Our platforms mapping system has failed."
     # Let's figure out which jobs are associated to such revision
-    all_jobs = query_jobs(repo_name, revision)
-    # Let's only look at jobs that match such build_buildername
-    matching_jobs = _matching_jobs(build_buildername, all_jobs)
-
-    if len(matching_jobs) == 0:
-        # We need to simply trigger a build job
-        LOG.debug("We might trigger %s instead of %s" %
-                  (build_buildername, buildername))
-        trigger = build_buildername
+    schedule = query_job_schedule(repo_name, revision)
+
+    trigger_build, files = _determine_build_objective(build_buildername, schedule)
+    if trigger_build:
+        LOG.debug("We trigger %s instead of %s" % (build_buildername, buildername))
+        return build_buildername, files
+    elif files is None:
+        # We are waiting for the build job
+        return None, None
     else:
-        # We know there is at least one build job in some state
-        # We need to determine if we need to trigger a build job
-        # or the test job
-        successful_job = None
-        running_job = None
-
-        LOG.debug("List of matching jobs:")
-        for job in matching_jobs:
-            LOG.debug(job)
-            status = job.get("status")
-            if status is None:
-                LOG.debug("We found a running job. We don't search anymore.")
-                running_job = job
-                # XXX: If we break, we mean that we wait for this job and ignore
-                # what status other jobs might be in
-                break
-            elif status == 0:
-                LOG.debug("We found a successful job. We don't search anymore.")
-                successful_job = job
-                break
-            else:
-                LOG.debug("We found a job that finished but its status "
-                          "is not successful.")
-
-        if successful_job:
-            # A build job has completed successfully
-            # If the files are still around on FTP we can then trigger
-            # the test job, otherwise, we need to trigger the build.
-            LOG.info("There is a job that has completed successfully.")
-            LOG.debug(str(successful_job))
-            files = _find_files(successful_job)
-            if not _all_urls_reachable(files):
-                LOG.debug("The files are not around on Ftp anymore:")
-                LOG.debug(files)
-                trigger = build_buildername
-                files = []
-            else:
-                # We have the files needed to trigger the test job
-                trigger = buildername
-        elif running_job:
-            # NOTE: Note that a build might have not finished yet
-            # the installer and test.zip might already have been uploaded
-            # For now, we will ignore this situation but need to take note of it
-            LOG.info("We are waiting for a build to finish.")
-            LOG.debug(str(running_job))
-            trigger = None
-        else:
-            LOG.info("We are going to trigger %s instead of %s" %
-                     (build_buildername, buildername))
-            trigger = build_buildername
+        return buildername, files
+
 
-    return trigger, files
+def _count_jobs(buildername, schedule):
+    ''' Count the pending, running and successful jobs of buildername. '''
+    counts = {
+        "pending": schedule.count(buildername, buildapi.PENDING),
+        "running": schedule.count(buildername, buildapi.RUNNING),
+        "successful": schedule.count(buildername, buildapi.SUCCESS),
+    }
+    LOG.debug("We found %d pending jobs, %d running jobs and %d successful_jobs." %
+              (counts["pending"], counts["running"], counts["successful"]))
+    return counts
 
 
-def _find_files(scheduled_job_info):
+def _find_files(scheduled_job_info, job_data=None):
     '''
     This function helps us find the files needed to trigger a job.
+
+    job_data can map request_ids to their buildjson data (as returned by
+    buildjson.query_jobs_data); we only query buildjson if it is missing.
     '''
     files = []
 
@@ -123,8 +159,10 @@ def _find_files(scheduled_job_info):
     complete_at = scheduled_job_info["requests"][0]["complete_at"]
     request_id = scheduled_job_info["requests"][0]["request_id"]
 
-    # NOTE: This call can take a bit of time
-    job_status = buildjson.query_job_data(complete_at, request_id)
+    job_status = (job_data or {}).get(request_id)
+    if job_status is None:
+        # NOTE: This call can take a bit of time
+        job_status = buildjson.query_job_data(complete_at, request_id)
     assert job_status is not None, \
         "We should not have received an empty status"
 
@@ -157,6 +195,14 @@ def query_jobs(repo_name, revision):
     return buildapi.query_jobs_schedule(repo_name, revision)
 
 
+def query_job_schedule(repo_name, revision):
+    '''
+    Return the jobs of a revision as a buildapi.JobSchedule (indexed by
+    buildername).
+    '''
+    return buildapi.query_job_schedule(repo_name, revision)
+
+
 def query_jobs_schedule_url(repo_name, revision):
     ''' Returns url of where a developer can login to see the
         scheduled jobs for a revision.
@@ -167,17 +213,14 @@ def query_jobs_schedule_url(repo_name, revision):
 def query_repo_name_from_buildername(buildername, clobber=False):
     ''' Returns the repository name from a given buildername.
     '''
-    repositories = buildapi.query_repositories(clobber)
-    ret_val = None
-    for repo_name in repositories:
-        if repo_name in buildername:
-            ret_val = repo_name
-            break
+    if clobber:
+        buildapi.query_repositories(clobber=True)
+    ret_val = match_repo_name(buildername)
 
     if ret_val is None and not clobber:
         # Since repositories file is cached, it can be that something has changed.
         # Adding clobber=True will make it overwrite the cached version with latest one.
-        query_repo_name_from_buildername(buildername, clobber=True)
+        return query_repo_name_from_buildername(buildername, clobber=True)
 
     if ret_val is None:
         raise Exception("Repository name not found in buildername. "
@@ -192,6 +235,21 @@ def query_builders():
     return allthethings.list_builders()
 
 
+def query_builders_matching(pattern, regex=False):
+    ''' Returns the sorted list of builders whose name matches pattern.
+
+    pattern is a shell style wildcard (e.g. "Ubuntu VM 12.04 fx-team opt test
+    mochitest-*") or, if regex is True, a regular expression searched for in
+    the names.
+    '''
+    if regex:
+        match = re.compile(pattern).search
+    else:
+        # A wildcard has to match the whole name
+        match = re.compile(fnmatch.translate(pattern)).match
+    return sorted(b for b in query_builders() if match(b))
+
+
 def query_repositories():
     ''' Returns all information about the repositories we have.
     '''
@@ -228,8 +286,7 @@ def valid_builder(buildername):
     ''' This function determines if the builder you're trying to trigger is
     valid.
     '''
-    builders = query_builders()
-    if buildername in builders:
+    if allthethings.valid_builder(buildername):
         LOG.debug("Buildername %s is valid." % buildername)
         return True
     else:
@@ -237,7 +294,7 @@ def valid_builder(buildername):
         LOG.info("Check the file we just created builders.txt for "
                  "a list of valid builders.")
         with open("builders.txt", "wb") as fd:
-            for b in sorted(builders):
+            for b in sorted(query_builders()):
                 fd.write(b + "\n")
 
         return False
@@ -246,11 +303,11 @@ def valid_builder(buildername):
 #
 # Trigger functionality
 #
+@memo.in_run_scope
 def trigger_job(repo_name, revision, buildername, times=1, files=None, dry_run=False):
     ''' This function triggers a job through self-serve.
     We return a list of all requests made.'''
     trigger = None
-    list_of_requests = []
     LOG.info("We want to trigger '%s' on revision '%s' a total of %d time(s)." %
              (buildername, revision, times))
 
@@ -276,6 +333,21 @@ def trigger_job(repo_name, revision, buildername, times=1, files=None, dry_run=F
             buildername,
         )
 
+    return _trigger(repo_name, revision, trigger, files, times, dry_run)
+
+
+def async_trigger_job(repo_name, revision, buildername, times=1, files=None,
+                      dry_run=False, callback=None):
+    ''' Non-blocking trigger_job; see mozci.utils.transport.submit.
+    The AsyncResult's value is the list of requests made.'''
+    return transport.submit(trigger_job, repo_name, revision, buildername,
+                            times, files, dry_run, callback=callback)
+
+
+def _trigger(repo_name, revision, trigger, files, times, dry_run):
+    ''' Post "times" requests to self-serve to schedule the builder "trigger".
+    We return a list of all requests made.'''
+    list_of_requests = []
     if trigger:
         payload = {}
         # These propertie are needed for Treeherder to display running jobs
@@ -295,8 +367,9 @@ def trigger_job(repo_name, revision, buildername, times=1, files=None, dry_run=F
         )
 
         if not dry_run:
-            for _ in range(times):
-                list_of_requests.append(buildapi.make_request(url, payload))
+            list_of_requests = buildapi.make_requests(url, payload, times)
+            # The jobs schedule of this revision is now out of date
+            buildapi.invalidate_jobs_schedule(repo_name, revision)
         else:
             # We could use HTTPPretty to mock an HTTP response
             # https://github.com/gabrielfalcao/HTTPretty
@@ -310,59 +383,441 @@ def trigger_job(repo_name, revision, buildername, times=1, files=None, dry_run=F
     return list_of_requests
 
 
-def trigger_range(buildername, repo_name, revisions, times, dry_run=False):
+def _revision_result(revision, buildername):
+    ''' The per revision result described in trigger_range. '''
+    return {
+        "revision": revision,
+        "buildername": buildername,
+        "pending": 0,
+        "running": 0,
+        "successful": 0,
+        "missing": 0,
+        "trigger": None,
+        "files": None,
+        "requests": [],
+        "skipped": None,
+        "error": None,
+    }
+
+
+def _plan_revision(buildernames, repo_name, revision, times, job_data=None,
+                   prefetch_records=None):
+    '''
+    Determine what we need to trigger on a revision to have "times" jobs of
+    every builder of buildernames. It returns the result dictionaries
+    described in trigger_range (one per buildername) and the triggers
+    described in plan_triggers.
+    '''
+    LOG.info("We want to have %s job(s) of %s on revision %s" %
+             (times, ", ".join(buildernames), revision))
+    triggers = OrderedDict()
+    statuses = _plan_revision_goals(repo_name, revision,
+                                    [(b, times) for b in buildernames], triggers, job_data,
+                                    prefetch_records)
+
+    results = []
+    for status in statuses:
+        result = _revision_result(revision, status["buildername"])
+        for key in ("pending", "running", "successful", "missing", "trigger"):
+            result[key] = status[key]
+        if status["status"] == "skipped":
+            result["skipped"] = status["reason"]
+        if status["trigger"]:
+            result["files"] = triggers[(revision, status["trigger"])]["files"]
+        if status["status"] == "error":
+            result["error"] = "We could not determine the build job of %s" % \
+                status["buildername"]
+        results.append(result)
+
+    return results, triggers.values()
+
+
+def _plan_revision_safely(args):
+    ''' Run _plan_revision capturing its exception and its log records. '''
+    log_buffer, buildernames, repo_name, revision, times, job_data, prefetch_records = args
+    with log_buffer.capture() as records:
+        try:
+            results, triggers = _plan_revision(buildernames, repo_name, revision, times,
+                                               job_data, prefetch_records)
+        except Exception, e:
+            LOG.exception(e)
+            results = [_revision_result(revision, b) for b in buildernames]
+            for result in results:
+                result["error"] = str(e) or e.__class__.__name__
+            triggers = []
+    return results, triggers, records
+
+
+@memo.in_run_scope
+def trigger_range(buildername, repo_name, revisions, times, dry_run=False, jobs=1):
     '''
     Schedule the job named "buildername" ("times" times) from "start_revision" to
     "end_revision".
+
+    buildername can also be a list of buildernames. The job schedule of every
+    revision is then fetched once for all of them, and builders which need
+    the same build job share a single trigger of it.
+
+    With jobs > 1 we determine what to trigger on up to "jobs" revisions
+    concurrently; the log output is still grouped and ordered by revision.
+    The requests to self-serve are made in revision order.
+
+    It returns a list with a dictionary per revision and buildername:
+
+    .. code-block:: python
+
+        {
+            "revision": string,
+            "buildername": string,
+            "pending": int,      # Number of pending jobs found
+            "running": int,      # Number of running jobs found
+            "successful": int,   # Number of successful jobs found
+            "missing": int,      # Number of jobs we still need
+            "trigger": string,   # Builder we (would) trigger or None
+            "files": list,       # Files passed to the triggered builder
+            "requests": list,    # Requests made to self-serve; the requests
+                                 # of a shared trigger are listed once
+            "skipped": string,   # Why we left the revision alone or None
+            "error": string,     # Why we could not process the revision or None
+        }
     '''
+    if isinstance(buildername, basestring):
+        buildernames = [buildername]
+    else:
+        # Drop duplicates but keep the order
+        buildernames = list(OrderedDict.fromkeys(buildername))
+
     LOG.info("We want to have %s job(s) of %s on revisions %s" %
-             (times, buildername, str(revisions)))
-    for rev in revisions:
-        LOG.info("")
-        LOG.info("=== %s ===" % rev)
-        LOG.info("We want to have %s job(s) of %s on revision %s" %
-                 (times, buildername, rev))
-
-        # 1) How many potentially completed jobs can we get for this buildername?
-        jobs = query_jobs(repo_name, rev)
-        matching_jobs = _matching_jobs(buildername, jobs)
-        successful_jobs = 0
-        pending_jobs = 0
-        running_jobs = 0
-
-        for job in matching_jobs:
-            status = buildapi.query_job_status(job)
-            if status == buildapi.PENDING:
-                pending_jobs += 1
-            if status == buildapi.RUNNING:
-                running_jobs += 1
-            if status == buildapi.SUCCESS:
-                successful_jobs += 1
-
-        potential_jobs = pending_jobs + running_jobs + successful_jobs
-        LOG.debug("We found %d pending jobs, %d running jobs and %d successful_jobs." %
-                  (pending_jobs, running_jobs, successful_jobs))
+             (times, ", ".join(buildernames), str(revisions)))
 
+    invalid_builders = [b for b in buildernames if not valid_builder(b)]
+    if invalid_builders:
+        LOG.error("The builders %s requested are invalid" % ", ".join(invalid_builders))
+        # XXX How should we exit cleanly?
+        exit(-1)
+
+    results = []
+    with ThreadLogBuffer() as log_buffer:
+        pool = ThreadPool(min(jobs, len(revisions)) or 1) if jobs > 1 else None
+        try:
+            # Look up the build jobs of all revisions in buildjson at once
+            goals = [(b, times) for b in buildernames]
+            job_data, prefetch_records = _prefetch_job_data(
+                repo_name, [(rev, goals) for rev in revisions], log_buffer, pool)
+            work = [(log_buffer, buildernames, repo_name, rev, times, job_data,
+                     prefetch_records[rev]) for rev in revisions]
+            if pool is not None:
+                planned = pool.imap(memo.bind(_plan_revision_safely), work)
+            else:
+                planned = itertools.imap(_plan_revision_safely, work)
+
+            # imap hands us the results in the order of the revisions
+            for revision_results, triggers, records in planned:
+                log_buffer.replay(records)
+                results_by_builder = dict((r["buildername"], r) for r in revision_results)
+                for trigger in triggers:
+                    list_of_requests = _trigger(repo_name, trigger["revision"],
+                                                trigger["buildername"], trigger["files"],
+                                                trigger["times"], dry_run)
+                    results_by_builder[trigger["goals"][0]]["requests"] = list_of_requests
+                    if any(req.status_code != 202 for req in list_of_requests):
+                        LOG.warning("Not all requests succeeded.")
+                if not triggers and not any(r["error"] for r in revision_results):
+                    LOG.debug("Nothing needs to be triggered")
+                results.extend(revision_results)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    # TODO:
+    # 3) Once we trigger a build job, we have to monitor it to make sure that it finishes;
+    #    at that point we have to trigger as many test jobs as we originally intended
+    #    If a build job does not finish, we have to notify the user... what should it then
+    #    happen?
+    return results
+
+
+def async_trigger_range(buildername, repo_name, revisions, times, dry_run=False,
+                        jobs=1, callback=None):
+    ''' Non-blocking trigger_range; see mozci.utils.transport.submit.
+    The AsyncResult's value is the list of per revision results.'''
+    return transport.submit(trigger_range, buildername, repo_name, revisions,
+                            times, dry_run, jobs, callback=callback)
+
+
+#
+# Planning functionality
+#
+def _goal_status(buildername, revision, times):
+    ''' The per goal status described in plan_triggers. '''
+    return {
+        "buildername": buildername,
+        "revision": revision,
+        "times": times,
+        "pending": 0,
+        "running": 0,
+        "successful": 0,
+        "missing": 0,
+        "trigger": None,
+        "status": None,
+        "reason": None,
+    }
+
+
+def _build_lookups(repo_name, revision, goals):
+    '''
+    Return the (complete_at, request_id) of the successful build jobs of
+    revision whose files we will need to satisfy goals, a list of
+    (buildername, times).
+    '''
+    if not buildapi.valid_revision(repo_name, revision):
+        return []
+
+    schedule = query_job_schedule(repo_name, revision)
+    upstream = determine_upstream_builders(set(b for b, _ in goals), repo_name)
+    lookups = set()
+    for buildername, times in goals:
+        build_buildername = upstream[buildername]
+        if build_buildername in (None, buildername):
+            continue
+        potential_jobs = schedule.count(buildername, buildapi.PENDING,
+                                        buildapi.RUNNING, buildapi.SUCCESS)
         if potential_jobs >= times:
+            continue
+        successful_job, _ = _build_job_to_use(schedule.jobs_of(build_buildername))
+        if successful_job is not None:
+            request = successful_job["requests"][0]
+            lookups.add((request["complete_at"], request["request_id"]))
+    return sorted(lookups)
+
+
+def _prefetch_job_data(repo_name, goals_per_revision, log_buffer, pool=None):
+    '''
+    Query buildjson at once about the build jobs whose files we will need
+    while planning goals_per_revision, a list of (revision, goals) tuples.
+    The job schedules are fetched with pool if given.
+
+    It returns a dictionary for _find_files and the log records of every
+    revision, captured with log_buffer so that the planning of the revision
+    can log them in its own section. If anything goes wrong the dictionary
+    is incomplete and the planning queries buildjson job by job.
+    '''
+    def lookups_of(args):
+        revision, goals = args
+        with log_buffer.capture() as records:
+            try:
+                lookups = _build_lookups(repo_name, revision, goals)
+            except Exception, e:
+                # Planning the revision will report it
+                LOG.debug("We could not look at the build jobs of %s: %s" % (revision, e))
+                lookups = []
+        return lookups, records
+
+    map_function = pool.map if pool is not None else map
+    lookups = []
+    records = {}
+    for (revision, _), (revision_lookups, revision_records) in zip(
+            goals_per_revision, map_function(memo.bind(lookups_of), goals_per_revision)):
+        lookups.extend(revision_lookups)
+        records[revision] = revision_records
+    if not lookups:
+        return {}, records
+
+    LOG.debug("Querying buildjson about %d build job(s)" % len(lookups))
+    try:
+        return buildjson.query_jobs_data(lookups), records
+    except Exception, e:
+        LOG.warning("We could not query buildjson about the build jobs: %s" % e)
+        return {}, records
+
+
+def _plan_revision_goals(repo_name, revision, goals, triggers, job_data=None,
+                         prefetch_records=None):
+    '''
+    Determine what to trigger on revision to satisfy goals, a list of
+    (buildername, times). Triggers are merged into the triggers dictionary
+    (keyed by (revision, buildername)). It returns the status of every goal.
+
+    job_data can map request_ids to their buildjson data (see _find_files)
+    and prefetch_records are the log records of the revision captured by
+    _prefetch_job_data; they are logged in the section of the revision.
+    '''
+    LOG.info("")
+    LOG.info("=== %s ===" % revision)
+    if prefetch_records:
+        ThreadLogBuffer.relog(prefetch_records)
+    statuses = [_goal_status(buildername, revision, times) for buildername, times in goals]
+
+    if not buildapi.valid_revision(repo_name, revision):
+        for status in statuses:
+            status["status"] = "skipped"
+            status["reason"] = "The revision does not exist in self-serve (DONTBUILD)"
+        return statuses
+
+    schedule = query_job_schedule(repo_name, revision)
+    upstream = determine_upstream_builders(set(b for b, _ in goals), repo_name)
+    # Every build job is only looked at once per revision
+    build_objectives = {}
+
+    def add_trigger(buildername, times, files, goal):
+        trigger = triggers.get((revision, buildername))
+        if trigger is None:
+            trigger = triggers[(revision, buildername)] = {
+                "revision": revision,
+                "buildername": buildername,
+                "times": 0,
+                "files": files or None,
+                "goals": [],
+            }
+        # Every run of a build job triggers all its test jobs, so we only
+        # need as many as the most demanding goal
+        trigger["times"] = max(trigger["times"], times)
+        if goal not in trigger["goals"]:
+            trigger["goals"].append(goal)
+
+    for status in statuses:
+        buildername = status["buildername"]
+        status.update(_count_jobs(buildername, schedule))
+        potential_jobs = status["pending"] + status["running"] + status["successful"]
+        status["missing"] = max(0, status["times"] - potential_jobs)
+        if not status["missing"]:
             LOG.info("We have %d job(s) for '%s' which is enough for the %d job(s) we want." %
-                     (potential_jobs, buildername, times))
+                     (potential_jobs, buildername, status["times"]))
+            status["status"] = "satisfied"
+            continue
+
+        LOG.info("We want to trigger '%s' on revision '%s' a total of %d time(s)." %
+                 (buildername, revision, status["missing"]))
+
+        build_buildername = upstream[buildername]
+        files = None
+        if build_buildername is None:
+            status["status"] = "error"
+            continue
+
+        if build_buildername == buildername:
+            status["trigger"] = buildername
         else:
-            # 2) If we have less potential jobs than 'times' instances then
-            #    we need to fill it in.
-            LOG.debug("We have found %d job(s) matching '%s' on %s. We need to trigger more." %
-                      (potential_jobs, buildername, rev))
-            list_of_requests = \
-                trigger_job(
-                    repo_name,
-                    rev,
-                    buildername,
-                    times=times-potential_jobs,
-                    dry_run=dry_run)
-            if list_of_requests and any(req.status_code != 202 for req in list_of_requests):
-                LOG.warning("Not all requests succeeded.")
-
-        # TODO:
-        # 3) Once we trigger a build job, we have to monitor it to make sure that it finishes;
-        #    at that point we have to trigger as many test jobs as we originally intended
-        #    If a build job does not finish, we have to notify the user... what should it then
-        #    happen?
+            if build_buildername not in build_objectives:
+                build_objectives[build_buildername] = \
+                    _determine_build_objective(build_buildername, schedule, job_data)
+            trigger_build, files = build_objectives[build_buildername]
+            if trigger_build:
+                status["trigger"] = build_buildername
+                files = None
+            elif files is None:
+                status["status"] = "waiting"
+                continue
+            else:
+                status["trigger"] = buildername
+
+        status["status"] = "triggered"
+        add_trigger(status["trigger"], status["missing"], files, buildername)
+
+    return statuses
+
+
+@memo.in_run_scope
+def plan_triggers(repo_name, goals):
+    '''
+    Determine the minimal set of jobs we need to trigger to have, for every
+    (buildername, revision, times) of goals, "times" jobs of buildername on
+    revision.
+
+    The schedule of every revision is fetched once, and goals whose test
+    jobs need the same build job share a single build trigger.
+
+    It returns a plan made of JSON serializable types which can be shown
+    with format_plan() and triggered with execute_plan():
+
+    .. code-block:: python
+
+        {
+            "repo_name": string,
+            "triggers": [
+                {
+                    "revision": string,
+                    "buildername": string,  # Builder to trigger
+                    "times": int,           # Number of times to trigger it
+                    "files": list,          # Files passed to the builder or None
+                    "goals": list,          # Buildernames this trigger is for
+                },
+            ],
+            "goals": [
+                {
+                    "buildername": string,
+                    "revision": string,
+                    "times": int,
+                    "pending": int,      # Number of pending jobs found
+                    "running": int,      # Number of running jobs found
+                    "successful": int,   # Number of successful jobs found
+                    "missing": int,      # Number of jobs we still need
+                    "trigger": string,   # Builder triggered for this goal or None
+                    "status": string,    # satisfied, triggered, waiting, skipped or error
+                    "reason": string,    # Why the goal was skipped or None
+                },
+            ],
+        }
+    '''
+    goals_per_revision = OrderedDict()
+    invalid_builders = set()
+    for buildername, revision, times in goals:
+        if buildername not in invalid_builders and not valid_builder(buildername):
+            LOG.error("The builder %s requested is invalid" % buildername)
+            invalid_builders.add(buildername)
+        goals_per_revision.setdefault(revision, []).append((buildername, times))
+
+    valid_goals_per_revision = [
+        (revision, [g for g in revision_goals if g[0] not in invalid_builders])
+        for revision, revision_goals in goals_per_revision.iteritems()]
+    triggers = OrderedDict()
+    statuses = []
+    with ThreadLogBuffer() as log_buffer:
+        job_data, prefetch_records = _prefetch_job_data(repo_name, valid_goals_per_revision,
+                                                        log_buffer)
+    for revision, valid_goals in valid_goals_per_revision:
+        revision_goals = goals_per_revision[revision]
+        revision_statuses = dict(
+            ((s["buildername"], s["times"]), s) for s in
+            _plan_revision_goals(repo_name, revision, valid_goals, triggers, job_data,
+                                 prefetch_records[revision]))
+        for buildername, times in revision_goals:
+            status = revision_statuses.get((buildername, times))
+            if status is None:
+                status = _goal_status(buildername, revision, times)
+                status["status"] = "error"
+            statuses.append(status)
+
+    return {
+        "repo_name": repo_name,
+        "triggers": triggers.values(),
+        "goals": statuses,
+    }
+
+
+def format_plan(plan):
+    ''' Describe a plan made by plan_triggers in a human readable way. '''
+    lines = ["Plan for %s:" % plan["repo_name"]]
+    for trigger in plan["triggers"]:
+        lines.append("  %s: trigger '%s' %d time(s)%s" % (
+            trigger["revision"], trigger["buildername"], trigger["times"],
+            " with %d file(s)" % len(trigger["files"]) if trigger["files"] else ""))
+        lines.append("      for: %s" % ", ".join(trigger["goals"]))
+    for status in plan["goals"]:
+        if status["status"] != "triggered":
+            lines.append("  %s: '%s' is %s" %
+                         (status["revision"], status["buildername"], status["status"]))
+    if not plan["triggers"]:
+        lines.append("  Nothing needs to be triggered")
+    return "\n".join(lines)
+
+
+def execute_plan(plan, dry_run=False):
+    '''
+    Trigger the jobs of a plan made by plan_triggers.
+    It returns a list with the requests made for every trigger of the plan.
+    '''
+    return [_trigger(plan["repo_name"], trigger["revision"], trigger["buildername"],
+                     trigger["files"], trigger["times"], dry_run)
+            for trigger in plan["triggers"]]
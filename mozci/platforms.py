@@ -2,98 +2,160 @@
 """
 This module helps us connect builds to tests since we don't have an API
 to help us with this task.
+
+The mapping tables are built from allthethings.json the first time they are
+needed; importing this module does not do any I/O. Use :func:`warm_up` if you
+prefer paying that cost upfront.
 """
-from sources.allthethings import fetch_allthethings_data
-
-# We will start by pre-computing some structures that will be used for
-# determine_upstream_builder. They are globals so we don't compute them over
-# and over again when calling determine_upstream_builder multiple times
-
-all_builders_information = fetch_allthethings_data()
-buildernames = all_builders_information['builders'].keys()
-
-# In buildbot, once a build job finishes, it triggers a scheduler,
-# which causes several tests to run. In allthethings.json we have the
-# name of the trigger that activates a scheduler, but what each build
-# job triggers is not directly available from the json file. Since
-# trigger names for a given build are similar to their shortnames,
-# which are available in allthethings.json, we'll use shortnames to
-# find the which builder triggered a given scheduler given only the
-# trigger name. In order to do that we'll need a mapping from
-# shortnames to build jobs. For example:
-# "Android armv7 API 11+ larch build":
-#               { ...  "shortname": "larch-android-api-11", ...},
-# Will give us the entry:
-# "larch-android-api-11" : "Android armv7 API 11+ larch build"
-shortname_to_name = {}
-
-# For every test job we can find the scheduler that runs it and the
-# corresponding trigger in allthethings.json. For example:
-# "schedulers": {...
-# "tests-larch-panda_android-opt-unittest": {
-#    "downstream": [ "Android 4.0 armv7 API 11+ larch opt test cppunit", ...],
-#    "triggered_by": ["larch-android-api-11-opt-unittest"]},
-# means that "Android 4.0 armv7 API 11+ larch opt test cppunit" is ran
-# by the "tests-larch-panda_android-opt-unittest" scheduler, and this
-# scheduler is triggered by "larch-android-api-11-opt-unittest". In
-# buildername_to_trigger we'll store the corresponding trigger to
-# every test job. In this case, "Android 4.0 armv7 API 11+ larch opt
-# test cppunit" : larch-android-api-11-opt-unittest
-buildername_to_trigger = {}
-
-# We'll look at every builder and if it's a build job we will add it
-# to shortname_to_name
-for buildername in buildernames:
-    # Skipping nightly for now
-    if 'nightly' in buildername:
-        continue
-
-    builder_info = all_builders_information['builders'][buildername]
-    props = builder_info['properties']
-    # We heuristically figure out what jobs are build jobs by checking
-    # the "slavebuilddir" property
-    if 'slavebuilddir' not in props or props['slavebuilddir'] != 'test':
-        shortname_to_name[builder_info['shortname']] = buildername
-
-# data['schedulers'] is a dictionary that maps a scheduler name to a
-# dictionary of it's properties:
-# "schedulers": {...
-# "tests-larch-panda_android-opt-unittest": {
-#    "downstream": [ "Android 4.0 armv7 API 11+ larch opt test cppunit",
-#                    "Android 4.0 armv7 API 11+ larch opt test crashtest",
-#                    "Android 4.0 armv7 API 11+ larch opt test jsreftest-1",
-#                    "Android 4.0 armv7 API 11+ larch opt test jsreftest-2",
-#                    ... ],
-#    "triggered_by": ["larch-android-api-11-opt-unittest"]},
-# A test scheduler has a list of tests in "downstream" and a trigger
-# name in "triggered_by". We will map every test in downstream to the
-# trigger name in triggered_by
-for sched, values in all_builders_information['schedulers'].iteritems():
-    # We are only interested in test schedulers
-    if not sched.startswith('tests-'):
-        continue
-
-    for buildername in values['downstream']:
-        assert buildername not in buildername_to_trigger
-        buildername_to_trigger[buildername] = values['triggered_by'][0]
+from __future__ import absolute_import
+import logging
+import re
+from collections import namedtuple
 
+from mozci.sources import buildapi
+from mozci.sources.allthethings import REGISTRY
+from mozci.utils.misc import AhoCorasick, lru_cache
 
-def determine_upstream_builder(buildername, repo_name):
-    '''Given a builder name, find the build job that triggered it. When
-    buildername corresponds to a test job, it does so by looking at
-    allthethings.json. When buildername corresponds to a build job, it
-    returns it unchanged.
+LOG = logging.getLogger()
+
+# Increase it when _build_platform_tables changes what it returns
+TABLES_VERSION = 2
+
+# Decomposition of a buildername; see parse_buildername()
+BuilderInfo = namedtuple(
+    'BuilderInfo',
+    ['buildername', 'repo_name', 'platform', 'build_type', 'job_type', 'suite', 'chunk']
+)
+# Characters that delimit the words of a buildername
+_WORD_SEPARATORS = frozenset(' _\t')
+_TOKEN_SEPARATORS = re.compile(r'[\s_]+')
+_CHUNKED_SUITE = re.compile(r'^(.+)-(\d+)$')
+
+
+def _build_platform_tables(registry):
     '''
-    assert repo_name in buildername, \
-        "You have requested '%s' buildername, " % buildername + \
-        "however, the key '%s' " % repo_name + \
-        "is not found in it."
+    It computes the build <-> test graph used by this module from
+    allthethings.json. The tables are stored in the allthethings snapshot
+    so we don't compute them over and over again for every process.
+    '''
+    all_builders_information = registry.data
 
-    # If a buildername is not in buildername_to_trigger, that means
-    # it's a build job and it should be returned unchanged
-    if buildername not in buildername_to_trigger:
-        return buildername
+    # In buildbot, once a build job finishes, it triggers a scheduler,
+    # which causes several tests to run. In allthethings.json we have the
+    # name of the trigger that activates a scheduler, but what each build
+    # job triggers is not directly available from the json file. Since
+    # trigger names for a given build are similar to their shortnames,
+    # which are available in allthethings.json, we'll use shortnames to
+    # find the which builder triggered a given scheduler given only the
+    # trigger name. In order to do that we'll need a mapping from
+    # shortnames to build jobs. For example:
+    # "Android armv7 API 11+ larch build":
+    #               { ...  "shortname": "larch-android-api-11", ...},
+    # Will give us the entry:
+    # "larch-android-api-11" : "Android armv7 API 11+ larch build"
+    shortname_to_name = {}
+
+    # For every test job we can find the scheduler that runs it and the
+    # corresponding trigger in allthethings.json. For example:
+    # "schedulers": {...
+    # "tests-larch-panda_android-opt-unittest": {
+    #    "downstream": [ "Android 4.0 armv7 API 11+ larch opt test cppunit", ...],
+    #    "triggered_by": ["larch-android-api-11-opt-unittest"]},
+    # means that "Android 4.0 armv7 API 11+ larch opt test cppunit" is ran
+    # by the "tests-larch-panda_android-opt-unittest" scheduler, and this
+    # scheduler is triggered by "larch-android-api-11-opt-unittest". In
+    # buildername_to_trigger we'll store the corresponding trigger to
+    # every test job. In this case, "Android 4.0 armv7 API 11+ larch opt
+    # test cppunit" : larch-android-api-11-opt-unittest
+    buildername_to_trigger = {}
+
+    # A build job can be scheduled for many platforms and repositories;
+    # we keep an index of all builders for a given (repo_name, platform)
+    repo_platform_to_builders = {}
+    builder_to_repo_platform = {}
+
+    nightly_builds = []
+    # We'll look at every builder and if it's a build job we will add it
+    # to shortname_to_name
+    for buildername, builder_info in all_builders_information['builders'].iteritems():
+        props = builder_info['properties']
+        key = (_repo_name_from_properties(props), props.get('platform'))
+        repo_platform_to_builders.setdefault(key, []).append(buildername)
+        builder_to_repo_platform[buildername] = key
+
+        # We heuristically figure out what jobs are build jobs by checking
+        # the "slavebuilddir" property
+        if 'slavebuilddir' not in props or props['slavebuilddir'] != 'test':
+            if 'nightly' in buildername:
+                nightly_builds.append((builder_info['shortname'], buildername))
+            else:
+                shortname_to_name[builder_info['shortname']] = buildername
+
+    # Nightly builds can only claim shortnames that no other build job uses
+    for shortname, buildername in nightly_builds:
+        shortname_to_name.setdefault(shortname, buildername)
+
+    # data['schedulers'] is a dictionary that maps a scheduler name to a
+    # dictionary of it's properties:
+    # "schedulers": {...
+    # "tests-larch-panda_android-opt-unittest": {
+    #    "downstream": [ "Android 4.0 armv7 API 11+ larch opt test cppunit",
+    #                    "Android 4.0 armv7 API 11+ larch opt test crashtest",
+    #                    "Android 4.0 armv7 API 11+ larch opt test jsreftest-1",
+    #                    "Android 4.0 armv7 API 11+ larch opt test jsreftest-2",
+    #                    ... ],
+    #    "triggered_by": ["larch-android-api-11-opt-unittest"]},
+    # A test scheduler has a list of tests in "downstream" and a trigger
+    # name in "triggered_by". We will map every test in downstream to the
+    # trigger name in triggered_by
+    for sched, values in registry.schedulers.iteritems():
+        # We are only interested in test schedulers
+        if not sched.startswith('tests-'):
+            continue
+
+        for buildername in values['downstream']:
+            assert buildername not in buildername_to_trigger
+            buildername_to_trigger[buildername] = values['triggered_by'][0]
+
+    # Now that we have both tables we can resolve every test job to its
+    # build job once. Many test jobs share a trigger, so we only resolve
+    # each trigger once.
+    trigger_to_build = {}
+    test_to_build = {}
+    build_to_tests = {}
+    for buildername, trigger in buildername_to_trigger.iteritems():
+        if trigger not in trigger_to_build:
+            trigger_to_build[trigger] = _resolve_trigger(trigger, shortname_to_name)
+        build_buildername = trigger_to_build[trigger]
+        test_to_build[buildername] = build_buildername
+        if build_buildername is not None:
+            build_to_tests.setdefault(build_buildername, []).append(buildername)
+
+    for tests in build_to_tests.itervalues():
+        tests.sort()
+
+    return {
+        'shortname_to_name': shortname_to_name,
+        'buildername_to_trigger': buildername_to_trigger,
+        'test_to_build': test_to_build,
+        'build_to_tests': build_to_tests,
+        'repo_platform_to_builders': repo_platform_to_builders,
+        'builder_to_repo_platform': builder_to_repo_platform,
+    }
 
+
+def _repo_name_from_properties(props):
+    ''' Determine the repository of a builder from its properties. '''
+    if props.get('repo_path'):
+        return props['repo_path'].split('/')[-1]
+    return props.get('branch')
+
+
+def _resolve_trigger(trigger, shortname_to_name):
+    '''
+    Guess the buildername of the build job behind the trigger name of a
+    test scheduler. It returns None if we can't determine it.
+    '''
     # For some (but not all) platforms and repos, -pgo is explicit in
     # the trigger but not in the shortname, e.g. "Linux
     # mozilla-release build" shortname is "mozilla-release-linux" but
@@ -105,7 +167,7 @@ def determine_upstream_builder(buildername, repo_name):
     # e.g. from "larch-android-api-11-opt-unittest"
     # look for "larch-android-api-11" in shortname_to_name and find
     # "Android armv7 API 11+ larch build"
-    shortname = buildername_to_trigger[buildername]
+    shortname = trigger
     for suffix in SUFFIXES:
         if shortname.endswith(suffix):
             shortname = shortname[:-len(suffix)]
@@ -114,17 +176,242 @@ def determine_upstream_builder(buildername, repo_name):
 
     # B2G jobs are weird
     shortname = "b2g_" + shortname.replace('-emulator', '_emulator') + "_dep"
-    if shortname in shortname_to_name:
-        return shortname_to_name[shortname]
+    return shortname_to_name.get(shortname)
+
+
+def _platform_tables():
+    '''
+    It returns the dictionary of tables computed by _build_platform_tables.
+
+    The tables are cached in memory and in the allthethings snapshot.
+    '''
+    return REGISTRY.derived("platforms-%d" % TABLES_VERSION, _build_platform_tables)
+
+
+def warm_up():
+    '''
+    Fetch allthethings.json if needed and build the mapping tables now rather
+    than on the first call to determine_upstream_builder.
+    '''
+    _platform_tables()
+
+
+def determine_upstream_builder(buildername, repo_name):
+    '''Given a builder name, find the build job that triggered it. When
+    buildername corresponds to a test job, it does so by looking at
+    allthethings.json. When buildername corresponds to a build job, it
+    returns it unchanged.
+    '''
+    assert repo_name in buildername, \
+        "You have requested '%s' buildername, " % buildername + \
+        "however, the key '%s' " % repo_name + \
+        "is not found in it."
+
+    test_to_build = _platform_tables()['test_to_build']
+
+    # If a buildername is not in test_to_build, that means
+    # it's a build job and it should be returned unchanged
+    if buildername not in test_to_build:
+        return buildername
+
+    return test_to_build[buildername]
+
+
+def determine_upstream_builders(buildernames, repo_name=None):
+    '''Batch version of determine_upstream_builder.
+
+    It returns a dictionary mapping every buildername to the build job that
+    triggers it (build jobs map to themselves). Test jobs for which we can't
+    determine the build job map to None and are reported together.
+
+    If repo_name is given, all buildernames have to belong to it.
+    '''
+    if repo_name is not None:
+        wrong_builders = [b for b in buildernames if repo_name not in b]
+        assert not wrong_builders, \
+            "The key '%s' is not found in these buildernames: %s" % \
+            (repo_name, ", ".join(wrong_builders))
+
+    test_to_build = _platform_tables()['test_to_build']
+    upstream = {}
+    for buildername in buildernames:
+        upstream[buildername] = test_to_build.get(buildername, buildername)
+
+    unresolved = sorted(b for b, build in upstream.iteritems() if build is None)
+    if unresolved:
+        LOG.warning("We could not determine the build job of %d builder(s): %s" %
+                    (len(unresolved), ", ".join(unresolved)))
+
+    return upstream
+
+
+def determine_downstream_builders(buildername):
+    '''Given the builder name of a build job, return the sorted list of
+    test jobs triggered by it. It returns an empty list for test jobs.
+    '''
+    return list(_platform_tables()['build_to_tests'].get(buildername, []))
+
+
+def find_builders(repo_name, platform):
+    '''Return all builder names running on a repository for a platform
+    (e.g. "mozilla-inbound", "linux64").
+    '''
+    return list(_platform_tables()['repo_platform_to_builders'].get(
+        (repo_name, platform), []))
+
+
+def match_repo_name(buildername, repo_names=None):
+    '''Return the longest repository name which appears in buildername as a
+    whole word (delimited by spaces, underscores or the ends of the
+    buildername), or None.
+
+    For instance, "ash" does not match "Windows 7 32-bit washington ...".
+
+    We look for the repositories known to buildapi unless repo_names is given.
+    The search is a single pass over buildername regardless of the number
+    of repositories.
+    '''
+    if repo_names is None:
+        automaton = buildapi.query_repositories_automaton()
+    else:
+        automaton = _repo_names_automaton(tuple(sorted(repo_names)))
+
+    best = None
+    for start, repo_name in automaton.iter_matches(buildername):
+        if best is not None and len(repo_name) <= len(best):
+            continue
+        end = start + len(repo_name)
+        if (start == 0 or buildername[start - 1] in _WORD_SEPARATORS) and \
+                (end == len(buildername) or buildername[end] in _WORD_SEPARATORS):
+            best = repo_name
+    return best
+
+
+@lru_cache(maxsize=16)
+def _repo_names_automaton(repo_names):
+    return AhoCorasick(repo_names)
+
+
+def _build_type(tokens):
+    for token in tokens:
+        if token == 'debug' or token.endswith('-debug'):
+            return 'debug'
+    for token in tokens:
+        if token == 'pgo' or token.startswith('pgo-'):
+            return 'pgo'
+    return 'opt'
+
+
+def _job_type(buildername, tokens, tables):
+    if buildername in tables['test_to_build']:
+        return 'talos' if 'talos' in tokens else 'test'
+    # Builders we don't know about and test jobs run by schedulers whose
+    # name does not start with "tests-" are not in the graph; rely on the
+    # naming conventions
+    if 'talos' in tokens:
+        return 'talos'
+    if 'test' in tokens and tokens[-1] != 'build':
+        return 'test'
+    if 'nightly' in tokens:
+        return 'nightly'
+    return 'build'
+
+
+@lru_cache(maxsize=4096)
+def _parse_buildername(buildername, digest):
+    return _parse(buildername, _platform_tables())
+
+
+def _parse(buildername, tables):
+    tokens = _TOKEN_SEPARATORS.split(buildername.strip())
+
+    if buildername in tables['builder_to_repo_platform']:
+        repo_name, platform = tables['builder_to_repo_platform'][buildername]
+    else:
+        repo_name = match_repo_name(buildername)
+        platform = None
+
+    job_type = _job_type(buildername, tokens, tables)
+
+    suite = None
+    chunk = None
+    if job_type in ('test', 'talos'):
+        # The suite is what follows the last "test" or "talos" word
+        # e.g. "Ubuntu VM 12.04 x64 mozilla-inbound debug test mochitest-3"
+        words = buildername.split()
+        for index in range(len(words) - 1, -1, -1):
+            if words[index] in ('test', 'talos'):
+                suite = ' '.join(words[index + 1:]) or None
+                break
+        if suite is not None:
+            match = _CHUNKED_SUITE.match(suite)
+            if match:
+                suite = match.group(1)
+                chunk = int(match.group(2))
+
+    return BuilderInfo(
+        buildername=buildername,
+        repo_name=repo_name,
+        platform=platform,
+        build_type=_build_type(tokens),
+        job_type=job_type,
+        suite=suite,
+        chunk=chunk,
+    )
+
+
+def parse_buildername(buildername):
+    '''Decompose a buildername into a BuilderInfo namedtuple:
+
+    * **repo_name**: e.g. "mozilla-inbound"
+    * **platform**: allthethings' platform property (e.g. "linux64") or None
+    * **build_type**: "opt", "pgo" or "debug"
+    * **job_type**: "build", "nightly", "test" or "talos"
+    * **suite**: e.g. "mochitest" (only for test and talos jobs)
+    * **chunk**: e.g. 3 for "mochitest-3" or None
+
+    The repository and platform come from allthethings.json. For builders
+    that are not listed in there we look for a known repository name.
+    Results are cached.
+    '''
+    _platform_tables()
+    return _parse_buildername(buildername, REGISTRY.digest)
+
+
+def filter_buildernames(buildernames=None, **criteria):
+    '''Return the buildernames whose BuilderInfo matches all criteria.
+
+    If buildernames is None we look at all builders in allthethings.json.
+    For instance, all debug mochitest chunks on mozilla-inbound:
+
+    .. code-block:: python
+
+        filter_buildernames(repo_name="mozilla-inbound", build_type="debug",
+                            job_type="test", suite="mochitest")
+    '''
+    unknown_fields = set(criteria) - set(BuilderInfo._fields)
+    assert not unknown_fields, \
+        "We can't filter by %s" % ", ".join(sorted(unknown_fields))
+
+    tables = _platform_tables()
+    if buildernames is None:
+        # Only look at the builders of the requested repository/platform
+        buildernames = []
+        for (repo_name, platform), builders in \
+                tables['repo_platform_to_builders'].iteritems():
+            if criteria.get('repo_name', repo_name) == repo_name and \
+                    criteria.get('platform', platform) == platform:
+                buildernames.extend(builders)
+
+    matching = []
+    for buildername in buildernames:
+        info = _parse(buildername, tables)
+        if all(getattr(info, field) == value for field, value in criteria.iteritems()):
+            matching.append(buildername)
+    return matching
 
 
 def is_downstream(buildername):
     ''' Determine if a job requires files to be triggered.
     '''
-    # XXX: This is closely tied to the buildbot naming
-    # We could determine this by looking if the builder belongs to
-    # the right schedulers in allthethings.json
-    for match in ("opt", "pgo", "debug", "talos"):
-        if buildername.find(match) != -1:
-            return True
-    return False
+    return parse_buildername(buildername).job_type in ('test', 'talos')
@@ -46,77 +46,266 @@ It contains a dictionary with 4 keys:
 * **master_builders**
 * **slavepools**
 """
+from __future__ import absolute_import
+import cPickle
+import hashlib
 import json
 import logging
 import os
+import threading
 
-import requests
+from mozci.utils.download import atomic_rename, fetch_file, temporary_path
 
 LOG = logging.getLogger()
 
+# We keep allthethings.json (and the files fetch_file keeps next to it) and
+# its snapshot in CACHE_DIR
+CACHE_DIR = os.path.expanduser("~/.mozilla/mozci")
 FILENAME = "allthethings.json"
+SNAPSHOT_FILENAME = "allthethings.snapshot"
 ALLTHETHINGS = \
     "https://secure.pub.build.mozilla.org/builddata/reports/allthethings.json"
+# Number of seconds before we check if there is a new allthethings.json
+TTL = 24 * 60 * 60
+# Increase it when the layout of the snapshot changes
+SNAPSHOT_VERSION = 1
 
 
-def fetch_allthethings_data(no_caching=False):
+def _path(filename):
+    ''' Where we keep filename (FILENAME or SNAPSHOT_FILENAME). '''
+    return os.path.join(CACHE_DIR, filename)
+
+
+def _fetch(ttl):
     '''
-    It fetches the allthethings.json file.
+    It makes sure that FILENAME is an up to date copy of allthethings.json.
+
+    We only check with the server if our copy is older than ttl seconds and
+    we only download it again if it has changed.
+    '''
+    if not os.path.isdir(CACHE_DIR):
+        try:
+            os.makedirs(CACHE_DIR)
+        except OSError:
+            # Another process created it
+            if not os.path.isdir(CACHE_DIR):
+                raise
+    LOG.debug("Fetching allthethings.json %s" % ALLTHETHINGS)
+    fetch_file(ALLTHETHINGS, _path(FILENAME), ttl=ttl)
+
 
-    It clobbers it the file is older than 24 hours.
+def _file_digest(filename):
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as fd:
+        for chunk in iter(lambda: fd.read(1024 * 1024), ""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
 
-    If no_caching is True, we fetch it every time without creating a file.
+
+def _load_snapshot():
+    path = _path(SNAPSHOT_FILENAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as fd:
+            snapshot = cPickle.load(fd)
+    except Exception, e:
+        LOG.debug("Ignoring unreadable %s: %s" % (path, e))
+        return None
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    return snapshot
+
+
+def _save_snapshot(snapshot):
+    path = _path(SNAPSHOT_FILENAME)
+    tmp_path = temporary_path(path)
+    try:
+        with open(tmp_path, "wb") as fd:
+            cPickle.dump(snapshot, fd, cPickle.HIGHEST_PROTOCOL)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    atomic_rename(tmp_path, path)
+
+
+class AllTheThings(object):
     '''
-    def _fetch():
-        LOG.debug("Fetching allthethings.json %s" % ALLTHETHINGS)
-        req = requests.get(ALLTHETHINGS, stream=True)
-
-        with open(FILENAME, "wb") as fd:
-            for chunk in req.iter_content(chunk_size=1024):
-                if chunk:  # filter out keep-alive new chunks
-                    fd.write(chunk)
-                    fd.flush()
-
-        if _verify_file_integrity():
-            fd = open(FILENAME, "r")
-            data = json.load(fd)
-            return data
-        else:
-            LOG.debug('File integrity failed. Retrying fetching the file.')
-            return _fetch()
-
-    def _verify_file_integrity():
-        statinfo = os.stat(FILENAME)
-        file_size = statinfo.st_size
-        response = requests.head(ALLTHETHINGS)
-        content_length = int(response.headers['content-length'])
-        if file_size != content_length:
-            return False
-        else:
-            return True
-
-    if no_caching:
-        data = _fetch()
-    else:
-        if os.path.exists(FILENAME):
-            # If corrupt incomplete / old file, remove
-            if not _verify_file_integrity():
-                os.remove(FILENAME)
-                data = _fetch()
+    In-process registry for the data contained in allthethings.json.
+
+    The file is parsed once per process. It is parsed again only if its
+    modification time changes *and* its content hash is different from the
+    one we loaded. Lookups are served from these indexes:
+
+    * **builders**: frozenset of all buildernames
+    * **schedulers**: dictionary of scheduler name to its values
+    * **shortnames**: dictionary of shortname to buildername
+
+    The indexes and any table registered through :meth:`derived` are saved
+    into a snapshot (SNAPSHOT_FILENAME in CACHE_DIR) keyed by the sha1 of the
+    json file.
+    Short-lived processes load the snapshot instead of parsing the json file
+    and rebuilding the tables.
+    '''
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._stat = None
+        self._data = None
+        self._derived = {}
+        self.digest = None
+        self.builders = frozenset()
+        self.schedulers = {}
+        self.shortnames = {}
+        self._builders_list = []
+
+    @property
+    def data(self):
+        ''' The raw content of allthethings.json; parsed only if needed. '''
+        with self._lock:
+            if self._data is None:
+                LOG.debug("Parsing %s" % FILENAME)
+                with open(_path(FILENAME), "rb") as fd:
+                    self._data = json.load(fd)
+            return self._data
+
+    def _index(self):
+        builders = self.data["builders"]
+        self._builders_list = builders.keys()
+        self.builders = frozenset(self._builders_list)
+        self.schedulers = self.data["schedulers"]
+        self.shortnames = dict(
+            (info["shortname"], buildername)
+            for buildername, info in builders.iteritems()
+            if "shortname" in info
+        )
+        self._derived = {}
+
+    def _snapshot(self):
+        return {
+            "version": SNAPSHOT_VERSION,
+            "digest": self.digest,
+            "stat": self._stat,
+            "builders": self._builders_list,
+            "schedulers": self.schedulers,
+            "shortnames": self.shortnames,
+            "derived": self._derived,
+        }
+
+    def _restore(self, snapshot):
+        self._data = None
+        self._builders_list = snapshot["builders"]
+        self.builders = frozenset(self._builders_list)
+        self.schedulers = snapshot["schedulers"]
+        self.shortnames = snapshot["shortnames"]
+        self._derived = snapshot["derived"]
+
+    def load(self, force=False):
+        '''
+        Return the registry making sure that it reflects what is on disk.
+
+        If force is True we check with the server even if the file is not
+        older than TTL.
+        '''
+        with self._lock:
+            _fetch(ttl=0 if force else TTL)
+
+            statinfo = os.stat(_path(FILENAME))
+            stat_key = (statinfo.st_mtime, statinfo.st_size)
+            if self.digest is not None and stat_key == self._stat:
+                return self
+
+            snapshot = _load_snapshot()
+            if snapshot is not None and snapshot["stat"] == stat_key:
+                # We trust the snapshot without hashing the file
+                digest = snapshot["digest"]
+            else:
+                digest = _file_digest(_path(FILENAME))
+
+            if digest == self.digest:
+                self._stat = stat_key
+            elif snapshot is not None and snapshot["digest"] == digest:
+                LOG.debug("Loading %s (sha1: %s)" % (SNAPSHOT_FILENAME, digest))
+                self._restore(snapshot)
+                self.digest = digest
+                self._stat = stat_key
             else:
-                fd = open(FILENAME)
-                data = json.load(fd)
-        else:
-            data = _fetch()
+                LOG.debug("Loading %s (sha1: %s)" % (FILENAME, digest))
+                self._data = None
+                self.digest = digest
+                self._stat = stat_key
+                self._index()
 
-    return data
+            if snapshot is None or snapshot["digest"] != digest or \
+                    snapshot["stat"] != stat_key:
+                _save_snapshot(self._snapshot())
+
+        return self
+
+    def derived(self, name, build_function):
+        '''
+        Return the table called name computed by build_function(registry).
+
+        The table is computed once per allthethings.json content and it is
+        stored in the snapshot; name must change whenever build_function
+        produces something different.
+        '''
+        with self._lock:
+            self.load()
+            if name not in self._derived:
+                LOG.debug("Building %s from %s" % (name, FILENAME))
+                self._derived[name] = build_function(self)
+                _save_snapshot(self._snapshot())
+            return self._derived[name]
+
+    def list_builders(self):
+        return self.load()._builders_list
+
+
+REGISTRY = AllTheThings()
+
+
+def fetch_allthethings_data(no_caching=False):
+    '''
+    It fetches the allthethings.json file.
+
+    If the file is older than TTL (24 hours) we ask the server if it has
+    changed and download it again only if it has.
+
+    The parsed data is kept in memory and it is only parsed again if the file
+    on disk changes.
+
+    If no_caching is True, we check with the server regardless of the TTL.
+    '''
+    return REGISTRY.load(force=no_caching).data
 
 
 def list_builders():
     '''
     It returns a list of all builders running in the buildbot CI.
     '''
-    j = fetch_allthethings_data()
-    list = j["builders"].keys()
+    list = REGISTRY.list_builders()
     assert list is not None, "The list of builders cannot be empty."
     return list
+
+
+def valid_builder(buildername):
+    '''
+    It determines in O(1) if a buildername exists in allthethings.json.
+    '''
+    return buildername in REGISTRY.load().builders
+
+
+def query_schedulers():
+    '''
+    It returns a dictionary mapping scheduler names to their downstream
+    builders and triggers.
+    '''
+    return REGISTRY.load().schedulers
+
+
+def query_buildername_from_shortname(shortname):
+    '''
+    It returns the buildername associated to a shortname or None.
+    '''
+    return REGISTRY.load().shortnames.get(shortname)
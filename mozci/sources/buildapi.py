@@ -13,48 +13,157 @@ from __future__ import absolute_import
 import json
 import logging
 import os
+import threading
+import time
+from multiprocessing.pool import ThreadPool
 
 import requests
-from bs4 import BeautifulSoup
 
+from mozci.utils import memo, transport
 from mozci.utils.authentication import get_credentials
 from mozci.sources.pushlog import query_revision_info
+from mozci.utils.misc import AhoCorasick, Record, TokenBucket
 
 LOG = logging.getLogger()
 HOST_ROOT = 'https://secure.pub.build.mozilla.org/buildapi/self-serve'
 REPOSITORIES_FILE = os.path.abspath("repositories.txt")
 
+# Limits for posting to self-serve (see make_requests):
+# - number of requests we have in flight at once
+TRIGGER_CONCURRENCY = 4
+# - requests per second on average (for the whole process) and burst size
+TRIGGER_RATE = 5
+TRIGGER_BURST = 5
+# - number of times we retry a request which got a 5xx response
+TRIGGER_RETRIES = 3
+
 # Self-serve cannot give us the whole granularity of states; Use buildjson where necessary.
 # http://hg.mozilla.org/build/buildbot/file/0e02f6f310b4/master/buildbot/status/builder.py#l25
 PENDING, RUNNING, UNKNOWN = range(-3, 0)
 SUCCESS, WARNING, FAILURE, SKIPPED, EXCEPTION, RETRY, CANCELLED = range(7)
 RESULTS = ["success", "warnings", "failure", "skipped", "exception", "retry", "cancelled"]
 
+# In-memory copy of REPOSITORIES_FILE; see query_repositories()
+_REPOSITORIES_CACHE = {
+    "stat": None,
+    "repositories": None,
+    "automaton": None,
+    "automaton_source": None,
+}
+
+_RATE_LIMITER = {"limits": None, "bucket": None}
+_RATE_LIMITER_LOCK = threading.Lock()
+
 
 class BuildapiException(Exception):
     pass
 
 
+def _rate_limiter():
+    ''' The TokenBucket shared by everything posting to self-serve. '''
+    with _RATE_LIMITER_LOCK:
+        limits = (TRIGGER_RATE, TRIGGER_BURST)
+        if _RATE_LIMITER["limits"] != limits:
+            _RATE_LIMITER["bucket"] = TokenBucket(*limits)
+            _RATE_LIMITER["limits"] = limits
+        return _RATE_LIMITER["bucket"]
+
+
+def _request_id(req):
+    ''' The request_id of an accepted self-serve request (or None). '''
+    if not req.ok:
+        return None
+    try:
+        return req.json().get("request_id")
+    except (ValueError, AttributeError):
+        return None
+
+
 def make_request(url, payload):
     ''' We request from buildapi to trigger a job for us.
 
+    Requests which get a 5xx response are retried (TRIGGER_RETRIES times)
+    and every attempt waits for the TRIGGER_RATE rate limit.
+
     We return the request.
     '''
-    # NOTE: A good response returns json with request_id as one of the keys
-    req = requests.post(url, data=payload, auth=get_credentials())
+    attempt = 0
+    while True:
+        _rate_limiter().acquire()
+        # NOTE: A good response returns json with request_id as one of the keys
+        req = transport.post(url, data=payload, auth=get_credentials())
+        if req.status_code not in transport.RETRY_STATUS_CODES or \
+                attempt >= TRIGGER_RETRIES:
+            break
+        LOG.debug("Self-serve returned %d for %s; retrying." % (req.status_code, url))
+        req.close()
+        time.sleep(transport.backoff(attempt))
+        attempt += 1
+
     assert req.status_code != 401, req.reason
-    LOG.debug("We have received this request:")
-    LOG.debug(" - status code: %s" % req.status_code)
-    LOG.debug(" - text:        %s" % BeautifulSoup(req.text).get_text())
+    if LOG.isEnabledFor(logging.DEBUG):
+        # We import it here since importing bs4 is slow
+        from bs4 import BeautifulSoup
+        LOG.debug("We have received this request:")
+        LOG.debug(" - status code: %s" % req.status_code)
+        LOG.debug(" - text:        %s" % BeautifulSoup(req.text).get_text())
     return req
 
 
+def make_requests(url, payload, times, concurrency=None):
+    ''' Post the same request to self-serve "times" times.
+
+    Up to concurrency (default: TRIGGER_CONCURRENCY) requests are in flight
+    at once. We log a summary of the request_ids self-serve accepted and of
+    the requests which failed.
+
+    We return the list of requests which got a response.
+    '''
+    if concurrency is None:
+        concurrency = TRIGGER_CONCURRENCY
+
+    def post(_):
+        try:
+            return make_request(url, payload)
+        except requests.RequestException, e:
+            LOG.error("We could not post to %s: %s" % (url, e))
+            return None
+
+    workers = min(concurrency, times)
+    if workers > 1:
+        pool = ThreadPool(workers)
+        try:
+            responses = pool.map(post, range(times))
+        finally:
+            pool.close()
+    else:
+        responses = map(post, range(times))
+
+    list_of_requests = [req for req in responses if req is not None]
+    accepted = []
+    failed = []
+    for req in responses:
+        request_id = _request_id(req) if req is not None else None
+        if request_id is not None:
+            accepted.append(str(request_id))
+        else:
+            failed.append(str(req.status_code) if req is not None else "no response")
+
+    LOG.info("Self-serve accepted %d of %d request(s) for %s; request_ids: %s" %
+             (len(accepted), times, url, ", ".join(accepted) or "none"))
+    if failed:
+        LOG.warning("%d request(s) failed for %s (%s)" %
+                    (len(failed), url, ", ".join(failed)))
+    return list_of_requests
+
+
 def _valid_builder():
     ''' Not implemented function '''
     raise Exception("Not implemented because of bug 1087336. Use "
                     "mozci.allthethings.")
 
 
+@memo.memoized("valid_revision")
 def valid_revision(repo_name, revision):
     '''
     There are revisions that won't exist in buildapi
@@ -93,11 +202,105 @@ def query_job_status(job):
             raise Exception("Unexpected status")
 
 
+class BuildapiRequest(Record):
+    ''' A scheduling request of a BuildapiJob. '''
+    FIELDS = ("request_id", "complete_at")
+    __slots__ = FIELDS
+
+
+class BuildapiJob(Record):
+    ''' Compact record of a job listed by query_jobs_schedule. It only keeps
+    the keys we use and can be read like the original dictionary.
+    '''
+    FIELDS = ("build_id", "buildername", "starttime", "endtime", "status", "requests")
+    __slots__ = FIELDS
+
+    @classmethod
+    def from_json(cls, data):
+        job = super(BuildapiJob, cls).from_json(data)
+        if "requests" in data:
+            job.requests = tuple(BuildapiRequest.from_json(r) for r in data["requests"])
+        return job
+
+
+class JobSchedule(object):
+    '''
+    The jobs of a revision (as returned by query_jobs_schedule) indexed by
+    buildername, together with the number of jobs of every builder in each
+    status (see query_job_status).
+
+    It is built in one pass over the jobs (which are kept as BuildapiJob
+    records); afterwards finding the jobs of a builder or counting them by
+    status does not look at the jobs again.
+    '''
+
+    def __init__(self, jobs):
+        self.jobs = [job if isinstance(job, BuildapiJob) else BuildapiJob.from_json(job)
+                     for job in jobs]
+        self._jobs = {}
+        self._counts = {}
+        for job in self.jobs:
+            buildername = job["buildername"]
+            self._jobs.setdefault(buildername, []).append(job)
+            try:
+                status = query_job_status(job)
+            except Exception:
+                status = UNKNOWN
+            counts = self._counts.setdefault(buildername, {})
+            counts[status] = counts.get(status, 0) + 1
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def __contains__(self, buildername):
+        return buildername in self._jobs
+
+    def buildernames(self):
+        ''' The builders which have jobs on the revision. '''
+        return self._jobs.keys()
+
+    def jobs_of(self, buildername):
+        ''' The jobs of buildername (in the order buildapi lists them). '''
+        return self._jobs.get(buildername, [])
+
+    def count(self, buildername, *statuses):
+        ''' Number of jobs of buildername in any of statuses (all of its jobs if
+        no status is given).
+        '''
+        if not statuses:
+            return len(self.jobs_of(buildername))
+        counts = self._counts.get(buildername, {})
+        return sum(counts.get(status, 0) for status in statuses)
+
+    def status_counts(self, buildername):
+        ''' Number of jobs of buildername for each of the buildapi statuses:
+
+        .. code-block:: python
+
+            {
+                "pending": int,
+                "running": int,
+                "successful": int,
+                "failed": int,       # warnings, failure or exception
+            }
+        '''
+        return {
+            "pending": self.count(buildername, PENDING),
+            "running": self.count(buildername, RUNNING),
+            "successful": self.count(buildername, SUCCESS),
+            "failed": self.count(buildername, WARNING, FAILURE, EXCEPTION),
+        }
+
+
+@memo.memoized("jobs_schedule")
 def query_jobs_schedule(repo_name, revision):
     ''' It returns a list with all jobs for that revision.
 
     If we can't query about this revision in buildapi we return an empty list.
 
+    Within a run scope (see mozci.utils.memo) we only ask buildapi once per
+    revision; use invalidate_jobs_schedule() after triggering new jobs.
+
     raises BuildapiException
     '''
     if not valid_revision(repo_name, revision):
@@ -105,12 +308,32 @@ def query_jobs_schedule(repo_name, revision):
 
     url = "%s/%s/rev/%s?format=json" % (HOST_ROOT, repo_name, revision)
     LOG.debug("About to fetch %s" % url)
-    req = requests.get(url, auth=get_credentials())
+    req = transport.get(url, auth=get_credentials())
     assert req.status_code in [200], req.content
 
     return req.json()
 
 
+@memo.memoized("job_schedule")
+def query_job_schedule(repo_name, revision):
+    ''' Same as query_jobs_schedule but it returns a JobSchedule. '''
+    return JobSchedule(query_jobs_schedule(repo_name, revision))
+
+
+def async_query_jobs_schedule(repo_name, revision, callback=None):
+    ''' Non-blocking query_jobs_schedule; see mozci.utils.transport.submit. '''
+    return transport.submit(query_jobs_schedule, repo_name, revision, callback=callback)
+
+
+def invalidate_jobs_schedule(repo_name, revision):
+    '''
+    Forget the memoized jobs schedule of a revision (e.g. after we have
+    triggered jobs on it).
+    '''
+    memo.invalidate("jobs_schedule", repo_name, revision)
+    memo.invalidate("job_schedule", repo_name, revision)
+
+
 def query_jobs_url(repo_name, revision):
     ''' Returns url of where a developer can login to see the
         scheduled jobs for a revision.
@@ -147,22 +370,46 @@ def query_repositories(clobber=False):
             "graph_branches": ["Ash"],
             "repo_type": "hg"
         }
+
+    The content of REPOSITORIES_FILE is kept in memory until the file changes.
     '''
     repositories = None
     if clobber and os.path.exists(REPOSITORIES_FILE):
         os.remove(REPOSITORIES_FILE)
 
     if os.path.exists(REPOSITORIES_FILE):
+        statinfo = os.stat(REPOSITORIES_FILE)
+        stat_key = (statinfo.st_mtime, statinfo.st_size)
+        if _REPOSITORIES_CACHE["stat"] == stat_key:
+            return _REPOSITORIES_CACHE["repositories"]
+
         LOG.debug("Loading %s" % REPOSITORIES_FILE)
         fd = open(REPOSITORIES_FILE)
         repositories = json.load(fd)
     else:
         url = "%s/branches?format=json" % HOST_ROOT
         LOG.debug("About to fetch %s" % url)
-        req = requests.get(url, auth=get_credentials())
+        req = transport.get(url, auth=get_credentials())
         assert req.status_code != 401, req.reason
         repositories = req.json()
         with open(REPOSITORIES_FILE, "wb") as fd:
             json.dump(repositories, fd)
+        statinfo = os.stat(REPOSITORIES_FILE)
+        stat_key = (statinfo.st_mtime, statinfo.st_size)
 
+    _REPOSITORIES_CACHE["stat"] = stat_key
+    _REPOSITORIES_CACHE["repositories"] = repositories
     return repositories
+
+
+def query_repositories_automaton():
+    '''
+    Return an AhoCorasick automaton over the names of the repositories.
+
+    It is rebuilt only when the repositories change.
+    '''
+    repositories = query_repositories()
+    if _REPOSITORIES_CACHE["automaton_source"] is not repositories:
+        _REPOSITORIES_CACHE["automaton"] = AhoCorasick(repositories.keys())
+        _REPOSITORIES_CACHE["automaton_source"] = repositories
+    return _REPOSITORIES_CACHE["automaton"]
@@ -3,80 +3,982 @@
 This module helps with the buildjson data generated by the Release Engineering
 systems: http://builddata.pub.build.mozilla.org/builddata/buildjson
 """
+from __future__ import absolute_import
+import bisect
+import calendar
+import cPickle
+import datetime
+import gzip
 import json
 import logging
 import os
-import requests
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from cStringIO import StringIO
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 
-from mozci.utils.tzone import utc_dt, utc_time, utc_day
+from mozci.utils import transport
+from mozci.utils.cache import DiskCache
+from mozci.utils.download import atomic_rename, file_lock, file_version, temporary_path
+from mozci.utils.misc import Record
+from mozci.utils.tzone import day_format, pacific_tz, utc_day
+
+try:
+    import sqlite3
+except ImportError:  # pragma: no cover
+    sqlite3 = None
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
 
 LOG = logging.getLogger()
 
+_CACHE = {"config": None, "cache": None}
+_CACHE_LOCK = threading.Lock()
+_STORE = {"store": None}
+
 BUILDJSON_DATA = "http://builddata.pub.build.mozilla.org/builddata/buildjson"
 BUILDS_4HR_FILE = "builds-4hr.js.gz"
 BUILDS_DAY_FILE = "builds-%s.js"
 
+# We keep the files we download (gzip compressed) in CACHE_DIR. Entries unused
+# for CACHE_MAX_AGE seconds are removed and so are the least recently used
+# ones when the directory grows over CACHE_MAX_BYTES (see buildjson_cache())
+CACHE_DIR = os.path.expanduser("~/.mozilla/mozci/buildjson")
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+CACHE_MAX_AGE = 30 * 24 * 60 * 60
+# Bump it when the format of the request_id index changes
+INDEX_VERSION = 1
+# Number of bytes we read at a time while streaming a buildjson file
+STREAM_CHUNK_SIZE = 1024 * 1024
 
-def _fetch_file(data_file, url):
-    LOG.debug("We will now fetch %s" % url)
-    # Fetch tar ball
-    req = requests.get(url)
-    # NOTE: requests deals with decrompressing the gzip file
-    with open(data_file, 'wb') as fd:
-        for chunk in req.iter_content(chunk_size=1024):
-            fd.write(chunk)
+# builds-4hr.js.gz is generated every minute and has the jobs which ended in
+# the last 4 hours; see BuildsPoller
+POLL_INTERVAL = 60
+POLL_WINDOW = 4 * 60 * 60
 
+# The jobs which ended during the UTC day D are in the file of day D, which
+# is generated every DAY_FILE_INTERVAL seconds during the Pacific day D (see
+# query_job_data)
+DAY_FILE_INTERVAL = 15 * 60
+# The complete_at of a request and the endtime of its job can be a bit apart;
+# near midnight we also look in the file of the adjacent day
+DAY_BOUNDARY_SLACK = 10 * 60
+# Jobs which end at 4pm PT only reach their day file at midnight PT; JobStore
+# keeps what it polls from builds-4hr in memory for that long
+STORE_WINDOW = 9 * 60 * 60
 
-def _fetch_buildjson_day_file(date):
+# Number of day files prefetch_days downloads at the same time
+PREFETCH_WORKERS = 4
+
+GZIP_MAGIC = "\x1f\x8b"
+
+
+class BuildjsonJob(Record):
+    '''
+    Compact record of a job of a buildjson file; see query_job_data.
+
+    A day file has hundreds of thousands of jobs and each of them has a
+    large "properties" dictionary. We only keep the keys we use and the
+    properties listed in PROPERTIES (as a tuple); the properties dictionary
+    is rebuilt when it is asked for. Missing or null properties are left out.
+    '''
+    FIELDS = ("builder_id", "starttime", "endtime", "requesttime", "result",
+              "slave_id", "request_ids", "properties")
+    PROPERTIES = ("buildername", "buildid", "revision", "repo_path", "branch",
+                  "log_url", "slavename", "packageUrl", "testsUrl", "symbolsUrl",
+                  "blobber_files")
+    __slots__ = FIELDS[:-1] + ("_properties",)
+
+    @property
+    def properties(self):
+        return dict((key, value) for key, value in zip(self.PROPERTIES, self._properties)
+                    if value is not None)
+
+    @properties.setter
+    def properties(self, properties):
+        self._properties = tuple(properties.get(key) for key in self.PROPERTIES)
+
+    def get_property(self, key, default=None):
+        ''' Same as job["properties"].get(key, default) without building the
+        dictionary. '''
+        try:
+            value = self._properties[self.PROPERTIES.index(key)]
+        except (AttributeError, ValueError):
+            return default
+        return default if value is None else value
+
+    @classmethod
+    def from_json(cls, data):
+        # This is called for every job of a day; avoid the generic (and slower)
+        # Record.from_json
+        job = cls()
+        for key in cls.FIELDS[:-2]:
+            if key in data:
+                setattr(job, key, data[key])
+        if "request_ids" in data:
+            job.request_ids = tuple(data["request_ids"])
+        properties = data.get("properties")
+        if properties is not None:
+            job._properties = tuple(map(properties.get, cls.PROPERTIES))
+        return job
+
+
+class _JSONStream(object):
+    '''
+    Read a JSON document from a file object one value at a time.
+
+    We only keep in memory the part of the file we have not consumed yet
+    (about STREAM_CHUNK_SIZE bytes plus the value being decoded).
+    '''
+    WHITESPACE = re.compile(r"[ \t\n\r]*")
+    NUMBER_CHARACTERS = frozenset("0123456789+-.eE")
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        ''' Read more of the file. It returns False at the end of the file. '''
+        chunk = self.fd.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        ''' Skip whitespace and return the next character ("" at the end). '''
+        while True:
+            self.pos = self.WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, characters):
+        ''' Consume the next character, which has to be one of characters. '''
+        character = self.peek()
+        if not character or character not in characters:
+            raise ValueError("Expected one of %r at byte %d of the buffer, found %r" %
+                             (characters, self.pos, character))
+        self.pos += 1
+        return character
+
+    def value(self):
+        ''' Decode the next JSON value. '''
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                # The value might continue in the next chunk
+                if not self._fill():
+                    raise
+                continue
+            # So might a value which ends with the buffer, or a number which
+            # we have only decoded in part (e.g. "1." of "1.25")
+            if end == len(self.buffer) or (
+                    self.buffer[self.pos] in self.NUMBER_CHARACTERS and
+                    self.buffer[end] in self.NUMBER_CHARACTERS):
+                if not self.eof and self._fill():
+                    continue
+            self.pos = end
+            return value
+
+
+def _open_data_file(data_file):
+    ''' Open a buildjson file, whether it is gzipped or not. '''
+    with open(data_file, "rb") as fd:
+        magic = fd.read(2)
+    if magic == GZIP_MAGIC:
+        return gzip.open(data_file, "rb")
+    return open(data_file, "rb")
+
+
+def iter_builds(data_file, predicate=None):
+    '''
+    Iterate over the jobs of a buildjson file (gzipped or not) without
+    loading the whole file: we decode one job of the "builds" list at a
+    time, so the memory we use does not depend on the size of the file.
+
+    It yields a BuildjsonJob for every job for which predicate (called with
+    the decoded JSON dictionary of the job) is true. We stop reading the
+    file as soon as the caller stops iterating.
+    '''
+    with _open_data_file(data_file) as fd:
+        for job in _iter_document_builds(fd, predicate):
+            yield job
+
+
+def _iter_document_builds(fd, predicate=None):
+    ''' Same as iter_builds but for a file object with the JSON document. '''
+    stream = _JSONStream(fd)
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+    while True:
+        key = stream.value()
+        stream.expect(":")
+        if key != "builds":
+            # Skip the other top level values (e.g. "slaves")
+            stream.value()
+        else:
+            stream.expect("[")
+            if stream.peek() == "]":
+                return
+            while True:
+                job = stream.value()
+                if predicate is None or predicate(job):
+                    yield BuildjsonJob.from_json(job)
+                if stream.expect(",]") == "]":
+                    # We don't need the rest of the document
+                    return
+        if stream.expect(",}") == "}":
+            return
+
+
+def _load_builds(data_file):
+    ''' Return the jobs of a buildjson file as BuildjsonJob records. '''
+    return list(iter_builds(data_file))
+
+
+def _has_request_ids(request_ids):
+    ''' A predicate for iter_builds selecting the jobs of request_ids. '''
+    wanted = set(request_ids)
+    return lambda job: not wanted.isdisjoint(job.get("request_ids", ()))
+
+
+def buildjson_cache():
+    ''' The DiskCache (configured by the CACHE_* constants) with our files. '''
+    with _CACHE_LOCK:
+        config = (CACHE_DIR, CACHE_MAX_BYTES, CACHE_MAX_AGE)
+        if _CACHE["config"] != config:
+            _CACHE["cache"] = DiskCache(*config)
+            _CACHE["config"] = config
+        return _CACHE["cache"]
+
+
+def cache_stats():
+    ''' Describe the cache of buildjson files; see DiskCache.stats. '''
+    return buildjson_cache().stats()
+
+
+def _day_file_name(date):
+    return (BUILDS_DAY_FILE % date) + ".gz"
+
+
+def _pacific_midnight(date):
+    ''' Return the timestamp at which the Pacific day date starts. '''
+    day = datetime.datetime.strptime(date, day_format).replace(tzinfo=pacific_tz)
+    return calendar.timegm((day - day.utcoffset()).timetuple())
+
+
+def _next_day(date):
+    day = datetime.datetime.strptime(date, day_format) + datetime.timedelta(days=1)
+    return day.strftime(day_format)
+
+
+def _day_file_ttl(date, now=None):
+    '''
+    Return for how many seconds a validated copy of the day file of date
+    stays valid (see download.fetch_file), or None if the file has not been
+    published yet.
+    '''
+    if now is None:
+        now = time.time()
+    if now < _pacific_midnight(date):
+        return None
+    final = _pacific_midnight(_next_day(date)) + DAY_FILE_INTERVAL
+    if now < final:
+        # The file is still being generated
+        return DAY_FILE_INTERVAL
+    # A copy validated after the last version was generated is valid forever
+    return now - final
+
+
+def _download_buildjson_day_file(date):
     '''
        In BUILDJSON_DATA we have the information about all jobs stored
        as a gzip file per day.
 
-       This function caches the uncompressed gzip files requested in the past.
+       This function caches the gzip files requested in the past; the copy of
+       a file which is still being generated is revalidated every
+       DAY_FILE_INTERVAL seconds.
 
-       This function returns a json object containing all jobs for a given day.
+       This function returns the path to the file of a given day.
     '''
-    data_file = BUILDS_DAY_FILE % date
+    name = _day_file_name(date)
+    url = "%s/%s" % (BUILDJSON_DATA, name)
+    return buildjson_cache().fetch(name, url, ttl=_day_file_ttl(date))
 
-    if not os.path.exists(data_file):
-        url = "%s/%s.gz" % (BUILDJSON_DATA, data_file)
-        LOG.debug("We have not been able to find on disk %s." % data_file)
-        _fetch_file(data_file, url)
 
-    return json.load(open(data_file))["builds"]
+def _fetch_buildjson_day_file(date):
+    '''
+       This function returns a list with a BuildjsonJob for every job of a given day.
+    '''
+    return _load_builds(_download_buildjson_day_file(date))
 
 
 def _fetch_buildjson_4hour_file():
     '''
-    This file is generate every minute.
-    It has the same data as today's buildjson day file but only for the
-    last 4 hours.
+    builds-4hr.js.gz is generated every minute. It has the same data as
+    today's buildjson day file but only for the last 4 hours.
+
+    This function returns a list with a BuildjsonJob for every job of the
+    last 4 hours (and older ones we polled earlier; see JobStore).
     '''
-    LOG.debug("Fetching %s..." % BUILDS_4HR_FILE)
-    url = "%s/%s" % (BUILDJSON_DATA, BUILDS_4HR_FILE)
-    _fetch_file(BUILDS_4HR_FILE, url)
-    return json.load(open(BUILDS_4HR_FILE))["builds"]
+    poller = builds_poller()
+    poller.poll()
+    return poller.jobs()
 
 
-def _find_job(request_id, builds, filename):
+class BuildsPoller(object):
     '''
-    Look for request_id in builds extracted from filename.
+    Keep the jobs of builds-4hr.js.gz in memory, indexed by request_id.
 
-    raises Exception when we can't find the job.
+    poll() only downloads the file if it has changed since the last time
+    (If-Modified-Since) and merges its jobs with the ones we have; the jobs
+    which ended more than window seconds ago are dropped. Lookups are
+    answered from memory, so a long running monitor can call poll() every
+    interval seconds and look jobs up as often as it wants.
     '''
-    LOG.debug("We are going to look for %s in %s." % (request_id, filename))
 
-    for job in builds:
-        if request_id in job["request_ids"]:
-            LOG.debug("Found %s" % str(job))
-            return job
+    def __init__(self, url=None, window=POLL_WINDOW, interval=POLL_INTERVAL):
+        self.url = url or "%s/%s" % (BUILDJSON_DATA, BUILDS_4HR_FILE)
+        self.window = window
+        self.interval = interval
+        self.last_modified = None
+        self.last_poll = None
+        self._jobs = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def poll(self, force=False):
+        '''
+        Merge the jobs of the latest builds-4hr.js.gz. We don't contact the
+        server if we did less than interval seconds ago, unless force is set.
+
+        It returns the number of request_ids we did not have.
+        '''
+        with self._lock:
+            now = time.time()
+            if not force and self.last_poll is not None and \
+                    now - self.last_poll < self.interval:
+                return 0
+
+            headers = {}
+            if self.last_modified:
+                headers["If-Modified-Since"] = self.last_modified
+            LOG.debug("Polling %s..." % self.url)
+            req = transport.get(self.url, headers=headers)
+            self.last_poll = now
+            if req.status_code == 304:
+                LOG.debug("%s has not changed since %s." % (self.url, self.last_modified))
+                self._prune(now)
+                return 0
+            assert req.status_code == 200, \
+                "We could not fetch %s (status code: %s)" % (self.url, req.status_code)
+
+            # Depending on the server the content might still be compressed
+            content = req.content
+            if content[:2] == GZIP_MAGIC:
+                fd = gzip.GzipFile(fileobj=StringIO(content))
+            else:
+                fd = StringIO(content)
+            new_jobs = self._merge(_iter_document_builds(fd))
+            self.last_modified = req.headers.get("last-modified")
+            self._prune(now)
+            LOG.debug("We have %d new request_ids from %s." % (new_jobs, self.url))
+            return new_jobs
+
+    def _merge(self, builds):
+        new_jobs = 0
+        for job in builds:
+            for request_id in job["request_ids"]:
+                if request_id not in self._jobs:
+                    new_jobs += 1
+                self._jobs[request_id] = job
+        return new_jobs
 
-    raise Exception(
+    def _prune(self, now):
+        ''' Drop the jobs which ended before the window. '''
+        cutoff = now - self.window
+        for request_id, job in self._jobs.items():
+            if job.get("endtime") is not None and job["endtime"] < cutoff:
+                del self._jobs[request_id]
+
+    def get(self, request_id):
+        ''' Return the job of request_id or None. '''
+        return self._jobs.get(request_id)
+
+    def lookup(self, request_ids):
+        '''
+        Return a dictionary mapping every request_id of request_ids we have
+        to its job. If some are missing we poll before giving up on them.
+        '''
+        with self._lock:
+            found = dict((r, self._jobs[r]) for r in request_ids if r in self._jobs)
+            if len(found) < len(set(request_ids)) and self.poll():
+                found = dict((r, self._jobs[r]) for r in request_ids if r in self._jobs)
+            return found
+
+    def jobs(self):
+        ''' Return a list with the jobs we have, ordered by endtime. '''
+        with self._lock:
+            jobs = dict((id(job), job) for job in self._jobs.itervalues()).values()
+        return sorted(jobs, key=lambda job: job.get("endtime"))
+
+
+def builds_poller():
+    ''' The BuildsPoller shared by the functions of this module. '''
+    return job_store().poller
+
+
+def _job_not_found(request_id, filename):
+    return Exception(
         "We have not found the job. If you see this problem please grep "
         "in %s for %d and run again with --debug and --dry-run." % (filename, request_id)
     )
 
 
+def _scan_builds(request_ids, builds):
+    '''
+    Return a dictionary mapping every request_id of request_ids found in
+    builds to the first job with it.
+    '''
+    wanted = set(request_ids)
+    found = {}
+    for job in builds:
+        for request_id in job["request_ids"]:
+            if request_id in wanted and request_id not in found:
+                found[request_id] = job
+        if len(found) == len(wanted):
+            break
+    return found
+
+
+#
+# request_id index of the day files
+#
+# Next to every day file we keep a sqlite database mapping each request_id to
+# its job, so looking a job up does not require loading the whole day again:
+#
+#   jobs (id, job)                    job is the JSON of a BuildjsonJob
+#   requests (request_id, job_id)     indexed by request_id
+#   meta (key, value)                 index version and size/mtime of the day file
+#
+def _index_path(data_file):
+    return data_file + ".index"
+
+
+def _index_source(data_file):
+    ''' Identify the version of data_file an index was built from. '''
+    return file_version(data_file)
+
+
+def _build_index(data_file, builds):
+    '''
+    Write the request_id index of data_file, which contains builds (an
+    iterable of BuildjsonJob, e.g. iter_builds(data_file)), unless another
+    thread or process has just written it.
+    '''
+    path = _index_path(data_file)
+    with file_lock(path + ".lock"):
+        if _lookup_index(data_file, [])[0]:
+            return
+        tmp_path = temporary_path(path)
+        try:
+            _write_index(data_file, tmp_path, builds)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        atomic_rename(tmp_path, path)
+
+
+def _write_index(data_file, tmp_path, builds):
+    ''' Write the request_id index of data_file into tmp_path. '''
+    LOG.debug("Indexing the jobs of %s" % data_file)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("CREATE TABLE jobs (id INTEGER PRIMARY KEY, job TEXT)")
+        conn.execute("CREATE TABLE requests (request_id INTEGER, job_id INTEGER)")
+        jobs = []
+        requests = []
+        for job_id, job in enumerate(builds):
+            jobs.append((job_id, json.dumps(job.to_dict())))
+            requests.extend((request_id, job_id) for request_id in job.get("request_ids", ()))
+            if len(jobs) >= 1000:
+                conn.executemany("INSERT INTO jobs VALUES (?, ?)", jobs)
+                conn.executemany("INSERT INTO requests VALUES (?, ?)", requests)
+                jobs = []
+                requests = []
+        conn.executemany("INSERT INTO jobs VALUES (?, ?)", jobs)
+        conn.executemany("INSERT INTO requests VALUES (?, ?)", requests)
+        conn.execute("CREATE INDEX requests_request_id ON requests (request_id)")
+        conn.executemany("INSERT INTO meta VALUES (?, ?)",
+                         [("version", str(INDEX_VERSION)),
+                          ("source", _index_source(data_file))])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _lookup_index(data_file, request_ids):
+    '''
+    Look for request_ids in the index of data_file.
+
+    It returns a tuple (index_is_valid, jobs); jobs maps every request_id
+    found to its job and it is empty if the index is missing or out of date.
+    '''
+    path = _index_path(data_file)
+    if not os.path.exists(path):
+        return False, {}
+
+    request_ids = list(set(request_ids))
+    found = {}
+    conn = sqlite3.connect(path)
+    try:
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+        if meta.get("version") != str(INDEX_VERSION) or \
+                meta.get("source") != _index_source(data_file):
+            LOG.debug("The index of %s is out of date." % data_file)
+            return False, {}
+        # Stay below sqlite's limit of variables per statement
+        for start in range(0, len(request_ids), 500):
+            chunk = request_ids[start:start + 500]
+            rows = conn.execute(
+                "SELECT requests.request_id, jobs.job FROM requests "
+                "JOIN jobs ON jobs.id = requests.job_id "
+                "WHERE requests.request_id IN (%s) ORDER BY requests.job_id" %
+                ", ".join("?" * len(chunk)), chunk)
+            for request_id, job in rows:
+                if request_id not in found:
+                    found[request_id] = job
+    except sqlite3.DatabaseError, e:
+        LOG.debug("We could not read the index of %s: %s" % (data_file, e))
+        return False, {}
+    finally:
+        conn.close()
+
+    return True, dict((request_id, BuildjsonJob.from_json(json.loads(job)))
+                      for request_id, job in found.iteritems())
+
+
+def _query_day_file(date, request_ids):
+    '''
+    Look for request_ids in the day file of date. The first lookup in a day
+    file indexes it; the next ones only read the index.
+
+    It returns a dictionary mapping every request_id found to its job.
+    '''
+    data_file = _download_buildjson_day_file(date)
+    LOG.debug("We are going to look for %s in %s." %
+              (", ".join(str(r) for r in request_ids), data_file))
+    if sqlite3 is not None:
+        index_is_valid, jobs = _lookup_index(data_file, request_ids)
+        if index_is_valid:
+            return jobs
+
+    if sqlite3 is None:
+        return _scan_builds(request_ids,
+                            iter_builds(data_file, _has_request_ids(request_ids)))
+
+    _build_index(data_file, iter_builds(data_file))
+    return _lookup_index(data_file, request_ids)[1]
+
+
+#
+# endtime index of the day files
+#
+# Next to every day file we can also keep its finished jobs as columns sorted
+# by endtime, one array.array per column (see EndtimeIndex), to answer
+# questions about the jobs which ended in a time range.
+#
+ENDTIME_COLUMNS = ("endtime", "starttime", "builder_id", "result", "request_id")
+# Value of the columns a job does not have
+MISSING = -1
+# Bump it when the format of the endtime index changes
+ENDTIME_INDEX_VERSION = 1
+
+
+def _percentile(values, percent):
+    ''' The percentile of sorted values; we interpolate like numpy.percentile. '''
+    position = (len(values) - 1) * percent / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class EndtimeIndex(object):
+    '''
+    The finished jobs of a day file as columns sorted by endtime.
+
+    columns maps every name of ENDTIME_COLUMNS to an array.array; the i-th
+    value of every column describes the same job. request_id is the first
+    request of the job (see query_job_data) and buildernames maps every
+    builder_id to its buildername.
+
+    Time ranges are bisected and the summaries use NumPy if it is installed.
+    '''
+
+    def __init__(self, columns, buildernames):
+        self.columns = columns
+        self.buildernames = buildernames
+
+    def __len__(self):
+        return len(self.columns["endtime"])
+
+    @classmethod
+    def from_builds(cls, builds):
+        ''' Index builds, an iterable of BuildjsonJob (e.g. iter_builds()). '''
+        rows = []
+        buildernames = {}
+        for job in builds:
+            if job.get("endtime") is None:
+                continue
+            starttime, builder_id, result = [
+                MISSING if value is None else value
+                for value in (job.get("starttime"), job.get("builder_id"), job.get("result"))]
+            request_ids = job.get("request_ids") or (MISSING,)
+            rows.append((job["endtime"], starttime, builder_id, result, request_ids[0]))
+            buildernames[builder_id] = job.get_property("buildername")
+        rows.sort()
+        values = zip(*rows) or [()] * len(ENDTIME_COLUMNS)
+        columns = dict((name, array("l", column))
+                       for name, column in zip(ENDTIME_COLUMNS, values))
+        return cls(columns, buildernames)
+
+    def bounds(self, start=None, end=None):
+        '''
+        Return the positions (lower, upper) of the jobs which ended in
+        [start, end); without start or end the range is open on that side.
+        '''
+        endtimes = self.columns["endtime"]
+        lower = 0 if start is None else bisect.bisect_left(endtimes, start)
+        upper = len(endtimes) if end is None else bisect.bisect_left(endtimes, end)
+        return lower, max(lower, upper)
+
+    def select(self, start=None, end=None, buildername=None):
+        '''
+        Return the columns (like self.columns) of the jobs which ended in
+        [start, end), only keeping the ones of buildername if given.
+        '''
+        lower, upper = self.bounds(start, end)
+        if buildername is None:
+            return dict((name, column[lower:upper])
+                        for name, column in self.columns.iteritems())
+
+        builder_ids = set(builder_id for builder_id, name in self.buildernames.iteritems()
+                          if name == buildername)
+        builder_column = self.columns["builder_id"]
+        positions = [i for i in xrange(lower, upper) if builder_column[i] in builder_ids]
+        return dict((name, array("l", (column[i] for i in positions)))
+                    for name, column in self.columns.iteritems())
+
+    def summary(self, start=None, end=None, column="endtime", percentiles=(50, 90, 99)):
+        '''
+        Describe the values of column (or "duration", the difference between
+        endtime and starttime) for the jobs which ended in [start, end):
+
+        .. code-block:: python
+
+            {
+                "jobs": int,
+                "min": int,
+                "max": int,
+                "percentiles": {percent: float},
+            }
+
+        Jobs without a starttime have no duration and are not counted in
+        the duration summary. min, max and the percentiles are None if
+        there are no jobs.
+        '''
+        lower, upper = self.bounds(start, end)
+        summary = {"jobs": upper - lower, "min": None, "max": None,
+                   "percentiles": dict((percent, None) for percent in percentiles)}
+        if upper == lower:
+            return summary
+
+        if column == "endtime":
+            # It is sorted already
+            values = self.columns["endtime"][lower:upper]
+        elif numpy is not None:
+            if column == "duration":
+                endtimes = numpy.frombuffer(self.columns["endtime"], dtype="l")[lower:upper]
+                starttimes = numpy.frombuffer(self.columns["starttime"],
+                                              dtype="l")[lower:upper]
+                known = starttimes != MISSING
+                values = endtimes[known] - starttimes[known]
+                summary["jobs"] = len(values)
+                if not len(values):
+                    return summary
+            else:
+                values = numpy.frombuffer(self.columns[column], dtype="l")[lower:upper]
+            summary["min"] = int(values.min())
+            summary["max"] = int(values.max())
+            summary["percentiles"] = dict(
+                zip(percentiles, (float(value) for value in
+                                  numpy.percentile(values, list(percentiles)))))
+            return summary
+        elif column == "duration":
+            endtimes = self.columns["endtime"]
+            starttimes = self.columns["starttime"]
+            values = sorted(endtimes[i] - starttimes[i] for i in xrange(lower, upper)
+                            if starttimes[i] != MISSING)
+            summary["jobs"] = len(values)
+            if not values:
+                return summary
+        else:
+            values = sorted(self.columns[column][lower:upper])
+
+        summary["min"] = values[0]
+        summary["max"] = values[-1]
+        summary["percentiles"] = dict((percent, float(_percentile(values, percent)))
+                                      for percent in percentiles)
+        return summary
+
+
+def _endtime_index_path(data_file):
+    return data_file + ".endtimes"
+
+
+def _save_endtime_index(data_file, index):
+    path = _endtime_index_path(data_file)
+    tmp_path = temporary_path(path)
+    try:
+        with open(tmp_path, "wb") as fd:
+            cPickle.dump({
+                "version": ENDTIME_INDEX_VERSION,
+                "source": _index_source(data_file),
+                "columns": dict((name, column.tostring())
+                                for name, column in index.columns.iteritems()),
+                "buildernames": index.buildernames,
+            }, fd, cPickle.HIGHEST_PROTOCOL)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    atomic_rename(tmp_path, path)
+
+
+def _load_endtime_index(data_file):
+    ''' Return the endtime index of data_file or None if it is out of date. '''
+    path = _endtime_index_path(data_file)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as fd:
+            data = cPickle.load(fd)
+    except Exception, e:
+        LOG.debug("We could not read the endtime index of %s: %s" % (data_file, e))
+        return None
+    if data.get("version") != ENDTIME_INDEX_VERSION or \
+            data.get("source") != _index_source(data_file):
+        LOG.debug("The endtime index of %s is out of date." % data_file)
+        return None
+
+    columns = {}
+    for name, values in data["columns"].iteritems():
+        columns[name] = array("l")
+        columns[name].fromstring(values)
+    return EndtimeIndex(columns, data["buildernames"])
+
+
+def endtime_index(date):
+    '''
+    Return the EndtimeIndex of the jobs of the day file of date; it is
+    built the first time and kept next to the day file.
+    '''
+    data_file = _download_buildjson_day_file(date)
+    index = _load_endtime_index(data_file)
+    if index is not None:
+        return index
+
+    # Only one thread or process builds it; the others wait and load it
+    with file_lock(_endtime_index_path(data_file) + ".lock"):
+        index = _load_endtime_index(data_file)
+        if index is None:
+            LOG.debug("Indexing the endtimes of %s" % data_file)
+            index = EndtimeIndex.from_builds(iter_builds(data_file))
+            _save_endtime_index(data_file, index)
+    return index
+
+
+def _prefetch_day_file(date):
+    ''' Download the day file of date; it returns its path or None. '''
+    try:
+        return _download_buildjson_day_file(date)
+    except Exception, e:
+        LOG.error("We could not fetch the buildjson file of %s: %s" % (date, e))
+        return None
+
+
+def _index_day_file(data_file):
+    ''' Index data_file unless its index is up to date; it returns whether
+    we indexed it. '''
+    try:
+        if _lookup_index(data_file, [])[0]:
+            return False
+        _build_index(data_file, iter_builds(data_file))
+        return True
+    except Exception, e:
+        # Looking its jobs up will try again
+        LOG.error("We could not index %s: %s" % (data_file, e))
+        return False
+
+
+def prefetch_days(start, end, workers=PREFETCH_WORKERS, processes=None):
+    '''
+    Make sure the day files from start to end (both included; e.g.
+    "2015-02-23") are in the cache and indexed, e.g. before investigating
+    the jobs of a week.
+
+    The files are downloaded by workers threads and then the ones without an
+    up to date index are indexed by a pool of processes (as many as CPUs by
+    default), so the JSON decoding runs on several cores.
+
+    It returns an OrderedDict mapping every date to the path of its file or
+    to None if we could not fetch it (e.g. it has not been published yet).
+    '''
+    if start > end:
+        raise ValueError("The start date %s is after the end date %s." % (start, end))
+
+    dates = [start]
+    while dates[-1] < end:
+        dates.append(_next_day(dates[-1]))
+
+    LOG.info("Fetching the buildjson files of %d days..." % len(dates))
+    pool = ThreadPool(min(workers, len(dates)))
+    try:
+        paths = pool.map(_prefetch_day_file, dates)
+    finally:
+        pool.close()
+        pool.join()
+
+    data_files = [path for path in paths if path is not None]
+    if sqlite3 is not None and data_files:
+        LOG.info("Indexing the jobs of %d days..." % len(data_files))
+        pool = Pool(processes)
+        try:
+            indexed = pool.map(_index_day_file, data_files)
+        finally:
+            pool.close()
+            pool.join()
+        LOG.debug("We have indexed %d files." % sum(indexed))
+
+    return OrderedDict(zip(dates, paths))
+
+
+class JobStore(object):
+    '''
+    Look jobs up by request_id in all the buildjson files which can have them.
+
+    A job is in the day file of the UTC day in which it ended, but that file
+    is only generated during the Pacific day of the same date; until then the
+    job is only in builds-4hr, for 4 hours (see query_job_data). We cover the
+    gap by keeping in memory what we poll from builds-4hr for STORE_WINDOW
+    seconds.
+
+    A lookup only refreshes the files which can have the job: builds-4hr if
+    it ended in the last 4 hours and otherwise the published day files of
+    the time it ended. Day files which are still being generated are
+    revalidated with conditional requests (see _day_file_ttl) rather than
+    removed and downloaded again.
+    '''
+
+    def __init__(self, poller=None):
+        self.poller = poller or BuildsPoller(window=STORE_WINDOW)
+
+    def day_files(self, complete_at, now=None):
+        '''
+        Return the dates of the published day files which can have the job
+        of a request completed at complete_at.
+        '''
+        dates = []
+        for timestamp in (complete_at, complete_at + DAY_BOUNDARY_SLACK,
+                          complete_at - DAY_BOUNDARY_SLACK):
+            date = utc_day(timestamp)
+            if date not in dates and _day_file_ttl(date, now) is not None:
+                dates.append(date)
+        return dates
+
+    def lookup(self, lookups):
+        '''
+        Return a dictionary mapping the request_id of every (complete_at,
+        request_id) of lookups to its job or to None if we have not found it.
+        '''
+        now = time.time()
+        jobs = {}
+        for _, request_id in lookups:
+            job = self.poller.get(request_id)
+            if job is not None:
+                jobs[request_id] = job
+
+        recent = [request_id for complete_at, request_id in lookups
+                  if request_id not in jobs and now - complete_at < POLL_WINDOW]
+        if recent:
+            LOG.debug("We are going to look for %s in %s." %
+                      (", ".join(str(r) for r in recent), BUILDS_4HR_FILE))
+            jobs.update(self.poller.lookup(recent))
+
+        request_ids_per_day = OrderedDict()
+        for complete_at, request_id in lookups:
+            # Recent jobs can only be in builds-4hr
+            if request_id not in jobs and now - complete_at >= POLL_WINDOW:
+                for date in self.day_files(complete_at, now):
+                    request_ids_per_day.setdefault(date, []).append(request_id)
+        for date, request_ids in request_ids_per_day.iteritems():
+            # We might have found some of them in the file of another day
+            request_ids = [r for r in request_ids if r not in jobs]
+            if request_ids:
+                jobs.update(_query_day_file(date, request_ids))
+
+        found = {}
+        for _, request_id in lookups:
+            found[request_id] = jobs.get(request_id)
+            if found[request_id] is None:
+                LOG.debug("We have not found the job of request %d." % request_id)
+        return found
+
+
+def job_store():
+    ''' The JobStore shared by the functions of this module. '''
+    with _CACHE_LOCK:
+        if _STORE["store"] is None:
+            _STORE["store"] = JobStore()
+        return _STORE["store"]
+
+
+def query_jobs_data(lookups):
+    '''
+    Batch version of query_job_data; lookups is a list of
+    (complete_at, request_id) tuples.
+
+    The lookups are grouped by the file which has them (see JobStore); every
+    file (or its index) is read once for all of them.
+
+    It returns a dictionary mapping every request_id to its job (see
+    query_job_data) or to None if we have not found it.
+    '''
+    for complete_at, request_id in lookups:
+        assert type(request_id) is int
+        assert type(complete_at) is int
+    return job_store().lookup(lookups)
+
+
 def query_job_data(complete_at, request_id):
     """
     This function looks for a job identified by `request_id` inside of a
@@ -85,8 +987,8 @@ def query_job_data(complete_at, request_id):
     Through `complete_at`, we can determine on which day we can find the
     metadata about this job.
 
-    If found, the returning entry will look like this (only important values
-    are referenced):
+    If found, we return a BuildjsonJob which can be read like this
+    dictionary (these are all the values we keep):
 
     .. code-block:: python
 
@@ -106,8 +1008,8 @@ def query_job_data(complete_at, request_id):
                 "blobber_files": json, # Mainly applicable to test jobs
                 "symbolsUrl": string, # It only applies for build jobs
             },
-            "request_ids": list of ints, # Scheduling ID
-            "requestime": int,
+            "request_ids": tuple of ints, # Scheduling ID
+            "requesttime": int,
             "result": int, # Job's exit code
             "slave_id": int, # Unique identifier for the machine that run it
         }
@@ -133,38 +1035,21 @@ def query_job_data(complete_at, request_id):
 
     This means that since 4pm to midnight we generate the same file again and again
     without adding any new data.
+
+    JobStore keeps the jobs it polls from builds-4hr in memory until their day
+    file is published, so a process which keeps running does not have that gap.
     """
-    assert type(request_id) is int
-    assert type(complete_at) is int
-
-    date = utc_day(complete_at)
-    LOG.debug("Job identified with complete_at value: %d run on %s UTC." % (complete_at, date))
-
-    then = utc_dt(complete_at)
-    hours_ago = (utc_dt() - then).total_seconds() / (60 * 60)
-    LOG.debug("The job completed at %s (%d hours ago)." % (utc_time(complete_at), hours_ago))
-
-    # If it has finished in the last 4 hours
-    if hours_ago < 4:
-        filename = BUILDS_4HR_FILE
-        job = _find_job(request_id, _fetch_buildjson_4hour_file(), filename)
-    else:
-        filename = BUILDS_DAY_FILE % date
-        builds = _fetch_buildjson_day_file(date)
-        # If it is today's date we might need to clobber the file since we could
-        # have cached today's file for a job earlier in the day
-        if utc_day() == date and os.path.exists(filename):
-            try:
-                job = _find_job(request_id, builds, filename)
-            except:
-                last_modified = int(os.path.getmtime(filename)) / 60
-                LOG.info("We removed today's buildjson file since the job was not found.")
-                LOG.info("We will fetch again since it is %s minutes out of date." %
-                         last_modified)
-                os.remove(filename)
-                builds = _fetch_buildjson_day_file(date)
-                job = _find_job(request_id, builds, filename)
-        else:
-            job = _find_job(request_id, builds, filename)
+    job = query_jobs_data([(complete_at, request_id)])[request_id]
+    if job is None:
+        dates = job_store().day_files(complete_at)
+        if not dates:
+            raise _job_not_found(request_id, builds_poller().url)
+        raise _job_not_found(request_id, buildjson_cache().path(_day_file_name(dates[0])))
 
+    LOG.debug("Found %s" % str(job))
     return job
+
+
+def async_query_job_data(complete_at, request_id, callback=None):
+    ''' Non-blocking query_job_data; see mozci.utils.transport.submit. '''
+    return transport.submit(query_job_data, complete_at, request_id, callback=callback)
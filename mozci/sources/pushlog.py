@@ -19,12 +19,18 @@ the following best practices:
 '''
 import logging
 
-import requests
+from mozci.utils import memo, transport
 
 LOG = logging.getLogger()
 JSON_PUSHES = "%(repo_url)s/json-pushes"
 
 
+@memo.memoized("url")
+def _fetch_json(url):
+    LOG.debug("About to fetch %s" % url)
+    return transport.get(url).json()
+
+
 def query_revisions_range(repo_url, start_revision, end_revision, version=2):
     '''
     This returns an ordered list of revisions (by date - oldest (starting) first).
@@ -41,9 +47,7 @@ def query_revisions_range(repo_url, start_revision, end_revision, version=2):
         end_revision,
         version
     )
-    LOG.debug("About to fetch %s" % url)
-    req = requests.get(url)
-    pushes = req.json()["pushes"]
+    pushes = _fetch_json(url)["pushes"]
     # json-pushes does not include the starting revision
     revisions.append(start_revision)
     for push_id in sorted(pushes.keys()):
@@ -71,9 +75,7 @@ def query_pushid_range(repo_url, start_id, end_id, version=2):
         end_id,
         version
     )
-    LOG.debug("About to fetch %s" % url)
-    req = requests.get(url)
-    pushes = req.json()["pushes"]
+    pushes = _fetch_json(url)["pushes"]
     for push_id in sorted(pushes.keys()):
         # Querying by push ID is preferred because date ordering is
         # not guaranteed (due to system clock skew)
@@ -111,11 +113,11 @@ def query_revision_info(repo_url, revision, full=False):
     url = "%s?changeset=%s" % (JSON_PUSHES % {"repo_url": repo_url}, revision)
     if full:
         url += "&full=1"
-    LOG.debug("About to fetch %s" % url)
-    req = requests.get(url)
-    data = req.json()
+    data = _fetch_json(url)
     assert len(data) == 1, "We should only have information about one push"
-    push_id, push_info = data.popitem()
+    # We copy the data since it might be memoized
+    push_id, push_info = data.items()[0]
+    push_info = dict(push_info)
     push_info["pushid"] = push_id
     if not full:
         LOG.debug("Push info: %s" % str(push_info))
@@ -123,3 +125,15 @@ def query_revision_info(repo_url, revision, full=False):
         LOG.debug("Requesting the info with full=1 can yield too much unecessary output "
                   "to debug anything properly")
     return push_info
+
+
+def async_query_pushid_range(repo_url, start_id, end_id, version=2, callback=None):
+    ''' Non-blocking query_pushid_range; see mozci.utils.transport.submit. '''
+    return transport.submit(query_pushid_range, repo_url, start_id, end_id, version,
+                            callback=callback)
+
+
+def async_query_revision_info(repo_url, revision, full=False, callback=None):
+    ''' Non-blocking query_revision_info; see mozci.utils.transport.submit. '''
+    return transport.submit(query_revision_info, repo_url, revision, full,
+                            callback=callback)
@@ -7,15 +7,33 @@
 """module for http authentication operations"""
 import getpass
 import os
+import threading
 
 CREDENTIALS_PATH = os.path.expanduser("~/.mozilla/credentials.cfg")
 DIRNAME = os.path.dirname(CREDENTIALS_PATH)
 
+# Credentials are only read from disk (or asked for) once per process
+_CREDENTIALS = None
+# Threads which need them at the same time wait for the first one to read them
+_CREDENTIALS_LOCK = threading.Lock()
+
 
 def get_credentials():
     """ Returns credentials for http access either from
     disk or directly from the user (which we store)
     """
+    if _CREDENTIALS is not None:
+        return _CREDENTIALS
+
+    with _CREDENTIALS_LOCK:
+        return _read_credentials()
+
+
+def _read_credentials():
+    global _CREDENTIALS
+    if _CREDENTIALS is not None:
+        return _CREDENTIALS
+
     if not os.path.exists(DIRNAME):
         os.makedirs(DIRNAME)
 
@@ -36,7 +54,8 @@ def get_credentials():
 
         os.chmod(CREDENTIALS_PATH, 0600)
 
-    return https_username, https_password
+    _CREDENTIALS = (https_username, https_password)
+    return _CREDENTIALS
 
 
 def get_credentials_path():
@@ -0,0 +1,202 @@
+#! /usr/bin/env python
+"""
+This module keeps downloaded files in a directory of bounded size.
+
+Every entry of a :class:`DiskCache` is a file downloaded with
+:func:`mozci.utils.download.fetch_file` (so it is written atomically and
+revalidated with conditional requests) together with the files derived
+from it, which are named after it (e.g. ``builds-2015-02-23.js.gz.index``),
+and the files fetch_file keeps next to it (e.g. the ``.part`` file of a
+download in progress).
+
+Whenever we download something, the entries which were not used for
+longer than ``max_age`` seconds are removed, and then the least recently
+used ones until the directory is below ``max_bytes``. Entries whose lock
+files are held (e.g. while they are being downloaded or indexed) are left
+alone, and lock files are never removed.
+"""
+from __future__ import absolute_import
+import logging
+import os
+import threading
+import time
+
+from mozci.utils.download import fetch_file, file_lock
+
+LOCK_SUFFIX = ".lock"
+# fetch_file keeps these files next to the file it downloads, even before
+# the file itself exists
+SIDE_FILE_SUFFIXES = (".headers", ".part", LOCK_SUFFIX)
+
+LOG = logging.getLogger()
+
+
+class DiskCache(object):
+    ''' A directory of downloaded files with least recently used eviction. '''
+
+    def __init__(self, directory, max_bytes=None, max_age=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def path(self, name):
+        ''' Where the entry name is (or would be) stored. '''
+        return os.path.join(self.directory, name)
+
+    def fetch(self, name, url, ttl=None, decode_content=False):
+        '''
+        Make sure the entry name is an up to date copy of url (see
+        fetch_file) and return its path.
+
+        By default we store what the server sends (e.g. a gzip file) without
+        decoding it.
+        '''
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # Another process created it
+                if not os.path.isdir(self.directory):
+                    raise
+
+        path = self.path(name)
+        downloaded = fetch_file(url, path, ttl=ttl, decode_content=decode_content)
+        with self._lock:
+            if downloaded:
+                self.misses += 1
+            else:
+                self.hits += 1
+        self.touch(name)
+        if downloaded:
+            self.evict(keep=name)
+        return path
+
+    def touch(self, name):
+        ''' Mark the entry name as used now. '''
+        path = self.path(name)
+        if os.path.exists(path):
+            # We keep the modification time since we use it to validate
+            # downloads and derived files
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+
+    def _entries(self):
+        '''
+        Return a list of (name, files, size, last used) for every entry.
+        '''
+        if not os.path.isdir(self.directory):
+            return []
+
+        filenames = os.listdir(self.directory)
+        # The files of an entry are named after it, whether it exists or not
+        names = set(_entry_name(filename) for filename in filenames)
+        entries = {}
+        for filename in filenames:
+            # The shortest name before a dot which is an entry
+            name = filename
+            position = filename.find(".")
+            while position != -1:
+                if filename[:position] in names:
+                    name = filename[:position]
+                    break
+                position = filename.find(".", position + 1)
+            entries.setdefault(name, []).append(filename)
+
+        result = []
+        for name, files in sorted(entries.iteritems()):
+            if all(filename.endswith(LOCK_SUFFIX) for filename in files):
+                # Only the lock files of an evicted entry are left
+                continue
+            size = 0
+            last_used = 0
+            for filename in files:
+                try:
+                    statinfo = os.stat(self.path(filename))
+                except OSError:
+                    # It was removed in the meantime
+                    continue
+                size += statinfo.st_size
+                if filename == name:
+                    last_used = statinfo.st_atime
+            result.append((name, files, size, last_used))
+        return result
+
+    def _remove(self, files):
+        '''
+        Remove files unless one of their lock files is held; the lock files
+        stay since other threads or processes may be waiting for them. It
+        returns whether we removed them.
+        '''
+        lock_files = [f for f in files if f.endswith(LOCK_SUFFIX)]
+        return self._remove_locked(lock_files, [f for f in files if f not in lock_files])
+
+    def _remove_locked(self, lock_files, files):
+        if lock_files:
+            with file_lock(self.path(lock_files[0]), blocking=False) as locked:
+                return locked and self._remove_locked(lock_files[1:], files)
+
+        for filename in files:
+            try:
+                os.remove(self.path(filename))
+            except OSError:
+                pass
+        return True
+
+    def evict(self, keep=None):
+        '''
+        Remove the entries unused for longer than max_age and then the least
+        recently used ones until we use less than max_bytes. The entry keep
+        is never removed.
+        '''
+        entries = sorted(self._entries(), key=lambda entry: entry[3])
+        total_bytes = sum(entry[2] for entry in entries)
+        now = time.time()
+        for name, files, size, last_used in entries:
+            if name == keep:
+                continue
+            too_old = self.max_age is not None and now - last_used > self.max_age
+            too_big = self.max_bytes is not None and total_bytes > self.max_bytes
+            if not (too_old or too_big):
+                continue
+            if self._remove(files):
+                LOG.debug("Removed %s from %s" % (name, self.directory))
+                total_bytes -= size
+            else:
+                LOG.debug("%s is in use; we keep it." % name)
+
+    def stats(self):
+        '''
+        Return a dictionary describing the cache:
+
+        .. code-block:: python
+
+            {
+                "directory": string,
+                "entries": int,
+                "bytes": int,        # Including the derived files
+                "hits": int,         # Fetches which did not download anything
+                "misses": int,       # Fetches which downloaded the file
+                "hit_rate": float,   # Or None if nothing was fetched yet
+            }
+        '''
+        entries = self._entries()
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        return {
+            "directory": self.directory,
+            "entries": len(entries),
+            "bytes": sum(entry[2] for entry in entries),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": float(hits) / (hits + misses) if hits + misses else None,
+        }
+
+
+def _entry_name(filename):
+    ''' The name of the entry a file of fetch_file belongs to. '''
+    for suffix in SIDE_FILE_SUFFIXES:
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
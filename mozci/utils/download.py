@@ -0,0 +1,286 @@
+#! /usr/bin/env python
+"""
+This module helps us keep local copies of remote files up to date.
+
+Downloads are:
+
+* conditional: we send If-None-Match/If-Modified-Since based on the
+  ETag/Last-Modified headers of the last download, so an unchanged file
+  costs us a single 304 response.
+* atomic: we write into a temporary file and rename it into place, so
+  other processes never read a half-written file.
+* resumable: an interrupted transfer is continued with an HTTP Range
+  request (guarded by If-Range).
+* time bounded: while the local copy is younger than the TTL we do not
+  touch the network at all.
+"""
+from __future__ import absolute_import
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from mozci.utils import transport
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+LOG = logging.getLogger()
+
+_LOCKS = {}
+_LOCKS_LOCK = threading.Lock()
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _metadata_path(filename):
+    return filename + ".headers"
+
+
+def _part_path(filename):
+    return filename + ".part"
+
+
+def _lock_path(filename):
+    return filename + ".lock"
+
+
+def _load_metadata(filename):
+    path = _metadata_path(filename)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as fd:
+            return json.load(fd)
+    except ValueError:
+        return {}
+
+
+def _save_metadata(filename, metadata):
+    path = _metadata_path(filename)
+    tmp_path = "%s.%d" % (path, os.getpid())
+    with open(tmp_path, "w") as fd:
+        json.dump(metadata, fd)
+    atomic_rename(tmp_path, path)
+
+
+def temporary_path(path):
+    '''
+    Return the path of a new empty file next to path, to be renamed into
+    place with atomic_rename once it is complete. Every caller gets its own.
+    '''
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".",
+                                    prefix=os.path.basename(path) + ".", suffix=".tmp")
+    os.close(fd)
+    return tmp_path
+
+
+@contextmanager
+def file_lock(lock_path, blocking=True):
+    '''
+    Hold an exclusive lock on lock_path (which is created if needed) against
+    the other threads of this process and, where fcntl exists, against other
+    processes.
+
+    It yields whether we got the lock; with blocking=False it does not wait
+    for the thread or process holding it.
+    '''
+    with _LOCKS_LOCK:
+        thread_lock = _LOCKS.setdefault(lock_path, threading.Lock())
+    if not thread_lock.acquire(blocking):
+        yield False
+        return
+    try:
+        with open(lock_path, "ab") as lock_fd:
+            if fcntl:
+                try:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+                except IOError:
+                    if blocking:
+                        raise
+                    yield False
+                    return
+            try:
+                yield True
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_fd, fcntl.LOCK_UN)
+    finally:
+        thread_lock.release()
+
+
+def file_version(filename):
+    '''
+    Identify the copy of the remote file we have in filename. Unlike its
+    modification time, it does not change when the server tells us that our
+    copy is still valid.
+    '''
+    metadata = _load_metadata(filename)
+    validator = metadata.get("etag") or metadata.get("last_modified")
+    statinfo = os.stat(filename)
+    if validator:
+        return "%d:%s" % (statinfo.st_size, validator)
+    return "%d:%d" % (statinfo.st_size, int(statinfo.st_mtime))
+
+
+def atomic_rename(src, dst):
+    ''' Move src into dst so readers see either the old or the new file. '''
+    if os.name == "nt" and os.path.exists(dst):
+        # os.rename does not overwrite on Windows
+        os.remove(dst)
+    os.rename(src, dst)
+
+
+def is_fresh(filename, ttl):
+    '''
+    Determine if filename exists and was validated less than ttl seconds ago.
+    '''
+    if ttl is None or not os.path.exists(filename):
+        return False
+    age = time.time() - os.path.getmtime(filename)
+    return age < ttl
+
+
+def _validators(metadata):
+    headers = {}
+    if metadata.get("etag"):
+        headers["If-None-Match"] = metadata["etag"]
+    if metadata.get("last_modified"):
+        headers["If-Modified-Since"] = metadata["last_modified"]
+    return headers
+
+
+def _response_metadata(url, req):
+    return {
+        "url": url,
+        "etag": req.headers.get("etag"),
+        "last_modified": req.headers.get("last-modified"),
+        "content_encoding": req.headers.get("content-encoding"),
+    }
+
+
+def _can_resume(part_metadata, url, decode_content=True):
+    '''
+    Whether we can ask for the rest of a partial download. Ranges count
+    bytes as sent by the server, so the partial file must hold them as is:
+    either we store the raw body or the server did not encode it.
+    '''
+    if part_metadata.get("url") != url or \
+            not (part_metadata.get("etag") or part_metadata.get("last_modified")):
+        return False
+    if not part_metadata.get("content_encoding"):
+        return True
+    return part_metadata.get("raw") and not decode_content
+
+
+def _expected_length(req, offset, decode_content=True):
+    ''' Size the complete file should have, if the server tells us. '''
+    if decode_content and req.headers.get("content-encoding"):
+        # requests decodes the content; the length does not apply
+        return None
+    content_length = req.headers.get("content-length")
+    if content_length is None:
+        return None
+    return offset + int(content_length)
+
+
+def _download(url, filename, metadata, auth=None, decode_content=True):
+    '''
+    Fetch url into filename. It returns True if the file was replaced.
+    '''
+    part = _part_path(filename)
+    headers = {}
+    offset = 0
+    part_metadata = metadata.get("part", {})
+
+    if os.path.exists(part) and not _can_resume(part_metadata, url, decode_content):
+        LOG.debug("We cannot resume the download of %s; starting over." % url)
+        os.remove(part)
+    if os.path.exists(part):
+        offset = os.path.getsize(part)
+        headers["Range"] = "bytes=%d-" % offset
+        headers["If-Range"] = part_metadata.get("etag") or part_metadata["last_modified"]
+        LOG.debug("Resuming download of %s at byte %d" % (url, offset))
+    elif os.path.exists(filename):
+        headers.update(_validators(metadata))
+
+    req = transport.get(url, headers=headers, stream=True, auth=auth)
+
+    if req.status_code == 304:
+        LOG.debug("%s has not changed since our last download." % url)
+        os.utime(filename, None)
+        return False
+
+    if req.status_code == 416:
+        # Our partial file is not valid anymore; start from scratch
+        LOG.debug("The server rejected our range request for %s." % url)
+        os.remove(part)
+        metadata.pop("part", None)
+        return _download(url, filename, metadata, auth, decode_content)
+
+    assert req.status_code in (200, 206), \
+        "We could not fetch %s (status code: %s)" % (url, req.status_code)
+
+    if req.status_code == 200:
+        offset = 0
+        mode = "wb"
+    elif decode_content and req.headers.get("content-encoding"):
+        # The decoded range cannot be appended to what we have
+        LOG.debug("The server encoded the range of %s; starting over." % url)
+        req.close()
+        os.remove(part)
+        metadata.pop("part", None)
+        return _download(url, filename, metadata, auth, decode_content)
+    else:
+        mode = "ab"
+
+    new_metadata = _response_metadata(url, req)
+    metadata["part"] = dict(new_metadata, raw=not decode_content)
+    _save_metadata(filename, metadata)
+
+    expected_length = _expected_length(req, offset, decode_content)
+    if decode_content:
+        chunks = req.iter_content(chunk_size=CHUNK_SIZE)
+    else:
+        # Keep the bytes as the server sent them (e.g. gzip compressed)
+        chunks = req.raw.stream(CHUNK_SIZE, decode_content=False)
+    with open(part, mode) as fd:
+        for chunk in chunks:
+            if chunk:  # filter out keep-alive new chunks
+                fd.write(chunk)
+
+    if expected_length is not None and os.path.getsize(part) != expected_length:
+        raise Exception("We have received an incomplete file for %s. "
+                        "Run again to resume the download." % url)
+
+    atomic_rename(part, filename)
+    _save_metadata(filename, new_metadata)
+    return True
+
+
+def fetch_file(url, filename, ttl=None, auth=None, decode_content=True):
+    '''
+    Make sure that filename is an up to date copy of url.
+
+    If the file was validated less than ttl seconds ago we don't touch the
+    network. Otherwise, we send a conditional request and only download
+    the file if it has changed.
+
+    With decode_content=False we store the body as sent by the server even
+    if it has a Content-Encoding (e.g. gzip).
+
+    It returns True if a new copy of the file was written.
+    '''
+    if is_fresh(filename, ttl):
+        return False
+
+    # Only one thread or process downloads at a time; the others wait for it
+    with file_lock(_lock_path(filename)):
+        if is_fresh(filename, ttl):
+            return False
+        return _download(url, filename, _load_metadata(filename), auth, decode_content)
@@ -0,0 +1,140 @@
+#! /usr/bin/env python
+"""
+This module helps us avoid asking the same question twice within a run.
+
+Functions decorated with :func:`memoized` only remember their results
+within a :func:`run_scope` (e.g. for the duration of
+mozci.mozci.trigger_range). Every run has its own cache, which is only
+used by the thread which started it and the threads it hands work to
+(see :func:`bind`) and is dropped when the run is over. Other threads
+and calls outside of a run behave as usual, so long running processes
+don't keep serving stale data.
+
+When we know that something has changed (e.g. we have just posted a new
+job for a revision) we can drop the affected entries with
+:func:`invalidate`.
+"""
+from __future__ import absolute_import
+import functools
+import logging
+import threading
+from contextlib import contextmanager
+
+LOG = logging.getLogger()
+
+_LOCAL = threading.local()
+# The scopes which are running, so invalidate() can reach all of them
+_SCOPES = set()
+_LOCK = threading.Lock()
+
+
+class RunScope(object):
+    ''' The memoized results of one run. '''
+
+    def __init__(self):
+        self.cache = {}
+        self.lock = threading.Lock()
+
+
+def current_scope():
+    ''' Return the RunScope of the run of this thread or None. '''
+    return getattr(_LOCAL, "scope", None)
+
+
+@contextmanager
+def run_scope(scope=None):
+    ''' Memoize the calls of this thread while this context is active.
+
+    Without scope we start a new run unless this thread is in one already
+    (scopes can be nested); its cache is emptied when it exits. Given a scope
+    (see current_scope) the thread joins that run instead, e.g. a worker
+    thread of it; see bind.
+    '''
+    previous = current_scope()
+    owner = scope is None and previous is None
+    if owner:
+        scope = RunScope()
+        with _LOCK:
+            _SCOPES.add(scope)
+    elif scope is None:
+        scope = previous
+    _LOCAL.scope = scope
+    try:
+        yield scope
+    finally:
+        _LOCAL.scope = previous
+        if owner:
+            with _LOCK:
+                _SCOPES.discard(scope)
+            scope.cache.clear()
+
+
+def in_run_scope(function):
+    ''' Decorator which runs function inside of a run scope. '''
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with run_scope():
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+def bind(function):
+    ''' Return a function which calls function in the run scope of the
+    caller, e.g. to hand work over to a pool of threads.
+    '''
+    scope = current_scope()
+    if scope is None:
+        return function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with run_scope(scope):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+def active():
+    return current_scope() is not None
+
+
+def memoized(namespace):
+    ''' Decorator which memoizes a function (by its positional arguments)
+    under namespace while the calling thread is in a run scope.
+    '''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args):
+            scope = current_scope()
+            if scope is None:
+                return function(*args)
+
+            key = (namespace,) + args
+            with scope.lock:
+                if key in scope.cache:
+                    return scope.cache[key]
+            value = function(*args)
+            with scope.lock:
+                scope.cache[key] = value
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+def invalidate(namespace, *args):
+    ''' Forget memoized results of namespace whose arguments start with args
+    in every running scope.
+
+    For instance, invalidate("jobs_schedule", repo_name, revision).
+    '''
+    key_prefix = (namespace,) + args
+    with _LOCK:
+        scopes = list(_SCOPES)
+    for scope in scopes:
+        with scope.lock:
+            for key in [k for k in scope.cache if k[:len(key_prefix)] == key_prefix]:
+                LOG.debug("Forgetting memoized %s" % str(key))
+                del scope.cache[key]
@@ -3,10 +3,14 @@
 This module simply adds miscelanous code that the main modules can use.
 """
 from __future__ import absolute_import
+import functools
 import logging
+import threading
+import time
+from collections import deque, OrderedDict
+from contextlib import contextmanager
 
-import requests
-
+from mozci.utils import transport
 from mozci.utils.authentication import get_credentials
 
 LOG = logging.getLogger()
@@ -36,10 +40,275 @@ def _all_urls_reachable(urls, auth=None):
     for url in urls:
         url_tested = _public_url(url)
         LOG.debug("We are going to test if we can reach %s" % url_tested)
-        req = requests.head(url_tested, auth=get_credentials())
+        req = transport.head(url_tested, auth=get_credentials())
         if not req.ok:
             LOG.warning("We can't reach %s for this reason %s" %
                         (url, req.reason))
             return False
 
     return True
+
+
+class LRUCache(object):
+    ''' Thread-safe dictionary which only keeps the maxsize most recently
+        used entries.
+    '''
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            # Move the entry to the end since it is the most recently used
+            value = self._data.pop(key)
+            self._data[key] = value
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def lru_cache(maxsize=1024):
+    ''' Memoize a function of hashable positional arguments.
+
+        The cache can be emptied with decorated_function.cache_clear().
+    '''
+    def decorator(function):
+        cache = LRUCache(maxsize)
+        missing = object()
+
+        @functools.wraps(function)
+        def wrapper(*args):
+            value = cache.get(args, missing)
+            if value is missing:
+                value = function(*args)
+                cache[args] = value
+            return value
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator
+
+
+class Record(object):
+    ''' Base class of compact (__slots__ based) records of JSON objects.
+
+        Subclasses list the keys they keep in FIELDS and declare a slot for
+        each of them. Keys missing from the JSON object are left unset, so
+        records can still be read like the dictionaries they come from:
+        record["key"], record.get("key") and "key" in record.
+    '''
+    __slots__ = ()
+    FIELDS = ()
+
+    @classmethod
+    def from_json(cls, data):
+        record = cls()
+        for key in cls.FIELDS:
+            if key in data:
+                setattr(record, key, data[key])
+        return record
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.FIELDS and hasattr(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [key for key in self.FIELDS if hasattr(self, key)]
+
+    def to_dict(self):
+        data = {}
+        for key in self.FIELDS:
+            try:
+                data[key] = getattr(self, key)
+            except AttributeError:
+                pass
+        return data
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        for key, value in state.iteritems():
+            setattr(self, key, value)
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.to_dict())
+
+
+class TokenBucket(object):
+    ''' Rate limiter which allows on average "rate" calls per second with
+        bursts of up to "capacity" calls. It can be shared between threads.
+    '''
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        ''' Block until we are allowed to make one more call. '''
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.capacity,
+                                   self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AhoCorasick(object):
+    ''' Automaton which finds all occurrences of a set of words in a single
+        pass over a text (Aho-Corasick string matching).
+    '''
+
+    def __init__(self, words):
+        self.words = frozenset(words)
+        # State 0 is the root; every state has its transitions, its failure
+        # link and the words which end at it
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+
+        for word in self.words:
+            state = 0
+            for char in word:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                    self._goto[state][char] = next_state
+                state = next_state
+            self._output[state] = (word,)
+
+        # Breadth-first computation of the failure links
+        queue = deque(self._goto[0].itervalues())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].iteritems():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] += self._output[self._fail[next_state]]
+
+    def iter_matches(self, text):
+        ''' Yield (start, word) for every occurrence of a word in text. '''
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for word in output[state]:
+                yield index - len(word) + 1, word
+
+
+class ThreadLogBuffer(object):
+    ''' Hold back the log records emitted by threads doing work in parallel
+        so we can emit them later in a meaningful order.
+
+        .. code-block:: python
+
+            with ThreadLogBuffer() as log_buffer:
+                # In the worker threads
+                with log_buffer.capture() as records:
+                    do_work()
+                # In the main thread
+                log_buffer.replay(records)
+    '''
+
+    def __init__(self):
+        self._buffers = {}
+        self._handlers = []
+
+    def filter(self, record):
+        ''' logging.Filter interface; it is added to the root handlers. '''
+        if getattr(record, "_replay", False):
+            return True
+        records = self._buffers.get(threading.current_thread().ident)
+        if records is None:
+            return True
+        # A record goes through every handler; only keep it once
+        if not getattr(record, "_captured", False):
+            record._captured = True
+            records.append(record)
+        return False
+
+    def __enter__(self):
+        self._handlers = list(logging.getLogger().handlers)
+        for handler in self._handlers:
+            handler.addFilter(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        for handler in self._handlers:
+            handler.removeFilter(self)
+        self._handlers = []
+
+    @contextmanager
+    def capture(self):
+        ''' Buffer the records emitted by the current thread. '''
+        records = []
+        ident = threading.current_thread().ident
+        self._buffers[ident] = records
+        try:
+            yield records
+        finally:
+            del self._buffers[ident]
+
+    @staticmethod
+    def relog(records):
+        ''' Log records again from the current thread; they are buffered
+        again if it is capturing. '''
+        for record in records:
+            record._captured = False
+            logging.getLogger().handle(record)
+
+    def replay(self, records):
+        ''' Emit records through the handlers of the root logger. '''
+        for record in records:
+            record._replay = True
+            for handler in logging.getLogger().handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
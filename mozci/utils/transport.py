@@ -0,0 +1,149 @@
+#! /usr/bin/env python
+"""
+This module is the single place where mozci talks HTTP.
+
+* There is one requests.Session per host so connections are kept alive and
+  reused across calls (e.g. all self-serve requests share their TLS
+  connections).
+* Every request has a timeout (TIMEOUT) so a hung server can't hang us.
+* Idempotent requests (GET/HEAD) are retried with exponential backoff on
+  connection errors, timeouts and 5xx responses.
+
+It also owns a small shared pool of workers (see :func:`submit`) used by
+the async_* functions of mozci; it is as large as the connection pool of a
+host so asynchronous callers can't open more connections than we keep alive.
+"""
+from __future__ import absolute_import
+import logging
+import random
+import threading
+import time
+import urlparse
+from multiprocessing.pool import ThreadPool
+
+import requests
+from requests.adapters import HTTPAdapter
+
+LOG = logging.getLogger()
+
+# (connect timeout, read timeout) in seconds
+TIMEOUT = (10, 120)
+# Number of times we retry an idempotent request
+MAX_RETRIES = 3
+# We sleep about BACKOFF_FACTOR * 2 ** attempt seconds between attempts
+BACKOFF_FACTOR = 0.5
+# Maximum number of connections we keep alive per host
+POOL_SIZE = 10
+
+RETRY_STATUS_CODES = frozenset([500, 502, 503, 504])
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD"])
+
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+_WORKERS = {"pool": None}
+
+
+def get_session(url):
+    ''' Return the requests.Session used for the host of url. '''
+    parsed_url = urlparse.urlparse(url)
+    key = (parsed_url.scheme, parsed_url.netloc)
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(key)
+        if session is None:
+            LOG.debug("Creating HTTP session for %s://%s" % key)
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount("%s://" % parsed_url.scheme, adapter)
+            _SESSIONS[key] = session
+    return session
+
+
+def close_sessions():
+    ''' Close all connections we keep alive. '''
+    with _SESSIONS_LOCK:
+        for session in _SESSIONS.itervalues():
+            session.close()
+        _SESSIONS.clear()
+
+
+def _call(function, args, kwargs):
+    try:
+        return function(*args, **kwargs)
+    except Exception:
+        raise
+    except BaseException, e:
+        # The workers of a ThreadPool only deliver Exceptions; anything else
+        # (e.g. the SystemExit of exit()) would leave the AsyncResult pending
+        # forever
+        raise RuntimeError("%s exited: %r" % (getattr(function, "__name__", function), e))
+
+
+def submit(function, *args, **kwargs):
+    '''
+    Call function(*args, **kwargs) in the shared pool of workers without
+    blocking the caller.
+
+    It returns a multiprocessing AsyncResult: use .ready() to poll it and
+    .get(timeout) to collect the value (or the exception). If a callback
+    keyword argument is given, it is called with the value once it is
+    available (e.g. to hand it over to an event loop). If function exits
+    (e.g. SystemExit) .get() raises a RuntimeError.
+    '''
+    callback = kwargs.pop("callback", None)
+    with _SESSIONS_LOCK:
+        if _WORKERS["pool"] is None:
+            _WORKERS["pool"] = ThreadPool(POOL_SIZE)
+        pool = _WORKERS["pool"]
+    return pool.apply_async(_call, (function, args, kwargs), callback=callback)
+
+
+def backoff(attempt):
+    ''' Seconds to wait before retrying for the attempt-th time.
+    We add +/-50% of jitter so clients which failed together don't all
+    retry at the same moment.'''
+    return BACKOFF_FACTOR * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+def request(method, url, retries=None, **kwargs):
+    '''
+    Same as requests.request() but it goes through the session of the host,
+    it applies TIMEOUT unless a timeout is given and it retries idempotent
+    requests.
+    '''
+    method = method.upper()
+    if retries is None:
+        retries = MAX_RETRIES if method in IDEMPOTENT_METHODS else 0
+    kwargs.setdefault("timeout", TIMEOUT)
+    session = get_session(url)
+
+    attempt = 0
+    while True:
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout), e:
+            if attempt >= retries:
+                raise
+            LOG.debug("%s %s failed (%s); retrying." % (method, url, e))
+        else:
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= retries:
+                return response
+            LOG.debug("%s %s returned %d; retrying." %
+                      (method, url, response.status_code))
+            response.close()
+
+        time.sleep(backoff(attempt))
+        attempt += 1
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def head(url, **kwargs):
+    # Like requests.head() we don't follow redirects by default
+    kwargs.setdefault("allow_redirects", False)
+    return request("HEAD", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
@@ -26,7 +26,7 @@ import bugsy
 import logging
 import os
 from argparse import ArgumentParser
-from mozci.mozci import query_repo_name_from_buildername
+from mozci.platforms import parse_buildername
 
 bugzilla = bugsy.Bugsy()
 logging.basicConfig(format='%(asctime)s %(levelname)s:\t %(message)s',
@@ -75,7 +75,7 @@ def check_repository(buildername):
     Function to check if the repository in buildername matches the supported repositories.
     '''
     supported_repositories = ['fx-team', 'mozilla-inbound', 'mozilla-aurora']
-    repo_name = query_repo_name_from_buildername(buildername)
+    repo_name = parse_buildername(buildername).repo_name
     if repo_name not in supported_repositories:
         raise Exception('The script supports only for fx-team, mozilla-inbound, mozilla-aurora')
 
@@ -0,0 +1,107 @@
+#! /usr/bin/env python
+'''
+Compare the memory used by the jobs of a buildjson day file when they are
+kept as the decoded JSON dictionaries and as BuildjsonJob records.
+
+    python scripts/misc/benchmark_buildjson_memory.py [builds-2015-02-23.js]
+
+Without a file we generate a day of synthetic jobs.
+'''
+import json
+import os
+import sys
+import tempfile
+import time
+
+from mozci.sources.buildjson import BuildjsonJob
+
+SYNTHETIC_JOBS = 200000
+
+
+def synthetic_day(path):
+    builds = []
+    for i in xrange(SYNTHETIC_JOBS):
+        builds.append({
+            "builder_id": i % 5000,
+            "buildnumber": i,
+            "starttime": 1424649600 + i,
+            "endtime": 1424650600 + i,
+            "requesttime": 1424649000 + i,
+            "result": i % 7,
+            "reason": "scheduler",
+            "request_ids": [60000000 + i],
+            "slave_id": i % 3000,
+            "master_id": 80,
+            "claimed_by_name": "buildbot-master%d.bb.releng.scl3.mozilla.com:/builds/buildbot"
+                               % (i % 100),
+            "properties": {
+                "buildername": "Ubuntu VM 12.04 x64 mozilla-inbound opt test mochitest-%d"
+                               % (i % 5),
+                "buildid": "20150223%06d" % (i % 1000000),
+                "revision": "%040x" % i,
+                "repo_path": "integration/mozilla-inbound",
+                "branch": "mozilla-inbound",
+                "log_url": "http://ftp.mozilla.org/pub/mozilla.org/firefox/tinderbox-builds/"
+                           "mozilla-inbound-linux64/%d/log-%d.txt.gz" % (i, i),
+                "slavename": "tst-linux64-spot-%d" % (i % 3000),
+                "platform": "linux64",
+                "product": "firefox",
+                "project": "",
+                "repository": "",
+                "script_repo_revision": "production",
+                "builduid": "%032x" % i,
+                "master": "http://buildbot-master%d.bb.releng.scl3.mozilla.com:8201/"
+                          % (i % 100),
+                "stage_platform": "linux64",
+                "basedir": "/builds/slave/test",
+                "buildnumber": i,
+                "request_times": {"%d" % (60000000 + i): 1424649000 + i},
+                "blobber_files": "{\"log.txt\": \"https://blobber/%d\"}" % i,
+            },
+        })
+    with open(path, "w") as fd:
+        json.dump({"builds": builds}, fd)
+
+
+def deep_size(obj, seen=None):
+    ''' Size in bytes of obj and everything it references (once). '''
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.iteritems())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_size(item, seen) for item in obj)
+    elif hasattr(obj, "__slots__"):
+        for cls in type(obj).__mro__:
+            for slot in getattr(cls, "__slots__", ()):
+                if hasattr(obj, slot):
+                    size += deep_size(getattr(obj, slot), seen)
+    return size
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+    else:
+        path = os.path.join(tempfile.mkdtemp(), "builds-synthetic.js")
+        print "Generating %d jobs into %s" % (SYNTHETIC_JOBS, path)
+        synthetic_day(path)
+
+    start = time.time()
+    with open(path) as fd:
+        builds = json.load(fd)["builds"]
+    print "Decoding %d jobs: %.2f s" % (len(builds), time.time() - start)
+
+    start = time.time()
+    records = [BuildjsonJob.from_json(job) for job in builds]
+    print "Building the records: %.2f s" % (time.time() - start)
+
+    dicts_size = deep_size(builds)
+    records_size = deep_size(records)
+    print "JSON dictionaries: %6.1f MB" % (dicts_size / 1024.0 ** 2)
+    print "BuildjsonJob:      %6.1f MB (%.0f%% less)" % (
+        records_size / 1024.0 ** 2, 100 - 100.0 * records_size / dicts_size)
@@ -0,0 +1,31 @@
+#! /usr/bin/env python
+'''
+Measure how long it takes to import mozci.mozci in a fresh interpreter.
+
+    python scripts/misc/benchmark_import.py [--runs N]
+'''
+import argparse
+import subprocess
+import sys
+import time
+
+
+def _time_command(code, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.time()
+        subprocess.check_call([sys.executable, "-c", code])
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10,
+                        help="Number of imports to measure (we report the fastest).")
+    args = parser.parse_args()
+
+    baseline = _time_command("pass", args.runs)
+    for module in ("mozci.mozci", "mozci.platforms"):
+        elapsed = _time_command("import %s" % module, args.runs) - baseline
+        print "import %-20s %6.1f ms" % (module, elapsed * 1000)
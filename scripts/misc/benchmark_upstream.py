@@ -0,0 +1,52 @@
+#! /usr/bin/env python
+'''
+Compare determine_upstream_builder called once per builder with
+determine_upstream_builders over the builders of test/test_platforms.json.
+
+    python scripts/misc/benchmark_upstream.py
+'''
+import json
+import os
+import time
+
+from mozci.platforms import (
+    determine_upstream_builder,
+    determine_upstream_builders,
+    warm_up,
+)
+from mozci.sources.allthethings import fetch_allthethings_data
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       os.pardir, os.pardir, "test", "test_platforms.json")
+
+if __name__ == "__main__":
+    with open(FIXTURE) as fd:
+        expected = json.load(fd)
+
+    builders_data = fetch_allthethings_data()["builders"]
+    builders = {}
+    for buildername in expected:
+        if buildername not in builders_data:
+            continue
+        repo_path = builders_data[buildername]["properties"].get("repo_path")
+        if repo_path:
+            builders[buildername] = repo_path.split("/")[-1]
+
+    start = time.time()
+    warm_up()
+    print "Building the platform tables: %.1f ms" % ((time.time() - start) * 1000)
+
+    start = time.time()
+    one_by_one = dict((b, determine_upstream_builder(b, repo_name))
+                      for b, repo_name in builders.iteritems())
+    print "%d calls to determine_upstream_builder: %.1f ms" % (
+        len(builders), (time.time() - start) * 1000)
+
+    start = time.time()
+    batch = determine_upstream_builders(builders.keys())
+    print "1 call to determine_upstream_builders: %.1f ms" % (
+        (time.time() - start) * 1000)
+
+    assert one_by_one == batch
+    mismatches = [b for b in builders if batch[b] != expected[b]]
+    print "%d builder(s) do not match test_platforms.json" % len(mismatches)
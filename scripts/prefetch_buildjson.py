@@ -0,0 +1,52 @@
+#! /usr/bin/env python
+# This script downloads and indexes the buildjson files of a range of days
+# so that investigating their jobs starts with a warm cache
+import argparse
+import logging
+import time
+
+from mozci.sources.buildjson import PREFETCH_WORKERS, cache_stats, prefetch_days
+from mozci.utils.tzone import utc_day
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:\t %(message)s',
+                    datefmt='%m/%d/%Y %I:%M:%S')
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        usage='%(prog)s --start-date YYYY-MM-DD [--end-date YYYY-MM-DD] [OPTION]...')
+    parser.add_argument('--start-date', dest='start_date', required=True,
+                        help='The first UTC day to fetch (e.g. 2015-02-23).')
+    # Today's file is only published once the day is over
+    parser.add_argument('--end-date', dest='end_date',
+                        default=utc_day(time.time() - 24 * 60 * 60),
+                        help='The last UTC day to fetch (yesterday by default).')
+    parser.add_argument('--workers', dest='workers', type=int, default=PREFETCH_WORKERS,
+                        help='Number of files to download at the same time.')
+    parser.add_argument('--processes', dest='processes', type=int,
+                        help='Number of processes indexing the files (as many '
+                        'as CPUs by default).')
+    parser.add_argument('--debug', action='store_const', const=True,
+                        help='Print debugging information')
+    args = parser.parse_args()
+
+    if args.debug:
+        LOG.setLevel(logging.DEBUG)
+        LOG.info("Setting DEBUG level")
+
+    paths = prefetch_days(args.start_date, args.end_date,
+                          workers=args.workers, processes=args.processes)
+    for date, path in paths.iteritems():
+        if path is None:
+            LOG.warning("%s: we could not fetch it" % date)
+        else:
+            LOG.info("%s: %s" % (date, path))
+
+    stats = cache_stats()
+    LOG.info("The cache in %s has %d files (%.1f MB)." %
+             (stats["directory"], stats["entries"], stats["bytes"] / (1024.0 * 1024)))
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,12 @@ import logging
 import urllib
 
 from argparse import ArgumentParser
-from mozci.mozci import trigger_range, query_repo_url, query_repo_name_from_buildername
+from mozci.mozci import (
+    query_builders_matching,
+    query_repo_name_from_buildername,
+    query_repo_url,
+    trigger_range,
+)
 from mozci.sources.pushlog import query_revisions_range_from_revision_and_delta
 from mozci.sources.pushlog import query_revisions_range, query_revision_info, query_pushid_range
 
@@ -18,10 +23,23 @@ def parse_args(argv=None):
     parser = ArgumentParser()
 
     parser.add_argument('-b', "--buildername",
-                        dest="buildername",
-                        required=True,
+                        dest="buildernames",
+                        action="append",
+                        default=[],
                         type=str,
-                        help="The buildername used in Treeherder.")
+                        help="The buildername used in Treeherder. "
+                             "It can be given more than once.")
+
+    parser.add_argument("--pattern",
+                        dest="pattern",
+                        type=str,
+                        help="Trigger every builder matching this shell style "
+                             "pattern (e.g. \"... mochitest-*\").")
+
+    parser.add_argument("--regex",
+                        action="store_true",
+                        dest="regex",
+                        help="--pattern is a regular expression.")
 
     parser.add_argument("--times",
                         dest="times",
@@ -51,6 +69,12 @@ def parse_args(argv=None):
                         type=int,
                         help="Number of revisions to go back from current revision (--rev).")
 
+    parser.add_argument("-j", "--jobs",
+                        dest="jobs",
+                        type=int,
+                        default=1,
+                        help="Number of revisions to process concurrently.")
+
     parser.add_argument("--dry-run",
                         action="store_true",
                         dest="dry_run",
@@ -62,12 +86,33 @@ def parse_args(argv=None):
                         help="set debug for logging.")
 
     options = parser.parse_args(argv)
+    if not options.buildernames and not options.pattern:
+        parser.error("Use -b/--buildername or --pattern.")
     return options
 
 
+def determine_buildernames(options):
+    '''
+    Return the buildernames given with -b plus the ones matching --pattern.
+    '''
+    buildernames = list(options.buildernames)
+    if options.pattern:
+        matching_builders = query_builders_matching(options.pattern, options.regex)
+        if not matching_builders:
+            raise Exception("No builder matches %s" % options.pattern)
+        LOG.info("%d builder(s) match %s" % (len(matching_builders), options.pattern))
+        buildernames.extend(b for b in matching_builders if b not in buildernames)
+    return buildernames
+
+
 if __name__ == "__main__":
     options = parse_args()
-    repo_name = query_repo_name_from_buildername(options.buildername)
+    buildernames = determine_buildernames(options)
+    repo_names = set(query_repo_name_from_buildername(b) for b in buildernames)
+    if len(repo_names) > 1:
+        raise Exception("The builders belong to more than one repository: %s" %
+                        ", ".join(sorted(repo_names)))
+    repo_name = repo_names.pop()
     repo_url = query_repo_url(repo_name)
 
     if (options.start or options.end) and (options.delta or options.push_revision):
@@ -99,19 +144,31 @@ if __name__ == "__main__":
         LOG.setLevel(logging.INFO)
 
     try:
-        trigger_range(
-            buildername=options.buildername,
+        results = trigger_range(
+            buildername=buildernames,
             repo_name=repo_name,
             revisions=revlist,
             times=options.times,
-            dry_run=options.dry_run
+            dry_run=options.dry_run,
+            jobs=options.jobs
         )
     except Exception, e:
         LOG.exception(e)
         exit(1)
 
-    LOG.info('https://treeherder.mozilla.org/#/jobs?%s' %
-             urllib.urlencode({'repo': repo_name,
-                               'fromchange': revlist[0],
-                               'tochange': revlist[-1],
-                               'filter-searchStr': options.buildername}))
+    failed_revisions = []
+    for result in results:
+        if result["error"] and result["revision"] not in failed_revisions:
+            failed_revisions.append(result["revision"])
+    if failed_revisions:
+        LOG.error("We could not process these revisions: %s" % ", ".join(failed_revisions))
+
+    treeherder_query = {'repo': repo_name,
+                        'fromchange': revlist[0],
+                        'tochange': revlist[-1]}
+    if len(buildernames) == 1:
+        treeherder_query['filter-searchStr'] = buildernames[0]
+    LOG.info('https://treeherder.mozilla.org/#/jobs?%s' % urllib.urlencode(treeherder_query))
+
+    if failed_revisions:
+        exit(1)
@@ -0,0 +1,115 @@
+"""
+Tests for mozci.sources.allthethings.AllTheThings
+"""
+import json
+import os
+
+import pytest
+
+from mozci.sources import allthethings
+
+DATA = {
+    "builders": {
+        "Platform repo build": {"shortname": "repo-build"},
+        "Platform repo opt test suite-1": {"shortname": "repo-test-suite-1"},
+    },
+    "schedulers": {"repo tests": {"downstream": ["Platform repo opt test suite-1"]}},
+}
+
+
+def write_allthethings(data, mtime):
+    path = allthethings._path(allthethings.FILENAME)
+    with open(path, "w") as fd:
+        json.dump(data, fd)
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def counters(tmpdir, monkeypatch):
+    ''' Work in tmpdir without the network and count the parses and hashes. '''
+    monkeypatch.setattr(allthethings, "CACHE_DIR", str(tmpdir))
+    monkeypatch.setattr(allthethings, "_fetch", lambda ttl: None)
+    counters = {"parse": 0, "digest": 0}
+    load = json.load
+    file_digest = allthethings._file_digest
+
+    def counting_load(fd):
+        counters["parse"] += 1
+        return load(fd)
+
+    def counting_file_digest(filename):
+        counters["digest"] += 1
+        return file_digest(filename)
+
+    monkeypatch.setattr(allthethings.json, "load", counting_load)
+    monkeypatch.setattr(allthethings, "_file_digest", counting_file_digest)
+    write_allthethings(DATA, 1000)
+    return counters
+
+
+def test_the_file_is_parsed_once(counters):
+    registry = allthethings.AllTheThings().load()
+    assert registry.builders == frozenset(DATA["builders"])
+    assert registry.shortnames["repo-build"] == "Platform repo build"
+    assert registry.schedulers == DATA["schedulers"]
+
+    registry.load()
+    registry.load()
+    assert counters == {"parse": 1, "digest": 1}
+
+
+def test_the_registry_follows_content_changes(counters):
+    registry = allthethings.AllTheThings().load()
+
+    # A new modification time with the same content is only hashed
+    write_allthethings(DATA, 2000)
+    registry.load()
+    assert counters == {"parse": 1, "digest": 2}
+
+    data = dict(DATA, builders={"Platform repo pgo build": {"shortname": "repo-pgo"}})
+    write_allthethings(data, 3000)
+    registry.load()
+    assert counters == {"parse": 2, "digest": 3}
+    assert registry.builders == frozenset(["Platform repo pgo build"])
+    assert registry.shortnames == {"repo-pgo": "Platform repo pgo build"}
+
+
+def test_snapshots_are_loaded_without_parsing(counters, tmpdir):
+    registry = allthethings.AllTheThings().load()
+    assert registry.derived("table", lambda r: sorted(r.builders)) == sorted(DATA["builders"])
+    assert os.path.exists(str(tmpdir.join(allthethings.SNAPSHOT_FILENAME)))
+
+    def build_table(registry):
+        raise AssertionError("The table should come from the snapshot")
+
+    # A new process restores the indexes and the derived tables
+    other_registry = allthethings.AllTheThings().load()
+    assert other_registry.builders == registry.builders
+    assert other_registry.shortnames == registry.shortnames
+    assert other_registry.derived("table", build_table) == sorted(DATA["builders"])
+    assert counters == {"parse": 1, "digest": 1}
+
+    # The snapshot does not apply to other content
+    write_allthethings(dict(DATA, builders={}), 2000)
+    assert allthethings.AllTheThings().load().builders == frozenset()
+    assert counters == {"parse": 2, "digest": 2}
+
+
+def test_files_are_kept_in_the_cache_directory(tmpdir, monkeypatch):
+    cache_dir = tmpdir.join("cache")
+    monkeypatch.setattr(allthethings, "CACHE_DIR", str(cache_dir))
+    monkeypatch.chdir(tmpdir)
+    fetched = []
+
+    def fetch_file(url, filename, ttl=None):
+        fetched.append(filename)
+        with open(filename, "w") as fd:
+            json.dump(DATA, fd)
+
+    monkeypatch.setattr(allthethings, "fetch_file", fetch_file)
+    allthethings.AllTheThings().load()
+
+    assert fetched == [str(cache_dir.join(allthethings.FILENAME))]
+    assert sorted(os.listdir(str(cache_dir))) == \
+        [allthethings.FILENAME, allthethings.SNAPSHOT_FILENAME]
+    assert tmpdir.listdir() == [cache_dir]
@@ -0,0 +1,48 @@
+"""
+Tests for the async_* functions of mozci
+"""
+import pytest
+
+from mozci import mozci
+from mozci.sources import buildapi
+from mozci.utils import transport
+
+TIMEOUT = 10
+
+
+def test_async_trigger_job(monkeypatch):
+    def trigger_job(repo_name, revision, buildername, times, files, dry_run):
+        return [(repo_name, revision, buildername, times, files, dry_run)]
+
+    monkeypatch.setattr(mozci, "trigger_job", trigger_job)
+    values = []
+    result = mozci.async_trigger_job("repo", "rev", "builder", times=2,
+                                     callback=values.append)
+    expected = [("repo", "rev", "builder", 2, None, False)]
+    assert result.get(TIMEOUT) == expected
+    assert values == [expected]
+
+
+def test_async_trigger_range_with_invalid_builders(monkeypatch):
+    monkeypatch.setattr(mozci, "valid_builder", lambda buildername: False)
+    result = mozci.async_trigger_range("builder", "repo", ["rev"], 1, dry_run=True)
+
+    # trigger_range exits; we get an error instead of waiting forever
+    result.wait(TIMEOUT)
+    assert result.ready()
+    with pytest.raises(RuntimeError):
+        result.get()
+
+
+def test_async_query_jobs_schedule(monkeypatch):
+    monkeypatch.setattr(buildapi, "query_jobs_schedule",
+                        lambda repo_name, revision: [revision])
+    assert buildapi.async_query_jobs_schedule("repo", "rev").get(TIMEOUT) == ["rev"]
+
+
+def test_submit_delivers_exceptions():
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        transport.submit(fail).get(TIMEOUT)
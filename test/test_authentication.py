@@ -0,0 +1,35 @@
+"""
+Tests for mozci.utils.authentication
+"""
+import threading
+import time
+
+from mozci.utils import authentication
+
+
+def test_credentials_are_asked_for_once(tmpdir, monkeypatch):
+    monkeypatch.setattr(authentication, "DIRNAME", str(tmpdir))
+    monkeypatch.setattr(authentication, "CREDENTIALS_PATH", str(tmpdir.join("credentials.cfg")))
+    monkeypatch.setattr(authentication, "_CREDENTIALS", None)
+    prompts = []
+
+    def raw_input(prompt):
+        prompts.append(prompt)
+        # Give the other threads a chance to ask too
+        time.sleep(0.1)
+        return "user@mozilla.com"
+
+    monkeypatch.setattr(authentication, "raw_input", raw_input, raising=False)
+    monkeypatch.setattr(authentication.getpass, "getpass", lambda: "password")
+
+    credentials = []
+    threads = [threading.Thread(target=lambda: credentials.append(
+        authentication.get_credentials())) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(prompts) == 1
+    assert credentials == [("user@mozilla.com", "password")] * 5
+    assert tmpdir.join("credentials.cfg").read() == "user@mozilla.com\npassword\n"
@@ -0,0 +1,114 @@
+"""
+Tests for the buildername parser in mozci.platforms. We use hand-made
+platform tables so we don't need allthethings.json.
+"""
+import pytest
+
+import mozci.platforms
+from mozci.platforms import filter_buildernames, match_repo_name, parse_buildername
+
+BUILD = "Linux x86-64 mozilla-inbound leak test build"
+TEST = "Ubuntu VM 12.04 x64 mozilla-inbound debug test mochitest-3"
+TALOS = "Ubuntu HW 12.04 x64 mozilla-inbound pgo talos chromez"
+ASH_TEST = "Ubuntu VM 12.04 x64 ash debug test mochitest-1"
+NIGHTLY = "Linux x86-64 mozilla-inbound nightly"
+# Test jobs whose scheduler is not named "tests-..." are not in test_to_build
+OTHER_TEST = "Ubuntu VM 12.04 x64 mozilla-inbound opt test web-platform-tests-2"
+OTHER_TALOS = "Ubuntu HW 12.04 x64 mozilla-inbound talos dromaeojs"
+
+TABLES = {
+    'test_to_build': {TEST: BUILD, TALOS: BUILD, ASH_TEST: None},
+    'builder_to_repo_platform': {
+        BUILD: ("mozilla-inbound", "linux64"),
+        TEST: ("mozilla-inbound", "linux64"),
+        TALOS: ("mozilla-inbound", "linux64"),
+        ASH_TEST: ("ash", "linux64"),
+        NIGHTLY: ("mozilla-inbound", "linux64"),
+        OTHER_TEST: ("mozilla-inbound", "linux64"),
+        OTHER_TALOS: ("mozilla-inbound", "linux64"),
+    },
+}
+
+REPOSITORIES = ["ash", "try", "try-comm-central", "mozilla-inbound",
+                "mozilla-b2g34_v2_1", "mozilla-b2g34_v2_1s"]
+
+
+@pytest.fixture(autouse=True)
+def fake_tables(monkeypatch):
+    monkeypatch.setattr(mozci.platforms, "_platform_tables", lambda: TABLES)
+    monkeypatch.setattr(mozci.platforms.buildapi, "query_repositories",
+                        lambda clobber=False: dict.fromkeys(REPOSITORIES))
+    mozci.platforms._parse_buildername.cache_clear()
+
+
+def test_parse_test_job():
+    info = parse_buildername(TEST)
+    assert info.repo_name == "mozilla-inbound"
+    assert info.platform == "linux64"
+    assert info.build_type == "debug"
+    assert info.job_type == "test"
+    assert info.suite == "mochitest"
+    assert info.chunk == 3
+
+
+def test_parse_build_job():
+    '''"leak test build" is a build job even if it contains the word test'''
+    info = parse_buildername(BUILD)
+    assert info.job_type == "build"
+    assert info.build_type == "opt"
+    assert info.suite is None
+
+
+def test_parse_talos_job():
+    info = parse_buildername(TALOS)
+    assert info.job_type == "talos"
+    assert info.build_type == "pgo"
+    assert info.suite == "chromez"
+    assert info.chunk is None
+
+
+def test_parse_unknown_builder():
+    info = parse_buildername("b2g_emulator_vm mozilla-b2g34_v2_1s opt test reftest-10")
+    assert info.repo_name == "mozilla-b2g34_v2_1s"
+    assert info.platform is None
+    assert info.job_type == "test"
+    assert (info.suite, info.chunk) == ("reftest", 10)
+
+
+def test_match_repo_name_whole_words():
+    assert match_repo_name("Ubuntu VM 12.04 x64 try-comm-central opt test xpcshell",
+                           REPOSITORIES) == "try-comm-central"
+    assert match_repo_name("Windows 7 32-bit washington opt test jsreftest",
+                           REPOSITORIES) is None
+    assert match_repo_name("b2g_mozilla-b2g34_v2_1_emulator_dep",
+                           REPOSITORIES) == "mozilla-b2g34_v2_1"
+
+
+def test_filter_buildernames():
+    assert filter_buildernames(TABLES['builder_to_repo_platform'].keys(),
+                               repo_name="mozilla-inbound", build_type="debug",
+                               suite="mochitest") == [TEST]
+
+
+@pytest.mark.parametrize("buildername, job_type", [
+    (TEST, "test"),
+    (TALOS, "talos"),
+    (BUILD, "build"),
+    (NIGHTLY, "nightly"),
+    (OTHER_TEST, "test"),
+    (OTHER_TALOS, "talos"),
+    # Builders allthethings.json does not list
+    ("Ubuntu VM 12.04 x64 mozilla-inbound debug test crashtest", "test"),
+    ("Ubuntu HW 12.04 x64 mozilla-inbound talos tp5o", "talos"),
+    ("Linux mozilla-inbound leak test build", "build"),
+    ("Linux x86-64 mozilla-inbound pgo-build", "build"),
+])
+def test_job_type(buildername, job_type):
+    assert parse_buildername(buildername).job_type == job_type
+    assert mozci.platforms.is_downstream(buildername) == (job_type in ("test", "talos"))
+
+
+def test_match_repo_name_from_buildapi_repositories():
+    '''Without repo_names we use the repositories known to buildapi'''
+    assert match_repo_name("Ubuntu VM 12.04 x64 try opt test xpcshell") == "try"
+    assert match_repo_name("Ubuntu VM 12.04 x64 tryout opt test xpcshell") is None
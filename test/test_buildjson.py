@@ -0,0 +1,349 @@
+"""
+Tests for mozci.sources.buildjson
+"""
+import cPickle
+import gzip
+import json
+import os
+import threading
+import time
+from cStringIO import StringIO
+
+import pytest
+
+from mozci.sources import buildjson
+from mozci.sources.buildjson import BuildjsonJob
+
+DATE = "2015-02-23"
+
+JOB = {
+    "builder_id": 1,
+    "starttime": 10,
+    "endtime": 20,
+    "reason": "scheduler",
+    "request_ids": [100, 101],
+    "result": 0,
+    "properties": {
+        "buildername": "Platform repo build",
+        "packageUrl": "http://server/installer",
+        "testsUrl": None,
+        "platform": "platform",
+    },
+}
+
+
+def test_record():
+    job = BuildjsonJob.from_json(JOB)
+    assert job["endtime"] == 20
+    assert 101 in job["request_ids"]
+    assert "reason" not in job
+    assert "slave_id" not in job
+    # Only the properties we use are kept
+    assert job["properties"] == {"buildername": "Platform repo build",
+                                 "packageUrl": "http://server/installer"}
+    assert job.get_property("packageUrl") == "http://server/installer"
+    assert job.get_property("testsUrl", "default") == "default"
+    assert job.get_property("platform") is None
+
+
+def test_record_pickling():
+    job = BuildjsonJob.from_json(JOB)
+    assert cPickle.loads(cPickle.dumps(job, 2)).to_dict() == job.to_dict()
+
+
+def write_day_file(path, builds):
+    with gzip.open(path, "wb") as fd:
+        json.dump({"builds": builds}, fd)
+
+
+def day_file(tmpdir, monkeypatch):
+    ''' Use tmpdir as the cache and return where the file of DATE goes. '''
+    monkeypatch.setattr(buildjson, "CACHE_DIR", str(tmpdir))
+    return buildjson.buildjson_cache().path(buildjson._day_file_name(DATE))
+
+
+def test_day_file_index(tmpdir, monkeypatch):
+    data_file = day_file(tmpdir, monkeypatch)
+    other_job = dict(JOB, request_ids=[102], endtime=30)
+    write_day_file(data_file, [JOB, other_job])
+
+    # The first lookup builds the index
+    assert buildjson._query_day_file(DATE, [102])[102]["endtime"] == 30
+    assert os.path.exists(data_file + ".index")
+
+    # The next ones don't load the day file
+    def iter_builds(data_file, predicate=None):
+        raise AssertionError("We should have used the index")
+
+    monkeypatch.setattr(buildjson, "iter_builds", iter_builds)
+    jobs = buildjson._query_day_file(DATE, [100, 101, 102, 1])
+    assert sorted(jobs) == [100, 101, 102]
+    assert jobs[101].to_dict() == BuildjsonJob.from_json(JOB).to_dict()
+
+
+def test_day_file_index_is_rebuilt(tmpdir, monkeypatch):
+    data_file = day_file(tmpdir, monkeypatch)
+    write_day_file(data_file, [JOB])
+    assert buildjson._query_day_file(DATE, [102]) == {}
+
+    # A new version of the day file has more jobs
+    write_day_file(data_file, [JOB, dict(JOB, request_ids=[102], endtime=30)])
+    assert buildjson._query_day_file(DATE, [102])[102]["endtime"] == 30
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, content="", last_modified=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {"last-modified": last_modified} if last_modified else {}
+
+
+def fake_4hr_server(monkeypatch, builds):
+    '''
+    Serve builds (a list we can change later on) as builds-4hr.js.gz and
+    return the list of If-Modified-Since headers we receive.
+    '''
+    received = []
+
+    def get(url, headers=None):
+        assert url.endswith(buildjson.BUILDS_4HR_FILE)
+        received.append((headers or {}).get("If-Modified-Since"))
+        version = "version %d" % len(builds)
+        if received[-1] == version:
+            return FakeResponse(304)
+        content = StringIO()
+        with gzip.GzipFile(fileobj=content, mode="wb") as fd:
+            json.dump({"builds": builds}, fd)
+        return FakeResponse(200, content.getvalue(), version)
+
+    monkeypatch.setattr(buildjson.transport, "get", get)
+    return received
+
+
+def test_builds_poller(monkeypatch):
+    now = time.time()
+    builds = [dict(JOB, request_ids=[1, 2], endtime=now - 100),
+              dict(JOB, request_ids=[3], endtime=now - 50)]
+    received = fake_4hr_server(monkeypatch, builds)
+    poller = buildjson.BuildsPoller(window=200, interval=60)
+
+    assert poller.poll() == 3
+    assert [job["request_ids"] for job in poller.jobs()] == [(1, 2), (3,)]
+    # We don't poll again until interval seconds have passed
+    assert poller.poll() == 0
+    assert poller.get(2)["endtime"] == now - 100
+    assert sorted(poller.lookup([1, 3])) == [1, 3]
+    assert received == [None]
+
+    # Unchanged files are not downloaded again
+    assert poller.poll(force=True) == 0
+    assert received == [None, "version 2"]
+
+    # A missing job makes us poll; old jobs are dropped
+    builds[0]["endtime"] = now - 300
+    builds.append(dict(JOB, request_ids=[4], endtime=now))
+    poller.last_poll = 0
+    assert sorted(poller.lookup([3, 4])) == [3, 4]
+    assert len(poller) == 2
+    assert poller.get(1) is None
+
+
+def test_day_file_is_indexed_once_by_concurrent_lookups(tmpdir, monkeypatch):
+    write_day_file(day_file(tmpdir, monkeypatch), [JOB])
+    written = []
+    write_index = buildjson._write_index
+
+    def slow_write_index(data_file, tmp_path, builds):
+        written.append(tmp_path)
+        time.sleep(0.1)
+        write_index(data_file, tmp_path, builds)
+
+    monkeypatch.setattr(buildjson, "_write_index", slow_write_index)
+    found = []
+    threads = [threading.Thread(target=lambda: found.append(
+        buildjson._query_day_file(DATE, [100]))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(written) == 1
+    assert [sorted(jobs) for jobs in found] == [[100]] * 4
+
+
+def test_query_jobs_data(tmpdir, monkeypatch):
+    write_day_file(day_file(tmpdir, monkeypatch), [JOB])
+    now = int(time.time())
+    fetched = fake_4hr_server(monkeypatch, [dict(JOB, request_ids=[200], endtime=now)])
+    monkeypatch.setattr(buildjson, "_STORE", {"store": None})
+    day = 1424649600 + 3600  # 2015-02-23 01:00:00 UTC
+    jobs = buildjson.query_jobs_data([(now, 200), (day, 100), (now, 201), (day, 101)])
+
+    # The 4 hour file is fetched once for both lookups
+    assert fetched == [None]
+    assert sorted(jobs) == [100, 101, 200, 201]
+    assert jobs[100] is not None and jobs[100]["endtime"] == 20
+    assert jobs[200]["request_ids"] == (200,)
+    assert jobs[201] is None
+
+
+def test_day_file_ttl():
+    # The file of 2015-02-23 is generated during that Pacific day
+    published = 1424678400  # 2015-02-23 00:00:00 PST
+    final = published + 24 * 60 * 60 + buildjson.DAY_FILE_INTERVAL
+    assert buildjson._day_file_ttl(DATE, published - 1) is None
+    assert buildjson._day_file_ttl(DATE, published) == buildjson.DAY_FILE_INTERVAL
+    assert buildjson._day_file_ttl(DATE, final + 100) == 100
+
+
+def test_job_store_covers_the_gap(monkeypatch):
+    queried = []
+
+    def query_day_file(date, request_ids):
+        queried.append((date, request_ids))
+        return {}
+
+    monkeypatch.setattr(buildjson, "_query_day_file", query_day_file)
+    store = buildjson.JobStore()
+    store.poller.last_poll = now = int(time.time())
+    # We polled this job when it ended; it is not in builds-4hr anymore
+    ended = now - 6 * 60 * 60
+    store.poller._merge([BuildjsonJob.from_json(dict(JOB, request_ids=[1], endtime=ended))])
+
+    midnight = 1424649600  # 2015-02-23 00:00:00 UTC
+    jobs = store.lookup([(ended, 1), (midnight + 3600, 2), (midnight - 60, 3)])
+    assert jobs[1]["endtime"] == ended
+    assert jobs[2] is None
+    # Near midnight we look in the files of both days
+    assert queried == [(DATE, [2, 3]), ("2015-02-22", [3])]
+
+
+def test_prefetch_days(tmpdir, monkeypatch):
+    monkeypatch.setattr(buildjson, "CACHE_DIR", str(tmpdir))
+
+    def download_buildjson_day_file(date):
+        if date == "2015-02-26":
+            raise Exception("Not published")
+        path = buildjson.buildjson_cache().path(buildjson._day_file_name(date))
+        if date == "2015-02-25":
+            with open(path, "w") as fd:
+                fd.write("not gzip")
+        else:
+            write_day_file(path, [dict(JOB, request_ids=[int(date[-2:])])])
+        return path
+
+    monkeypatch.setattr(buildjson, "_download_buildjson_day_file",
+                        download_buildjson_day_file)
+    paths = buildjson.prefetch_days("2015-02-23", "2015-02-26", workers=2, processes=2)
+
+    assert paths.keys() == [DATE, "2015-02-24", "2015-02-25", "2015-02-26"]
+    assert paths["2015-02-26"] is None
+    # The files were indexed by other processes, except the broken one
+    assert buildjson._lookup_index(paths["2015-02-24"], [24])[1][24]["endtime"] == 20
+    assert not buildjson._lookup_index(paths["2015-02-25"], [])[0]
+
+    with pytest.raises(ValueError):
+        buildjson.prefetch_days("2015-02-24", DATE)
+
+
+def endtime_jobs():
+    jobs = []
+    for i in range(10):
+        properties = dict(JOB["properties"], buildername="builder %d" % (i % 2))
+        jobs.append(dict(JOB, builder_id=i % 2, request_ids=[i], starttime=1000 - i,
+                         endtime=1000 + 10 * (9 - i), properties=properties))
+    # Jobs which have not finished are not indexed
+    return jobs + [dict(JOB, endtime=None)]
+
+
+def test_endtime_index():
+    index = buildjson.EndtimeIndex.from_builds(
+        BuildjsonJob.from_json(job) for job in endtime_jobs())
+    assert len(index) == 10
+    assert list(index.columns["endtime"]) == range(1000, 1100, 10)
+    assert list(index.columns["request_id"]) == range(9, -1, -1)
+
+    selected = index.select(1020, 1050)
+    assert list(selected["endtime"]) == [1020, 1030, 1040]
+    selected = index.select(1020, buildername="builder 0")
+    assert list(selected["request_id"]) == [6, 4, 2, 0]
+    assert list(index.select(2000)["endtime"]) == []
+
+    summary = index.summary(1010, 1050, percentiles=(0, 50, 100))
+    assert summary == {"jobs": 4, "min": 1010, "max": 1040,
+                       "percentiles": {0: 1010.0, 50: 1025.0, 100: 1040.0}}
+    # starttime is 1000 - request_id and endtime 1090 - 10 * request_id
+    summary = index.summary(column="duration", percentiles=(50,))
+    assert (summary["min"], summary["max"], summary["percentiles"]) == (9, 90, {50: 49.5})
+    assert index.summary(2000)["min"] is None
+
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_durations_need_a_starttime(monkeypatch, use_numpy):
+    if use_numpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(buildjson, "numpy", None)
+    jobs = [dict(JOB, request_ids=[1], starttime=None, endtime=1000),
+            dict(JOB, request_ids=[2], starttime=990, endtime=1010)]
+    index = buildjson.EndtimeIndex.from_builds(BuildjsonJob.from_json(job) for job in jobs)
+
+    summary = index.summary(column="duration", percentiles=(50,))
+    assert summary == {"jobs": 1, "min": 20, "max": 20, "percentiles": {50: 20.0}}
+    summary = index.summary(end=1005, column="duration", percentiles=(50,))
+    assert summary == {"jobs": 0, "min": None, "max": None, "percentiles": {50: None}}
+
+
+def test_endtime_index_is_kept(tmpdir, monkeypatch):
+    data_file = day_file(tmpdir, monkeypatch)
+    write_day_file(data_file, endtime_jobs())
+    assert len(buildjson.endtime_index(DATE)) == 10
+
+    def iter_builds(data_file):
+        raise AssertionError("We should have used the index")
+
+    monkeypatch.setattr(buildjson, "iter_builds", iter_builds)
+    # It does not depend on the format of the request_id index
+    monkeypatch.setattr(buildjson, "INDEX_VERSION", buildjson.INDEX_VERSION + 1)
+    index = buildjson.endtime_index(DATE)
+    assert index.buildernames == {0: "builder 0", 1: "builder 1"}
+    assert index.summary()["max"] == 1090
+
+
+def test_iter_builds(tmpdir, monkeypatch):
+    # Make sure values are split between chunks
+    monkeypatch.setattr(buildjson, "STREAM_CHUNK_SIZE", 7)
+    builds = [dict(JOB, request_ids=[i], endtime=i * 1000) for i in range(20)]
+    document = json.dumps({"slaves": {"1": "slave"}, "builds": builds, "masters": {}},
+                          indent=1)
+    plain_file = tmpdir.join("builds.js")
+    plain_file.write(document)
+    gzip_file = tmpdir.join("builds.js.gz")
+    with gzip.open(str(gzip_file), "wb") as fd:
+        fd.write(document)
+
+    for data_file in (str(plain_file), str(gzip_file)):
+        jobs = list(buildjson.iter_builds(data_file))
+        assert [job.to_dict() for job in jobs] == \
+            [BuildjsonJob.from_json(job).to_dict() for job in builds]
+
+        selected = buildjson.iter_builds(data_file, lambda job: job["endtime"] >= 5000)
+        assert [job["endtime"] for job in selected] == range(5000, 20000, 1000)
+
+
+def test_iter_builds_with_numbers_split_between_chunks(tmpdir, monkeypatch):
+    data_file = tmpdir.join("builds.js")
+    data_file.write('{"n": 1.25, "m": [-2e3, 22], "builds": [%s]}' % json.dumps(JOB))
+    for chunk_size in range(1, 12):
+        monkeypatch.setattr(buildjson, "STREAM_CHUNK_SIZE", chunk_size)
+        assert [job["endtime"] for job in buildjson.iter_builds(str(data_file))] == [20]
+
+
+def test_iter_builds_stops_early(tmpdir):
+    data_file = tmpdir.join("builds.js")
+    # Everything after the first job is garbage which we should not read
+    data_file.write('{"builds": [%s, garbage' % json.dumps(JOB))
+    assert next(buildjson.iter_builds(str(data_file)))["endtime"] == 20
+
+    data_file.write('{"builds": []}')
+    assert list(buildjson.iter_builds(str(data_file))) == []
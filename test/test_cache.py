@@ -0,0 +1,87 @@
+"""
+Tests for mozci.utils.cache
+"""
+import os
+
+from mozci.utils import cache
+from mozci.utils.download import file_lock
+
+
+def fake_fetch_file(downloads):
+    ''' A fetch_file which writes 10 bytes unless the file exists. '''
+    def fetch_file(url, filename, ttl=None, decode_content=True):
+        if os.path.exists(filename):
+            return False
+        downloads.append(url)
+        with open(filename, "w") as fd:
+            fd.write("x" * 10)
+        return True
+
+    return fetch_file
+
+
+def use(disk_cache, name, when):
+    path = disk_cache.path(name)
+    os.utime(path, (when, os.path.getmtime(path)))
+
+
+def test_least_recently_used_entries_are_evicted(tmpdir, monkeypatch):
+    downloads = []
+    monkeypatch.setattr(cache, "fetch_file", fake_fetch_file(downloads))
+    disk_cache = cache.DiskCache(str(tmpdir.join("cache")), max_bytes=25)
+
+    disk_cache.fetch("a", "url/a")
+    # Derived files count towards the size of their entry
+    tmpdir.join("cache", "a.index").write("x" * 5)
+    disk_cache.fetch("b", "url/b")
+    assert disk_cache.fetch("a", "url/a") == disk_cache.path("a")
+    use(disk_cache, "a", 1000)
+    use(disk_cache, "b", 2000)
+
+    # There is only room for 2 files; "a" was used the longest time ago
+    disk_cache.fetch("c", "url/c")
+    assert sorted(os.listdir(disk_cache.directory)) == ["b", "c"]
+    assert downloads == ["url/a", "url/b", "url/c"]
+
+    stats = disk_cache.stats()
+    assert (stats["entries"], stats["bytes"]) == (2, 20)
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 3, 0.25)
+
+
+def test_old_entries_are_evicted(tmpdir, monkeypatch):
+    monkeypatch.setattr(cache, "fetch_file", fake_fetch_file([]))
+    disk_cache = cache.DiskCache(str(tmpdir), max_age=60)
+
+    disk_cache.fetch("a", "url/a")
+    use(disk_cache, "a", 1000)
+    disk_cache.fetch("b", "url/b")
+    assert os.listdir(str(tmpdir)) == ["b"]
+
+
+def test_side_files_belong_to_their_entry(tmpdir, monkeypatch):
+    monkeypatch.setattr(cache, "fetch_file", fake_fetch_file([]))
+    disk_cache = cache.DiskCache(str(tmpdir), max_age=60)
+    disk_cache.fetch("a.gz", "url/a")
+    for filename in ("a.gz.headers", "a.gz.lock", "a.gz.index", "a.gz.index.lock"):
+        tmpdir.join(filename).write("")
+    # A download in progress only has side files
+    for filename in ("b.gz.part", "b.gz.headers", "b.gz.lock"):
+        tmpdir.join(filename).write("x")
+
+    entries = dict((name, sorted(files)) for name, files, _, _ in disk_cache._entries())
+    assert entries == {
+        "a.gz": ["a.gz", "a.gz.headers", "a.gz.index", "a.gz.index.lock", "a.gz.lock"],
+        "b.gz": ["b.gz.headers", "b.gz.lock", "b.gz.part"],
+    }
+
+    # Entries whose lock is held are not evicted
+    use(disk_cache, "a.gz", 1000)
+    with file_lock(disk_cache.path("a.gz.index.lock")):
+        with file_lock(disk_cache.path("b.gz.lock")):
+            disk_cache.evict()
+    assert len(os.listdir(str(tmpdir))) == 8
+
+    # Lock files are never removed; they are not entries on their own
+    disk_cache.evict()
+    assert sorted(os.listdir(str(tmpdir))) == ["a.gz.index.lock", "a.gz.lock", "b.gz.lock"]
+    assert disk_cache.stats()["entries"] == 0
@@ -0,0 +1,171 @@
+"""
+Tests for mozci.utils.download
+"""
+import os
+
+import pytest
+
+from mozci.utils import download
+
+URL = "http://server/file.json"
+CONTENT = "0123456789"
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, content="", headers=None, interrupted=False):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.interrupted = interrupted
+        self.raw = self
+
+    def iter_content(self, chunk_size):
+        yield self.content
+        if self.interrupted:
+            raise IOError("The connection was reset")
+
+    def stream(self, chunk_size, decode_content):
+        return self.iter_content(chunk_size)
+
+    def close(self):
+        pass
+
+
+def fake_server(monkeypatch, responses):
+    ''' A transport.get which returns responses in order; it returns the
+    list of headers of the requests it receives. '''
+    received = []
+    responses = iter(responses)
+
+    def get(url, headers=None, stream=False, auth=None):
+        assert url == URL
+        received.append(headers)
+        return next(responses)
+
+    monkeypatch.setattr(download.transport, "get", get)
+    return received
+
+
+def full_response(content=CONTENT):
+    return FakeResponse(200, content, {"etag": '"v1"', "content-length": str(len(content))})
+
+
+def test_fresh_files_are_not_validated(tmpdir, monkeypatch):
+    filename = str(tmpdir.join("file.json"))
+    received = fake_server(monkeypatch, [full_response()])
+
+    assert download.fetch_file(URL, filename, ttl=60)
+    assert not download.fetch_file(URL, filename, ttl=60)
+    assert received == [{}]
+
+
+def test_unchanged_files_are_not_downloaded_again(tmpdir, monkeypatch):
+    filename = str(tmpdir.join("file.json"))
+    received = fake_server(monkeypatch, [full_response(), FakeResponse(304)])
+
+    assert download.fetch_file(URL, filename)
+    os.utime(filename, (1, 1))
+    assert not download.fetch_file(URL, filename)
+
+    assert received[1] == {"If-None-Match": '"v1"'}
+    assert tmpdir.join("file.json").read() == CONTENT
+    # The copy counts as validated now
+    assert download.is_fresh(filename, 60)
+
+
+def test_interrupted_downloads_are_resumed(tmpdir, monkeypatch):
+    filename = str(tmpdir.join("file.json"))
+    incomplete = full_response()
+    incomplete.content = CONTENT[:4]
+    received = fake_server(monkeypatch, [
+        incomplete,
+        FakeResponse(206, CONTENT[4:], {"etag": '"v1"', "content-length": "6"}),
+    ])
+
+    with pytest.raises(Exception):
+        download.fetch_file(URL, filename)
+    assert not os.path.exists(filename)
+
+    assert download.fetch_file(URL, filename)
+    assert received[1] == {"Range": "bytes=4-", "If-Range": '"v1"'}
+    assert tmpdir.join("file.json").read() == CONTENT
+    assert not os.path.exists(filename + ".part")
+
+
+def test_rejected_resumes_start_from_scratch(tmpdir, monkeypatch):
+    filename = str(tmpdir.join("file.json"))
+    incomplete = full_response()
+    incomplete.content = CONTENT[:4]
+    received = fake_server(monkeypatch, [
+        incomplete,
+        FakeResponse(416),
+        full_response("new content"),
+    ])
+
+    with pytest.raises(Exception):
+        download.fetch_file(URL, filename)
+    assert download.fetch_file(URL, filename)
+
+    assert received[1] == {"Range": "bytes=4-", "If-Range": '"v1"'}
+    assert received[2] == {}
+    assert tmpdir.join("file.json").read() == "new content"
+
+
+def test_decoded_downloads_start_from_scratch(tmpdir, monkeypatch):
+    filename = str(tmpdir.join("file.json"))
+    gzip_headers = {"etag": '"v1"', "content-encoding": "gzip"}
+    received = fake_server(monkeypatch, [
+        FakeResponse(200, CONTENT[:4], gzip_headers, interrupted=True),
+        FakeResponse(200, CONTENT, gzip_headers),
+    ])
+
+    with pytest.raises(IOError):
+        download.fetch_file(URL, filename)
+    assert os.path.exists(filename + ".part")
+
+    # The decoded bytes do not match a range of the encoded body
+    assert download.fetch_file(URL, filename)
+    assert received[1] == {}
+    assert tmpdir.join("file.json").read() == CONTENT
+
+
+def test_raw_downloads_are_resumed(tmpdir, monkeypatch):
+    filename = str(tmpdir.join("file.json.gz"))
+    received = fake_server(monkeypatch, [
+        FakeResponse(200, CONTENT[:4], {"etag": '"v1"', "content-encoding": "gzip",
+                                        "content-length": "10"}, interrupted=True),
+        FakeResponse(206, CONTENT[4:], {"etag": '"v1"', "content-encoding": "gzip",
+                                        "content-length": "6"}),
+    ])
+
+    with pytest.raises(IOError):
+        download.fetch_file(URL, filename, decode_content=False)
+    assert download.fetch_file(URL, filename, decode_content=False)
+    assert received[1] == {"Range": "bytes=4-", "If-Range": '"v1"'}
+    assert tmpdir.join("file.json.gz").read() == CONTENT
+
+
+def test_encoded_ranges_are_not_appended(tmpdir, monkeypatch):
+    filename = str(tmpdir.join("file.json"))
+    received = fake_server(monkeypatch, [
+        FakeResponse(200, CONTENT[:4], {"etag": '"v1"'}, interrupted=True),
+        FakeResponse(206, "gzip bytes", {"etag": '"v1"', "content-encoding": "gzip"}),
+        full_response(),
+    ])
+
+    with pytest.raises(IOError):
+        download.fetch_file(URL, filename)
+    assert download.fetch_file(URL, filename)
+    assert received[1] == {"Range": "bytes=4-", "If-Range": '"v1"'}
+    assert received[2] == {}
+    assert tmpdir.join("file.json").read() == CONTENT
+
+
+def test_file_lock_without_waiting(tmpdir):
+    lock_path = str(tmpdir.join("file.json.lock"))
+    with download.file_lock(lock_path) as locked:
+        assert locked
+        with download.file_lock(lock_path, blocking=False) as locked_again:
+            assert not locked_again
+    with download.file_lock(lock_path, blocking=False) as locked:
+        assert locked
@@ -0,0 +1,51 @@
+"""
+Tests for mozci.sources.buildapi.JobSchedule
+"""
+from mozci.sources import buildapi
+
+JOBS = [
+    {"buildername": "build"},
+    {"buildername": "build", "status": None, "endtime": 1},
+    {"buildername": "build", "status": buildapi.SUCCESS},
+    {"buildername": "test", "status": buildapi.FAILURE},
+    {"buildername": "test", "status": buildapi.WARNING},
+    {"buildername": "test", "status": buildapi.SUCCESS},
+    # Statuses buildapi is not expected to give us are counted as unknown
+    {"buildername": "test", "status": buildapi.SKIPPED},
+]
+
+
+def test_index():
+    schedule = buildapi.JobSchedule(JOBS)
+    assert len(schedule) == len(JOBS)
+    assert sorted(schedule.buildernames()) == ["build", "test"]
+    assert "build" in schedule
+    assert "other" not in schedule
+    assert [job.to_dict() for job in schedule.jobs_of("build")] == JOBS[:3]
+    assert schedule.jobs_of("other") == []
+
+
+def test_counts():
+    schedule = buildapi.JobSchedule(JOBS)
+    assert schedule.count("test") == 4
+    assert schedule.count("test", buildapi.UNKNOWN) == 1
+    assert schedule.count("build", buildapi.PENDING, buildapi.RUNNING) == 2
+    assert schedule.status_counts("build") == \
+        {"pending": 1, "running": 1, "successful": 1, "failed": 0}
+    assert schedule.status_counts("test") == \
+        {"pending": 0, "running": 0, "successful": 1, "failed": 2}
+    assert schedule.status_counts("other") == \
+        {"pending": 0, "running": 0, "successful": 0, "failed": 0}
+
+
+def test_records():
+    job = buildapi.BuildapiJob.from_json({
+        "buildername": "build", "status": None, "endtime": 1, "claimed_by_name": "master",
+        "requests": [{"request_id": 2, "complete_at": 3, "reason": "retrigger"}]})
+    assert job["buildername"] == "build"
+    assert job["requests"][0]["complete_at"] == 3
+    assert job.get("claimed_by_name") is None
+    assert "starttime" not in job
+    assert buildapi.query_job_status(job) == buildapi.RUNNING
+    assert buildapi.query_job_status(buildapi.BuildapiJob.from_json(JOBS[0])) == \
+        buildapi.PENDING
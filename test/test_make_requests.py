@@ -0,0 +1,69 @@
+"""
+Tests for mozci.sources.buildapi.make_requests
+"""
+import itertools
+import threading
+
+import requests
+
+from mozci.sources import buildapi
+from mozci.utils import transport
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, request_id=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.reason = "fake"
+        self.text = ""
+        self._request_id = request_id
+
+    def json(self):
+        return {"request_id": self._request_id}
+
+    def close(self):
+        pass
+
+
+def fake_post(responses):
+    ''' A transport.post which returns responses (or raises them) in order. '''
+    lock = threading.Lock()
+    iterator = iter(responses)
+
+    def post(url, **kwargs):
+        with lock:
+            response = next(iterator)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    return post
+
+
+def patch_self_serve(monkeypatch, responses):
+    monkeypatch.setattr(buildapi, "get_credentials", lambda: ("user", "password"))
+    monkeypatch.setattr(buildapi, "TRIGGER_RATE", 1000)
+    monkeypatch.setattr(buildapi, "TRIGGER_BURST", 1000)
+    monkeypatch.setattr(transport, "backoff", lambda attempt: 0)
+    monkeypatch.setattr(transport, "post", fake_post(responses))
+
+
+def test_requests_are_retried_on_server_errors(monkeypatch):
+    patch_self_serve(monkeypatch,
+                     [FakeResponse(503), FakeResponse(502), FakeResponse(202, 1)])
+
+    req = buildapi.make_request("url", {})
+    assert req.status_code == 202
+
+
+def test_make_requests_returns_responses(monkeypatch):
+    counter = itertools.count(1)
+    patch_self_serve(monkeypatch,
+                     [FakeResponse(202, next(counter)) for _ in range(4)] +
+                     [FakeResponse(500), requests.ConnectionError("boom")])
+    monkeypatch.setattr(buildapi, "TRIGGER_RETRIES", 0)
+
+    list_of_requests = buildapi.make_requests("url", {}, 6)
+    assert len(list_of_requests) == 5
+    assert sorted(buildapi._request_id(req) for req in list_of_requests) == \
+        [None, 1, 2, 3, 4]
@@ -0,0 +1,86 @@
+"""
+Tests for mozci.utils.memo
+"""
+import threading
+
+from mozci.utils import memo
+
+CALLS = []
+
+
+@memo.memoized("square")
+def square(value):
+    CALLS.append(value)
+    return value * value
+
+
+def setup_function(function):
+    del CALLS[:]
+
+
+def test_no_memoization_outside_of_a_scope():
+    square(2)
+    square(2)
+    assert CALLS == [2, 2]
+
+
+def test_memoization_within_a_scope():
+    with memo.run_scope():
+        assert square(2) == 4
+        assert square(2) == 4
+        assert square(3) == 9
+    assert CALLS == [2, 3]
+
+    # The cache is emptied once the scope is over
+    square(2)
+    assert CALLS == [2, 3, 2]
+
+
+def test_invalidate():
+    with memo.run_scope():
+        square(2)
+        square(3)
+        memo.invalidate("square", 2)
+        square(2)
+        square(3)
+    assert CALLS == [2, 3, 2]
+
+
+def in_thread(function, *args):
+    thread = threading.Thread(target=function, args=args)
+    thread.start()
+    thread.join()
+
+
+def test_scopes_belong_to_their_run():
+    with memo.run_scope():
+        square(2)
+        # Other threads are not part of the run
+        in_thread(square, 2)
+        in_thread(memo.bind(square), 2)
+        square(2)
+    assert CALLS == [2, 2]
+
+
+def test_concurrent_runs_have_their_own_cache():
+    started = threading.Event()
+    finished = threading.Event()
+
+    def other_run():
+        with memo.run_scope():
+            square(3)
+            started.set()
+            finished.wait(10)
+            square(3)
+
+    thread = threading.Thread(target=other_run)
+    thread.start()
+    started.wait(10)
+    with memo.run_scope():
+        square(3)
+    finished.set()
+    thread.join()
+
+    # Our run is over but the other one still remembers its result
+    assert CALLS == [3, 3]
+    assert not memo.active()
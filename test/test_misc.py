@@ -0,0 +1,60 @@
+"""
+Tests for mozci.utils.misc
+"""
+import logging
+import threading
+
+import pytest
+
+from mozci.utils.misc import ThreadLogBuffer
+
+LOG = logging.getLogger()
+
+
+def test_thread_log_buffer(caplog):
+    caplog.set_level(logging.INFO)
+    records = {}
+    second_done = threading.Event()
+
+    def work(name, wait=None):
+        with log_buffer.capture() as records[name]:
+            if wait is not None:
+                wait.wait(10)
+            LOG.info("%s worked" % name)
+            if name == "second":
+                second_done.set()
+                raise ValueError("boom")
+
+    def failing_work():
+        try:
+            work("second")
+        except ValueError:
+            pass
+
+    with ThreadLogBuffer() as log_buffer:
+        threads = [threading.Thread(target=work, args=("first", second_done)),
+                   threading.Thread(target=failing_work)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Nothing was emitted while the threads were working
+        assert [r.getMessage() for r in caplog.records] == []
+
+        LOG.info("main thread")
+        log_buffer.replay(records["first"])
+        log_buffer.replay(records["second"])
+
+    # The records come out in the order we replay them, even those of the
+    # thread which failed, and the buffers of the threads are gone
+    assert [r.getMessage() for r in caplog.records] == \
+        ["main thread", "first worked", "second worked"]
+    assert log_buffer._buffers == {}
+
+
+def test_thread_log_buffer_capture_is_cleaned_up_on_errors():
+    log_buffer = ThreadLogBuffer()
+    with pytest.raises(ValueError):
+        with log_buffer.capture():
+            raise ValueError("boom")
+    assert log_buffer._buffers == {}
@@ -38,3 +38,17 @@ class TestQueries:
         '''A repository not in the JSON file must trigger an exception'''
         with pytest.raises(Exception):
             mozci.mozci.query_repository('not-a-repo')
+
+
+def test_query_builders_matching(monkeypatch):
+    '''Wildcards match whole names; regular expressions are searched for'''
+    builders = ["mozilla-inbound build", "Linux mozilla-inbound build",
+                "WINNT 5.2 mozilla-inbound build", "Linux mozilla-inbound test"]
+    monkeypatch.setattr(mozci.mozci, "query_builders", lambda: builders)
+
+    assert mozci.mozci.query_builders_matching("mozilla-inbound build") == \
+        ["mozilla-inbound build"]
+    assert mozci.mozci.query_builders_matching("Linux *") == \
+        ["Linux mozilla-inbound build", "Linux mozilla-inbound test"]
+    assert mozci.mozci.query_builders_matching("inbound b", regex=True) == \
+        sorted(builders[:3])
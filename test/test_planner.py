@@ -0,0 +1,168 @@
+"""
+Tests for mozci.mozci.plan_triggers
+"""
+import json
+import logging
+import time
+
+import pytest
+
+from mozci import mozci
+from mozci.utils import memo
+
+BUILD = "Platform repo build"
+TEST_1 = "Platform repo opt test suite-1"
+TEST_2 = "Platform repo opt test suite-2"
+FILES = ["http://server/installer", "http://server/tests.zip"]
+BUILD_DATA = {"properties": {"buildername": BUILD,
+                             "packageUrl": FILES[0],
+                             "testsUrl": FILES[1]}}
+
+SCHEDULES = {
+    # The build job finished; its files can be used
+    "rev1": [{"buildername": BUILD, "status": 0, "endtime": 1,
+              "requests": [{"complete_at": 1, "request_id": 1}]},
+             {"buildername": TEST_1, "status": 0, "endtime": 2}],
+    # There is no build job
+    "rev2": [],
+    # The build job is running
+    "rev3": [{"buildername": BUILD, "status": None, "endtime": 1}],
+}
+
+
+class Fetched(list):
+    ''' The revisions whose schedule was fetched. '''
+    buildjson_lookups = None
+
+
+@pytest.fixture
+def schedules(monkeypatch):
+    fetched = Fetched()
+    buildjson_lookups = []
+
+    def query_jobs_data(lookups):
+        buildjson_lookups.append(sorted(lookups))
+        return dict((request_id, BUILD_DATA) for _, request_id in lookups)
+
+    def query_job_data(complete_at, request_id):
+        raise AssertionError("We should have queried buildjson in one go")
+
+    def query_jobs_schedule(repo_name, revision):
+        fetched.append(revision)
+        return SCHEDULES[revision]
+
+    monkeypatch.setattr(mozci, "valid_builder", lambda buildername: True)
+    monkeypatch.setattr(mozci, "determine_upstream_builders",
+                        lambda buildernames, repo_name: dict(
+                            (b, BUILD) for b in buildernames))
+    monkeypatch.setattr(mozci, "_all_urls_reachable", lambda urls: True)
+    monkeypatch.setattr(mozci.buildapi, "valid_revision", lambda repo_name, revision: True)
+    monkeypatch.setattr(mozci.buildapi, "query_jobs_schedule", query_jobs_schedule)
+    monkeypatch.setattr(mozci.buildjson, "query_jobs_data", query_jobs_data)
+    monkeypatch.setattr(mozci.buildjson, "query_job_data", query_job_data)
+    fetched.buildjson_lookups = buildjson_lookups
+    return fetched
+
+
+def test_plan_triggers(schedules):
+    goals = [(b, rev, times) for rev in ("rev1", "rev2", "rev3")
+             for b, times in ((TEST_1, 2), (TEST_2, 3))]
+    plan = mozci.plan_triggers("repo", goals)
+
+    # Every schedule is fetched once
+    assert schedules == ["rev1", "rev2", "rev3"]
+    assert schedules.buildjson_lookups == [[(1, 1)]]
+    # The plan can be serialized
+    assert json.loads(json.dumps(plan)) == plan
+
+    triggers = [(t["revision"], t["buildername"], t["times"], t["files"])
+                for t in plan["triggers"]]
+    assert triggers == [
+        ("rev1", TEST_1, 1, FILES),
+        ("rev1", TEST_2, 3, FILES),
+        # One build serves both test jobs
+        ("rev2", BUILD, 3, None),
+    ]
+    assert plan["triggers"][2]["goals"] == [TEST_1, TEST_2]
+    assert [g["status"] for g in plan["goals"]] == \
+        ["triggered"] * 4 + ["waiting"] * 2
+
+
+def test_satisfied_goals_trigger_nothing(schedules):
+    plan = mozci.plan_triggers("repo", [(TEST_1, "rev1", 1)])
+    assert plan["triggers"] == []
+    assert plan["goals"][0]["successful"] == 1
+    assert plan["goals"][0]["status"] == "satisfied"
+    assert "Nothing needs to be triggered" in mozci.format_plan(plan)
+
+
+def test_trigger_range_with_many_builders(schedules):
+    results = mozci.trigger_range([TEST_1, TEST_2, TEST_1], "repo", ["rev1", "rev2"], 2,
+                                  dry_run=True)
+
+    assert schedules == ["rev1", "rev2"]
+    assert schedules.buildjson_lookups == [[(1, 1)]]
+    assert [(r["revision"], r["buildername"], r["trigger"], r["missing"]) for r in results] == [
+        ("rev1", TEST_1, TEST_1, 1),
+        ("rev1", TEST_2, TEST_2, 2),
+        ("rev2", TEST_1, BUILD, 2),
+        ("rev2", TEST_2, BUILD, 2),
+    ]
+
+
+def test_trigger_range_in_parallel(schedules, caplog, monkeypatch):
+    caplog.set_level(logging.INFO)
+    revisions = ["rev1", "rev2", "dontbuild", "rev3", "unknown"]
+    query_jobs_schedule = mozci.buildapi.query_jobs_schedule
+
+    @memo.memoized("valid_revision")
+    def valid_revision(repo_name, revision):
+        logging.info("checked %s" % revision)
+        return revision != "dontbuild"
+
+    def slow_query_jobs_schedule(repo_name, revision):
+        # The first revisions are the last ones to be done
+        if revision in revisions:
+            time.sleep(0.05 * (len(revisions) - revisions.index(revision)))
+        logging.info("fetched %s" % revision)
+        return query_jobs_schedule(repo_name, revision)
+
+    monkeypatch.setattr(mozci.buildapi, "valid_revision", valid_revision)
+    monkeypatch.setattr(mozci.buildapi, "query_jobs_schedule", slow_query_jobs_schedule)
+
+    def run(jobs):
+        del caplog.records[:]
+        results = mozci.trigger_range([TEST_1, TEST_2], "repo", revisions, 2,
+                                      dry_run=True, jobs=jobs)
+        messages = [r.getMessage() for r in caplog.records
+                    if r.getMessage().split(" ")[0] in ("===", "checked", "fetched")]
+        return [(r["revision"], r["buildername"], r["trigger"], r["missing"],
+                 r["skipped"] is not None, r["error"] is not None) for r in results], messages
+
+    serial = run(1)
+    parallel = run(3)
+    assert parallel == serial
+    # The revision we skip and the one we could not query only affect themselves
+    assert [r[4:] for r in parallel[0]] == \
+        [(False, False)] * 4 + [(True, False)] * 2 + [(False, False)] * 2 + [(False, True)] * 2
+    # The log records of every revision come out in its section, in the
+    # order of the revisions, including those of fetching its data up front
+    assert parallel[1] == [
+        "=== rev1 ===", "checked rev1", "fetched rev1",
+        "=== rev2 ===", "checked rev2", "fetched rev2",
+        "=== dontbuild ===", "checked dontbuild",
+        "=== rev3 ===", "checked rev3", "fetched rev3",
+        # Planning tries again to fetch the schedule we could not fetch
+        "=== unknown ===", "checked unknown", "fetched unknown", "fetched unknown",
+    ]
+
+
+def test_skipped_revisions_say_why(schedules, monkeypatch):
+    monkeypatch.setattr(mozci.buildapi, "valid_revision", lambda repo_name, revision: False)
+    results = mozci.trigger_range(TEST_1, "repo", ["rev1"], 1, dry_run=True)
+    assert results[0]["skipped"] == "The revision does not exist in self-serve (DONTBUILD)"
+    assert results[0]["error"] is None
+
+    plan = mozci.plan_triggers("repo", [(TEST_1, "rev1", 1)])
+    assert plan["goals"][0]["status"] == "skipped"
+    assert plan["goals"][0]["reason"] == results[0]["skipped"]
@@ -0,0 +1,166 @@
+"""
+Tests for the build <-> test graph of mozci.platforms. We build the tables
+from a small hand-made allthethings.json so we don't need the network.
+"""
+import logging
+
+import pytest
+
+import mozci.platforms
+
+BUILD = "Linux x86-64 mozilla-inbound build"
+PGO_BUILD = "Linux x86-64 mozilla-inbound pgo-build"
+NIGHTLY = "Linux x86-64 mozilla-inbound nightly"
+WIN_BUILD = "WINNT 5.2 mozilla-inbound build"
+CENTRAL_NIGHTLY = "Linux x86-64 mozilla-central nightly"
+TEST_1 = "Ubuntu VM 12.04 x64 mozilla-inbound opt test mochitest-1"
+TEST_2 = "Ubuntu VM 12.04 x64 mozilla-inbound opt test mochitest-2"
+PGO_TEST = "Ubuntu VM 12.04 x64 mozilla-inbound pgo test mochitest-1"
+TALOS = "Ubuntu HW 12.04 x64 mozilla-inbound talos chromez"
+CENTRAL_TEST = "Ubuntu VM 12.04 x64 mozilla-central opt test mochitest-1"
+# No build job has the shortname its trigger points to
+ORPHAN_TEST = "Rev5 MacOSX Yosemite 10.10 mozilla-inbound opt test mochitest-1"
+
+
+def builder(shortname, platform, repo_name, slavebuilddir="build"):
+    return {"shortname": shortname,
+            "properties": {"platform": platform,
+                           "repo_path": "integration/%s" % repo_name,
+                           "slavebuilddir": slavebuilddir}}
+
+
+def unittest_builder(platform, repo_name):
+    return builder("", platform, repo_name, slavebuilddir="test")
+
+
+DATA = {
+    "builders": {
+        BUILD: builder("mozilla-inbound-linux64", "linux64", "mozilla-inbound"),
+        PGO_BUILD: builder("mozilla-inbound-linux64-pgo", "linux64", "mozilla-inbound"),
+        # The nightly build shares its shortname with the build above
+        NIGHTLY: builder("mozilla-inbound-linux64", "linux64", "mozilla-inbound"),
+        WIN_BUILD: builder("mozilla-inbound-win32", "win32", "mozilla-inbound"),
+        # This one is the only build job with its shortname
+        CENTRAL_NIGHTLY: builder("mozilla-central-linux64", "linux64", "mozilla-central"),
+        TEST_1: unittest_builder("linux64", "mozilla-inbound"),
+        TEST_2: unittest_builder("linux64", "mozilla-inbound"),
+        PGO_TEST: unittest_builder("linux64", "mozilla-inbound"),
+        TALOS: unittest_builder("linux64", "mozilla-inbound"),
+        CENTRAL_TEST: unittest_builder("linux64", "mozilla-central"),
+        ORPHAN_TEST: unittest_builder("macosx64", "mozilla-inbound"),
+    },
+    "schedulers": {
+        "tests-mozilla-inbound-ubuntu64_vm-opt-unittest": {
+            "downstream": [TEST_2, TEST_1],
+            "triggered_by": ["mozilla-inbound-linux64-opt-unittest"]},
+        "tests-mozilla-inbound-ubuntu64_vm-pgo-unittest": {
+            "downstream": [PGO_TEST],
+            "triggered_by": ["mozilla-inbound-linux64-pgo-unittest"]},
+        "tests-mozilla-inbound-ubuntu64_hw-opt-talos": {
+            "downstream": [TALOS],
+            "triggered_by": ["mozilla-inbound-linux64-talos"]},
+        "tests-mozilla-central-ubuntu64_vm-opt-unittest": {
+            "downstream": [CENTRAL_TEST],
+            "triggered_by": ["mozilla-central-linux64-opt-unittest"]},
+        "tests-mozilla-inbound-yosemite-opt-unittest": {
+            "downstream": [ORPHAN_TEST],
+            "triggered_by": ["mozilla-inbound-macosx64-opt-unittest"]},
+        # Only test schedulers connect builders
+        "mozilla-inbound": {
+            "downstream": [BUILD, PGO_BUILD],
+            "triggered_by": []},
+    },
+}
+
+
+class FakeRegistry(object):
+    data = DATA
+    schedulers = DATA["schedulers"]
+
+
+@pytest.fixture(autouse=True)
+def fake_tables(monkeypatch):
+    tables = mozci.platforms._build_platform_tables(FakeRegistry())
+    monkeypatch.setattr(mozci.platforms, "_platform_tables", lambda: tables)
+    return tables
+
+
+@pytest.mark.parametrize("buildername, expected", [
+    (BUILD, [TALOS, TEST_1, TEST_2]),
+    (PGO_BUILD, [PGO_TEST]),
+    (CENTRAL_NIGHTLY, [CENTRAL_TEST]),
+    # The nightly build could not claim the shortname of BUILD
+    (NIGHTLY, []),
+    (WIN_BUILD, []),
+    # Test jobs do not trigger anything
+    (TEST_1, []),
+    ("Unknown mozilla-inbound build", []),
+])
+def test_determine_downstream_builders(buildername, expected):
+    assert mozci.platforms.determine_downstream_builders(buildername) == expected
+
+
+def test_downstream_builders_are_copies():
+    mozci.platforms.determine_downstream_builders(BUILD).append("extra")
+    assert "extra" not in mozci.platforms.determine_downstream_builders(BUILD)
+
+
+@pytest.mark.parametrize("repo_name, platform, expected", [
+    ("mozilla-inbound", "linux64", [BUILD, NIGHTLY, PGO_BUILD, TALOS, TEST_1, TEST_2,
+                                    PGO_TEST]),
+    ("mozilla-inbound", "win32", [WIN_BUILD]),
+    ("mozilla-central", "linux64", [CENTRAL_NIGHTLY, CENTRAL_TEST]),
+    ("mozilla-central", "win32", []),
+    ("try", "linux64", []),
+])
+def test_find_builders(repo_name, platform, expected):
+    assert sorted(mozci.platforms.find_builders(repo_name, platform)) == sorted(expected)
+
+
+@pytest.mark.parametrize("shortname, expected", [
+    # A nightly build never takes the shortname of another build job...
+    ("mozilla-inbound-linux64", BUILD),
+    # ...but it is used when it is the only one with it
+    ("mozilla-central-linux64", CENTRAL_NIGHTLY),
+    ("mozilla-inbound-linux64-pgo", PGO_BUILD),
+    # Test jobs have no shortname entry
+    ("", None),
+])
+def test_nightly_shortnames(fake_tables, shortname, expected):
+    assert fake_tables["shortname_to_name"].get(shortname) == expected
+
+
+@pytest.mark.parametrize("buildername, expected", [
+    (TEST_1, BUILD),
+    (TALOS, BUILD),
+    (PGO_TEST, PGO_BUILD),
+    (CENTRAL_TEST, CENTRAL_NIGHTLY),
+    # Build jobs and builders we don't know are their own build job
+    (BUILD, BUILD),
+    ("Unknown mozilla-inbound build", "Unknown mozilla-inbound build"),
+    (ORPHAN_TEST, None),
+])
+def test_determine_upstream_builders(buildername, expected):
+    assert mozci.platforms.determine_upstream_builders([buildername]) == {buildername: expected}
+
+
+def test_unresolved_upstream_builders_are_reported_together(caplog):
+    caplog.set_level(logging.WARNING)
+    upstream = mozci.platforms.determine_upstream_builders(
+        [TEST_1, ORPHAN_TEST, BUILD, PGO_TEST], "mozilla-inbound")
+
+    assert upstream == {TEST_1: BUILD, ORPHAN_TEST: None, BUILD: BUILD, PGO_TEST: PGO_BUILD}
+    assert [r.getMessage() for r in caplog.records] == [
+        "We could not determine the build job of 1 builder(s): %s" % ORPHAN_TEST]
+
+
+def test_resolved_upstream_builders_are_not_reported(caplog):
+    caplog.set_level(logging.WARNING)
+    assert mozci.platforms.determine_upstream_builders([TEST_1, TEST_2]) == \
+        {TEST_1: BUILD, TEST_2: BUILD}
+    assert caplog.records == []
+
+
+def test_upstream_builders_of_another_repository():
+    with pytest.raises(AssertionError):
+        mozci.platforms.determine_upstream_builders([TEST_1, CENTRAL_TEST], "mozilla-inbound")
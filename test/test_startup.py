@@ -0,0 +1,33 @@
+"""
+Importing mozci should be cheap: it must not touch the network nor load
+allthethings.json. See scripts/misc/benchmark_import.py for timings.
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SCRIPT = '''
+import socket
+import sys
+
+
+def no_network(*args, **kwargs):
+    raise AssertionError("Importing mozci should not use the network.")
+
+socket.socket.connect = no_network
+
+import mozci.mozci
+from mozci.sources.allthethings import REGISTRY
+
+assert REGISTRY.digest is None, "allthethings.json was loaded."
+assert "bs4" not in sys.modules, "bs4 should only be imported when needed."
+'''
+
+
+def test_import_does_no_io(tmpdir):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    subprocess.check_call([sys.executable, "-c", IMPORT_SCRIPT],
+                          cwd=str(tmpdir), env=env)
+    assert tmpdir.listdir() == []